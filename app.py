@@ -1,13 +1,34 @@
+import time
+APP_STARTED = time.perf_counter()
+
 import os
+from itertools import zip_longest
 from dotenv import load_dotenv
 
-import hopsworks
 import streamlit as st
 
-from sentence_transformers import SentenceTransformer
-from openai import OpenAI
-
-from functions.prompt_engineering import get_reranker, get_context_and_source, get_answer_from_gemini, get_answer_from_gpt
+from functions.prompt_engineering import (
+    get_reranker, 
+    get_multi_source_context_and_source, 
+    stream_answer_from_gemini, 
+    stream_answer_from_gpt,
+    get_hedged_answer,
+    measure_time_to_first_token,
+    get_context_id,
+)
+from functions.retrievers import LocalVectorIndex
+from functions.embeddings import EmbeddingService
+from functions.inference_backends import load_sentence_transformer, get_model_id
+from functions.batching import BatchedEncoder, BatchedReranker
+from functions.semantic_cache import SemanticCache
+from functions.tracing import configure_tracing, span, set_attributes
+from functions.startup import (
+    StartupTimer,
+    start_in_background,
+    when_all_done,
+    warm_up_sentence_transformer,
+    warm_up_reranker,
+)
 
 import config
 import warnings
@@ -22,8 +43,18 @@ st.title("💬 AI assistant")
 # Define a global variable for the OpenAI client
 openai_client = None
 
-@st.cache_resource()
+# Cached answers are only reused against the same indexes: the same chunks, embedded by the same model and searched alike
+CHUNKER_VERSION = config.CHUNKER if config.CHUNKER != "token" else (
+    f"token_{config.CHUNK_TARGET_TOKENS}_{config.CHUNK_MAX_TOKENS}_{config.CHUNK_MIN_TOKENS}_{config.CHUNK_OVERLAP_TOKENS}")
+INDEX_VERSION = (f"{config.RETRIEVER_BACKEND}:stanford_reports_{config.STANFORD_REPORTS_VERSION}:"
+                 f"eqt_portfolio_{config.EQT_PORTFOLIO_VERSION}:{CHUNKER_VERSION}:"
+                 f"{get_model_id(config.MODEL_SENTENCE_TRANSFORMER)}")
+if config.RETRIEVER_BACKEND == "local":
+    INDEX_VERSION += f":{config.LOCAL_INDEX_COMPRESSION}_{config.LOCAL_INDEX_PCA_DIM}"
+
 def connect_to_hopsworks():
+    import hopsworks
+
     # Initialize Hopsworks feature store connection
     project = hopsworks.login()
     fs = project.get_feature_store()
@@ -31,72 +62,225 @@ def connect_to_hopsworks():
     # Retrieve the 'documents' feature view
     stanford_reports_view = fs.get_feature_view(
         name="stanford_reports",
-        version=1)
+        version=config.STANFORD_REPORTS_VERSION)
     
     eqt_portfolio_view = fs.get_feature_view(
         name="eqt_portfolio",
-        version=1)
+        version=config.EQT_PORTFOLIO_VERSION)
 
     return stanford_reports_view, eqt_portfolio_view
 
 
-@st.cache_resource()
-def get_models(saved_model_dir):
+def load_local_indexes():
+    # Load the memory-mapped indexes written by the feature pipeline
+    stanford_reports_index = LocalVectorIndex(
+        os.path.join(config.LOCAL_INDEX_PATH, "stanford_reports"),
+        n_probe=config.LOCAL_INDEX_N_PROBE,
+        rescore_factor=config.LOCAL_INDEX_RESCORE_FACTOR,
+    )
+
+    eqt_portfolio_index = LocalVectorIndex(
+        os.path.join(config.LOCAL_INDEX_PATH, "eqt_portfolio"),
+        n_probe=config.LOCAL_INDEX_N_PROBE,
+        rescore_factor=config.LOCAL_INDEX_RESCORE_FACTOR,
+    )
+
+    return stanford_reports_index, eqt_portfolio_index
+
+
+@st.cache_resource(max_entries=1)
+def reopen_local_indexes(versions):
+    # Keyed on the build ids, the indexes are opened once per build swapped in by the feature pipeline
+    return load_local_indexes()
 
-    # Load the Sentence Transformer
-    sentence_transformer = SentenceTransformer(
-        config.MODEL_SENTENCE_TRANSFORMER,
-    ).to(config.DEVICE)
 
-    reranker = get_reranker(config.RERANKER)
+def get_models(timer):
+    # Load the Sentence Transformer on the configured inference backend
+    with timer.phase("load_sentence_transformer"):
+        sentence_transformer = load_sentence_transformer(
+            config.MODEL_SENTENCE_TRANSFORMER,
+        )
+
+    with timer.phase("load_reranker"):
+        reranker = get_reranker(config.RERANKER)
+
+    # Pay for lazy initialisation now rather than on the first query
+    if config.STARTUP_WARM_UP:
+        with timer.phase("warm_up_models"):
+            warm_up_sentence_transformer(sentence_transformer)
+            warm_up_reranker(reranker)
+
+    # Share batches between all sessions
+    if config.INFERENCE_BATCHING:
+        sentence_transformer = BatchedEncoder(sentence_transformer)
+        reranker = BatchedReranker(reranker)
+
+    # Reuse embeddings of queries that were asked before, in memory only to keep disk writes off the request path
+    sentence_transformer = EmbeddingService(sentence_transformer, get_model_id(config.MODEL_SENTENCE_TRANSFORMER),
+                                            cache_path=None)
     
     return sentence_transformer, reranker
 
+@st.cache_resource()
+def get_startup_timer():
+    timer = StartupTimer(started=APP_STARTED)
+    timer.mark("imports")
+    return timer
+
+@st.cache_resource()
+def start_loading():
+    """Connect to the feature store and load the models concurrently, returning readiness futures."""
+    timer = get_startup_timer()
+
+    # Retrieve the feature views, or their local stand-ins
+    load_feature_views = load_local_indexes if config.RETRIEVER_BACKEND == "local" else connect_to_hopsworks
+
+    futures = {
+        'feature_views': start_in_background(load_feature_views, timer, "feature_views",
+                                             background=config.STARTUP_BACKGROUND),
+        'models': start_in_background(lambda: get_models(timer), timer, "models",
+                                      background=config.STARTUP_BACKGROUND),
+    }
+
+    def on_ready():
+        timer.mark("ready")
+        timer.save()
+
+    when_all_done(futures, on_ready)
+    return futures
+
+@st.cache_resource()
+def get_semantic_cache():
+    return SemanticCache()
+
+@st.cache_resource()
+def get_tracing_sinks():
+    # Register the trace sinks once, no sinks leaves the tracing disabled
+    if not config.TRACING_ENABLED:
+        return configure_tracing()
+    return configure_tracing(
+        jsonl_path=config.TRACING_JSONL_PATH,
+        metrics=config.TRACING_METRICS,
+        recent=config.TRACING_SIDEBAR_TRACES,
+    )
+
 def set_openai_client():
     """Initialize and set the OpenAI client globally."""
+    from openai import OpenAI
+
     global openai_client
     openai_client = OpenAI(
         api_key=os.environ["OPENAI_API_KEY"],
     )
 
-def predict(user_query, sentence_transformer, feature_views, reranker, model):
+def predict(user_query, sentence_transformer, feature_views, reranker, model, semantic_cache=None):
     st.write('⚙️ Generating Response...')
+
+    if model == "GPT" and openai_client is None:
+        st.error("OpenAI client is not initialized. Please check the API key.")
+        return iter(["OpenAI client error."])
+    elif model not in ("GPT", "Gemini"):
+        return iter(["Unknown model. Please select GPT or Gemini."])
+
+    # Answer from the semantic cache if a similar question was answered before
+    if semantic_cache is not None:
+        query_embedding = sentence_transformer.encode(user_query)
+        cached_answer = semantic_cache.lookup(query_embedding, model, INDEX_VERSION)
+        set_attributes(semantic_cache_hit=cached_answer is not None)
+        if cached_answer is not None:
+            return iter([cached_answer])
     
     stanford_reports_view = feature_views[0]
     eqt_portfolio_view = feature_views[1]
     
-    # Retrieve reranked context and source
-    reports_and_source = get_context_and_source(user_query=user_query, 
-                                                sentence_transformer=sentence_transformer, 
-                                                feature_view=stanford_reports_view, 
-                                                reranker=reranker,
-                                                year=2024, 
-                                                k=50)
-    companies_and_source = get_context_and_source(user_query=user_query, 
-                                                  sentence_transformer=sentence_transformer, 
-                                                  feature_view=eqt_portfolio_view, 
-                                                  reranker=reranker)
-
-    reports_company_context = reports_and_source[0] + companies_and_source[0]
-
-    # Generate model response
-    if model == "GPT":
-        if openai_client is None:
-            st.error("OpenAI client is not initialized. Please check the API key.")
-            return "OpenAI client error."
-        return get_answer_from_gpt(query=user_query, context=reports_company_context, source=reports_and_source[1], 
-                                   gpt_model=config.GPT_MODEL, client=openai_client)        
-    elif model == "Gemini":
-        return get_answer_from_gemini(query=user_query, context=reports_company_context, source=reports_and_source[1], api_key=os.environ["GEMINI_KEY"])
+    # Retrieve reranked context and source from both feature views in one pass
+    reports_and_source, companies_and_source = get_multi_source_context_and_source(
+        user_query=user_query,
+        sentence_transformer=sentence_transformer,
+        sources=[
+            {'feature_view': stanford_reports_view, 'year': 2024, 'k': 50},
+            {'feature_view': eqt_portfolio_view},
+        ],
+        reranker=reranker,
+    )
+
+    # Interleave both sources by rank, so the prompt token budget trims the lowest-ranked snippets of each
+    reports_company_context = [
+        context 
+        for pair in zip_longest(reports_and_source[0], companies_and_source[0]) 
+        for context in pair 
+        if context is not None
+    ]
+
+    # Stream the model response, or ask both models when hedging
+    if config.LLM_HEDGING:
+        answer, provider = get_hedged_answer(query=user_query, context=reports_company_context,
+                                             source=reports_and_source[1], primary=model, gpt_model=config.GPT_MODEL,
+                                             client=openai_client, api_key=os.environ["GEMINI_KEY"])
+        chunks = iter([answer])
+        # The answer is cached under the provider that gave it, failures are not cached
+        model = provider
+    elif model == "GPT":
+        chunks = stream_answer_from_gpt(query=user_query, context=reports_company_context, source=reports_and_source[1], 
+                                        gpt_model=config.GPT_MODEL, client=openai_client)        
     else:
-        return "Unknown model. Please select GPT or Gemini."
+        chunks = stream_answer_from_gemini(query=user_query, context=reports_company_context, source=reports_and_source[1], api_key=os.environ["GEMINI_KEY"])
+
+    if semantic_cache is None or model is None:
+        return chunks
+    return cache_answer(chunks, semantic_cache, user_query, query_embedding, model, 
+                        context=reports_company_context, source=reports_and_source[1])
+
+
+def cache_answer(chunks, semantic_cache, user_query, query_embedding, model, context, source):
+    """Pass a token stream through and store the complete answer in the semantic cache."""
+    answer = ""
+    for chunk in chunks:
+        answer += chunk
+        yield chunk
+
+    # Only successful answers end with their references
+    if answer.endswith(source):
+        semantic_cache.put(user_query, query_embedding, model, INDEX_VERSION, answer, 
+                           context_ids=[get_context_id(c) for c in context])
 
 
-# Retrieve the feature view and the saved_model_dir
-feature_views = connect_to_hopsworks()
+def render_stream(chunks):
+    """Render a token stream into the current container as it arrives and return the full text."""
+    placeholder = st.empty()
+    response = ""
+    for chunk in chunks:
+        response += chunk
+        placeholder.markdown(response + "▌")
+    placeholder.markdown(response)
+    return response
 
-# Load and retrieve the sentence_transformer and reranker
-sentence_transformer, reranker = get_models(saved_model_dir=None)
+
+def render_trace_panel(recent_traces):
+    """Show the per-stage latency breakdown of the last requests in the sidebar."""
+    st.sidebar.subheader("Recent requests")
+    for trace in reversed(recent_traces.traces):
+        with st.sidebar.expander(f"{trace.attributes.get('model', '')} {trace.duration * 1000:.0f}ms"):
+            for row in recent_traces.breakdown(trace)[1:]:
+                attributes = ", ".join(f"{key}={value}" for key, value in row['attributes'].items())
+                st.text(f"{'  ' * (row['depth'] - 1)}{row['name']}: {row['duration_ms']:.0f}ms {attributes}")
+
+
+def render_metrics_panel(metrics_registry):
+    """Show the span counters and mean latencies in the sidebar, with a Prometheus text export."""
+    st.sidebar.subheader("Span metrics")
+    st.sidebar.dataframe(metrics_registry.summary(), hide_index=True)
+    st.sidebar.download_button("Prometheus metrics", metrics_registry.render(), file_name="metrics.prom")
+
+
+# Connect to the feature store and load the sentence_transformer and reranker in the background
+startup = start_loading()
+
+# Answers of previously asked, similar questions
+semantic_cache = get_semantic_cache()
+
+# Trace sinks of the per-request spans
+tracing_sinks = get_tracing_sinks()
 
 # Model selection
 model_choice = st.radio(
@@ -106,8 +290,8 @@ model_choice = st.radio(
     horizontal=True
 )
 
-# Set the OpenAI client globally if GPT is selected
-if model_choice == "GPT" and openai_client is None:
+# Set the OpenAI client globally if GPT is selected or may be hedged to
+if (model_choice == "GPT" or config.LLM_HEDGING) and openai_client is None:
     set_openai_client()
 
 # Initialize chat history
@@ -126,14 +310,41 @@ if user_query := st.chat_input("How can I help you?"):
     # Add user message to chat history
     st.session_state.messages.append({"role": "user", "content": user_query})
 
-    response = predict(user_query=user_query, 
-                       sentence_transformer=sentence_transformer, 
-                       feature_views=feature_views, 
-                       reranker=reranker,
-                       model=model_choice)
+    # Queries arriving during the start wait until the models are ready
+    with st.spinner("Loading models..."):
+        feature_views = startup['feature_views'].result()
+        sentence_transformer, reranker = startup['models'].result()
 
-    # Display assistant response in chat message container
-    with st.chat_message("assistant"):
-        st.markdown(response)
+    # Search the latest local indexes, the open ones keep reading the build they were opened on
+    if config.RETRIEVER_BACKEND == "local" and any(index.is_stale() for index in feature_views):
+        feature_views = reopen_local_indexes(tuple(LocalVectorIndex.get_version(index.path) for index in feature_views))
+
+    # One trace per request, it covers the streamed answer as well
+    with span('predict', model=model_choice) as trace:
+        chunks = predict(user_query=user_query, 
+                         sentence_transformer=sentence_transformer, 
+                         feature_views=feature_views, 
+                         reranker=reranker,
+                         model=model_choice,
+                         semantic_cache=semantic_cache)
+
+        # Display assistant response in chat message container as it is generated
+        metrics = {}
+        with st.chat_message("assistant"):
+            response = render_stream(measure_time_to_first_token(chunks, metrics))
+        trace.set(**metrics)
+    st.session_state.setdefault("llm_metrics", []).append(metrics)
     # Add assistant response to chat history
     st.session_state.messages.append({"role": "assistant", "content": response})
+
+st.sidebar.caption(f"Semantic cache: {semantic_cache.hits} hits, {semantic_cache.misses} misses")
+if not all(future.done() for future in startup.values()):
+    st.sidebar.caption("⏳ Loading models...")
+
+get_startup_timer().mark("first_render")
+
+if 'recent' in tracing_sinks:
+    render_trace_panel(tracing_sinks['recent'])
+
+if 'metrics' in tracing_sinks:
+    render_metrics_panel(tracing_sinks['metrics'])
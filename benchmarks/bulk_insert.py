@@ -0,0 +1,89 @@
+"""
+Offline benchmark of the feature group write path, with a local Parquet file standing in for the feature group.
+
+Compares the legacy path (embeddings as Python lists in a DataFrame column, written in one shot)
+with the batched path (float32 matrix, staged as Parquet and written in bounded batches). Every
+mode runs in its own process so its peak memory can be measured.
+
+Usage (from the repository root):
+    python -m benchmarks.bulk_insert --rows 100000
+    python -m benchmarks.bulk_insert --rows 100000 --batch-rows 2000
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import numpy as np
+import pandas as pd
+
+from multiprocessing import get_context
+
+from functions.bulk_insert import bulk_insert, ParquetSink
+from benchmarks.stubs import synthetic_reports_df
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(mode: str, rows: int, dimension: int, batch_rows: int, path: str, results) -> None:
+    df = synthetic_reports_df(rows)
+    embeddings = np.random.default_rng(0).standard_normal((rows, dimension), dtype=np.float32)
+    baseline_rss = peak_rss_mb()
+
+    started = time.perf_counter()
+    if mode == 'legacy':
+        # What the notebook did: a list per row in a DataFrame column, inserted in one shot
+        df['embeddings'] = pd.Series(embeddings.astype(np.float64).tolist())
+        df.to_parquet(os.path.join(path, 'legacy.parquet'))
+    else:
+        bulk_insert(df, embeddings, ParquetSink(os.path.join(path, 'batched.parquet')), name='benchmark',
+                    staging_path=os.path.join(path, 'staging'), batch_rows=batch_rows)
+    elapsed = time.perf_counter() - started
+
+    results.put({
+        'mode': mode,
+        'seconds': elapsed,
+        'rows_per_s': rows / elapsed,
+        'peak_rss_mb': peak_rss_mb(),
+        'write_rss_mb': peak_rss_mb() - baseline_rss,
+        'file_mb': os.path.getsize(os.path.join(path, f'{mode}.parquet')) / 2 ** 20,
+    })
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='Number of chunks, about 10x the current corpus.')
+    parser.add_argument('--dimension', type=int, default=384, help='Embedding dimension of all-MiniLM-L6-v2.')
+    parser.add_argument('--batch-rows', type=int, default=5000, help='Rows per batch of the batched path.')
+    args = parser.parse_args(argv)
+
+    path = tempfile.mkdtemp(prefix='bulk_insert_')
+    context = get_context('spawn')
+    results = context.Queue()
+    try:
+        for mode in ('legacy', 'batched'):
+            process = context.Process(target=run_mode,
+                                      args=(mode, args.rows, args.dimension, args.batch_rows, path, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                print(f"[BENCHMARK] {mode} failed with exit code {process.exitcode}")
+                return 1
+
+        print(f"\n{'mode':<10}{'s':>9}{'rows/s':>11}{'write MB':>10}{'peak MB':>10}{'file MB':>10}")
+        while not results.empty():
+            result = results.get()
+            print(f"{result['mode']:<10}{result['seconds']:>9.2f}{result['rows_per_s']:>11.0f}"
+                  f"{result['write_rss_mb']:>10.0f}{result['peak_rss_mb']:>10.0f}{result['file_mb']:>10.1f}")
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
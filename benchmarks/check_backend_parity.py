@@ -0,0 +1,78 @@
+"""
+Parity check of the int8 and ONNX inference backends against the fp32 models.
+
+Embeds a synthetic corpus and reranks the neighbors of synthetic queries with the fp32 models and
+with the backend under test, then reports embedding similarity, score drift, ranking agreement and
+the speed-up. Fails when the agreement is below the given limits.
+
+Usage (from the repository root):
+    python -m benchmarks.check_backend_parity --backend int8
+    python -m benchmarks.check_backend_parity --backend onnx --min-agreement 0.9
+"""
+import sys
+import random
+import argparse
+import numpy as np
+
+from functions.inference_backends import (
+    load_sentence_transformer,
+    load_reranker,
+    embedding_parity,
+    reranker_parity,
+)
+from benchmarks.stubs import synthetic_paragraph, synthetic_queries
+
+import config
+
+
+def print_report(title: str, report: dict) -> None:
+    print(f"\n{title}")
+    for name, value in report.items():
+        print(f"  {name:<26}{value:>10.4f}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=['int8', 'onnx'], default='int8', help='Backend compared against fp32.')
+    parser.add_argument('--queries', type=int, default=20, help='Number of synthetic queries.')
+    parser.add_argument('--passages', type=int, default=500, help='Number of synthetic passages.')
+    parser.add_argument('--candidates', type=int, default=50, help='Passages reranked per query, like k in get_context_and_source.')
+    parser.add_argument('--top-k', type=int, default=3, help='Depth of the reranking agreement.')
+    parser.add_argument('--min-agreement', type=float, default=0.9, help='Minimum top-k agreement of both models.')
+    parser.add_argument('--skip-reranker', action='store_true', help='Only check the sentence transformer.')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    passages = [synthetic_paragraph(rng) for _ in range(args.passages)]
+    queries = synthetic_queries(args.queries)
+
+    print(f"[PARITY] Loading {config.MODEL_SENTENCE_TRANSFORMER} (torch, {args.backend})")
+    reference_encoder = load_sentence_transformer(config.MODEL_SENTENCE_TRANSFORMER, backend="torch")
+    candidate_encoder = load_sentence_transformer(config.MODEL_SENTENCE_TRANSFORMER, backend=args.backend)
+    embedding_report = embedding_parity(reference_encoder, candidate_encoder, queries, passages)
+    print_report(f"Sentence transformer, {args.backend} vs fp32", embedding_report)
+    failed = embedding_report['top_10_agreement'] < args.min_agreement
+
+    if not args.skip_reranker:
+        # Rerank the fp32 nearest neighbors of every query, like the app does
+        passage_embeddings = reference_encoder.encode(passages, normalize_embeddings=True)
+        query_embeddings = reference_encoder.encode(queries, normalize_embeddings=True)
+        neighbors = np.argsort(-(query_embeddings @ passage_embeddings.T), axis=1)[:, :args.candidates]
+        queries_and_passages = [(query, [passages[i] for i in ids]) for query, ids in zip(queries, neighbors)]
+
+        print(f"\n[PARITY] Loading {config.RERANKER} (torch, {args.backend})")
+        reference_reranker = load_reranker(config.RERANKER, backend="torch")
+        candidate_reranker = load_reranker(config.RERANKER, backend=args.backend)
+        reranker_report = reranker_parity(reference_reranker, candidate_reranker, queries_and_passages, k=args.top_k)
+        print_report(f"Reranker, {args.backend} vs fp32", reranker_report)
+        failed = failed or reranker_report[f'top_{args.top_k}_agreement'] < args.min_agreement
+
+    if failed:
+        print(f"\n[PARITY] Top-k agreement below {args.min_agreement}")
+        return 1
+    print("\n[PARITY] OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
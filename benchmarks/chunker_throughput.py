@@ -0,0 +1,84 @@
+"""
+Throughput, memory and chunk size uniformity of the chunkers of process_text_data.
+
+Chunks synthetic report pages with the paragraph chunker (split, explode, filter), the token chunker
+on a DataFrame (chunk_text_data) and the token chunker streaming from a page iterator (iter_chunks).
+Peak memory, without the input pages, is measured with tracemalloc in a second pass, so it does not
+slow down the timed one. Chunk sizes are reported in words, see estimate_tokens.
+
+Usage (from the repository root):
+    python -m benchmarks.chunker_throughput --pages 5000
+    python -m benchmarks.chunker_throughput --pages 5000 --target-tokens 100 --overlap-tokens 20
+"""
+import sys
+import time
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from functions.chunking import iter_chunks, chunk_text_data, estimate_tokens
+from functions.text_preprocess import process_text_data
+from benchmarks.stubs import synthetic_pages
+
+import config
+
+
+def run_paragraph(pages: list, chunk_sizes: dict) -> list:
+    df = pd.DataFrame(pages, columns=["file_name", "file_link", "page_number", "text"])
+    return process_text_data(df, dedup=None, chunker="paragraph")['text'].tolist()
+
+
+def run_token(pages: list, chunk_sizes: dict) -> list:
+    df = pd.DataFrame(pages, columns=["file_name", "file_link", "page_number", "text"])
+    return chunk_text_data(df, **chunk_sizes)['text'].tolist()
+
+
+def run_streaming(pages: list, chunk_sizes: dict) -> list:
+    return [row[-1] for row in iter_chunks(iter(pages), **chunk_sizes)]
+
+
+MODES = {'paragraph': run_paragraph, 'token': run_token, 'streaming': run_streaming}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=5000, help='Number of synthetic pages.')
+    parser.add_argument('--target-tokens', type=int, default=config.CHUNK_TARGET_TOKENS, help='Words per chunk.')
+    parser.add_argument('--max-tokens', type=int, default=config.CHUNK_MAX_TOKENS)
+    parser.add_argument('--min-tokens', type=int, default=config.CHUNK_MIN_TOKENS)
+    parser.add_argument('--overlap-tokens', type=int, default=config.CHUNK_OVERLAP_TOKENS)
+    args = parser.parse_args(argv)
+
+    chunk_sizes = {
+        'target_tokens': args.target_tokens,
+        'max_tokens': args.max_tokens,
+        'min_tokens': args.min_tokens,
+        'overlap_tokens': args.overlap_tokens,
+    }
+    # The pages are generated once, outside the timed and traced runs
+    pages = list(synthetic_pages(args.pages))
+    page_bytes = sum(len(text.encode('utf-8')) for *_, text in pages)
+    print(f"[BENCHMARK] {args.pages} pages, {page_bytes / 2 ** 20:.1f} MB of text")
+
+    print(f"\n{'mode':<11}{'s':>8}{'pages/s':>10}{'MB/s':>7}{'peak MB':>9}{'chunks':>8}"
+          f"{'mean words':>12}{'p5':>6}{'p95':>6}{'cv':>7}")
+    for mode, run in MODES.items():
+        started = time.perf_counter()
+        chunks = run(pages, chunk_sizes)
+        elapsed = time.perf_counter() - started
+
+        tracemalloc.start()
+        run(pages, chunk_sizes)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        tokens = np.array([estimate_tokens(chunk) for chunk in chunks])
+        print(f"{mode:<11}{elapsed:>8.2f}{args.pages / elapsed:>10.0f}{page_bytes / 2 ** 20 / elapsed:>7.1f}"
+              f"{peak / 2 ** 20:>9.1f}{len(chunks):>8}{tokens.mean():>12.0f}{np.percentile(tokens, 5):>6.0f}"
+              f"{np.percentile(tokens, 95):>6.0f}{tokens.std() / tokens.mean():>7.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Encoding throughput of the feature pipeline, to size the ingestion machines.
+
+Compares the default single-process encode (fixed batch_size, in input order) with ParallelEncoder
+(token-budget batches of similar length, spread over worker processes) at every process count, and
+checks that both return the same embeddings in the same order.
+
+Usage (from the repository root):
+    python -m benchmarks.encode_throughput --rows 5000 --processes 1 2 4 8
+    python -m benchmarks.encode_throughput --backend onnx --max-batch-tokens 8192
+"""
+import sys
+import time
+import argparse
+import numpy as np
+
+from functions.parallel_encoding import ParallelEncoder, get_token_lengths
+from functions.inference_backends import load_sentence_transformer
+from benchmarks.stubs import synthetic_reports_df
+
+import config
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000, help='Number of synthetic paragraphs.')
+    parser.add_argument('--backend', default=config.INFERENCE_BACKEND, help='torch, int8 or onnx.')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads-per-process', type=int, default=config.ENCODE_THREADS_PER_PROCESS)
+    parser.add_argument('--max-batch-tokens', type=int, default=config.ENCODE_MAX_BATCH_TOKENS)
+    args = parser.parse_args(argv)
+
+    texts = synthetic_reports_df(args.rows)['text'].tolist()
+    sentence_transformer = load_sentence_transformer(config.MODEL_SENTENCE_TRANSFORMER, args.backend)
+    tokens = int(get_token_lengths(sentence_transformer, texts).sum())
+    print(f"[BENCHMARK] {len(texts)} texts, {tokens} tokens")
+
+    started = time.perf_counter()
+    reference = sentence_transformer.encode(texts, batch_size=config.EMBEDDING_BATCH_SIZE, show_progress_bar=False)
+    elapsed = time.perf_counter() - started
+    rows = [('default', 1, elapsed, 1.0)]
+
+    for processes in args.processes:
+        with ParallelEncoder(config.MODEL_SENTENCE_TRANSFORMER, args.backend, processes=processes,
+                             threads_per_process=args.threads_per_process,
+                             max_batch_tokens=args.max_batch_tokens) as encoder:
+            # Load the worker models before timing
+            encoder.start()
+            started = time.perf_counter()
+            embeddings = encoder.encode(texts)
+            elapsed = time.perf_counter() - started
+        similarity = np.sum(embeddings * reference, axis=1) / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference, axis=1))
+        rows.append(('bucketed', processes, elapsed, float(similarity.min())))
+
+    print(f"\n{'mode':<10}{'processes':>10}{'s':>9}{'texts/s':>10}{'tokens/s':>11}{'speedup':>9}{'min cos':>9}")
+    for mode, processes, elapsed, min_similarity in rows:
+        print(f"{mode:<10}{processes:>10}{elapsed:>9.2f}{len(texts) / elapsed:>10.1f}{tokens / elapsed:>11.0f}"
+              f"{rows[0][2] / elapsed:>9.2f}{min_similarity:>9.4f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
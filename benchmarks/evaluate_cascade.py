@@ -0,0 +1,73 @@
+"""
+Recall of cascade reranking against full reranking, per shortlist size and margin.
+
+Retrieves the neighbors of every query from a local index written by the feature pipeline, or from
+a synthetic corpus, and reports how many of the top-k of full reranking the cascade keeps and how
+many candidates it still sends to the reranker.
+
+Usage (from the repository root):
+    python -m benchmarks.evaluate_cascade --index data/index/stanford_reports --queries-file queries.txt
+    python -m benchmarks.evaluate_cascade --shortlist-sizes 5 10 20 --margins none 0.05 0.1
+"""
+import sys
+import argparse
+
+from functions.prompt_engineering import get_reranker, find_neighbors, evaluate_cascade
+from functions.retrievers import LocalVectorIndex
+from functions.inference_backends import load_sentence_transformer
+from benchmarks.stubs import StubFeatureView, synthetic_reports_df, synthetic_queries
+
+import config
+
+
+def parse_margin(value: str):
+    return None if value.lower() == 'none' else float(value)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index', default=None, help='Local index to retrieve from. Default is a synthetic corpus.')
+    parser.add_argument('--queries-file', default=None, help='One query per line. Default is synthetic queries.')
+    parser.add_argument('--queries', type=int, default=20, help='Number of synthetic queries.')
+    parser.add_argument('--rows', type=int, default=2000, help='Rows of the synthetic corpus.')
+    parser.add_argument('--candidates', type=int, default=50, help='Neighbors retrieved per query, like k in predict.')
+    parser.add_argument('--top-k', type=int, default=3, help='Contexts kept after reranking.')
+    parser.add_argument('--shortlist-sizes', type=int, nargs='+', default=[5, 10, 15, 20, 30])
+    parser.add_argument('--margins', type=parse_margin, nargs='+', default=[None, config.RERANK_CASCADE_MARGIN],
+                        help="First-stage margins, 'none' evaluates the cascade without a margin.")
+    args = parser.parse_args(argv)
+
+    print("[CASCADE] Loading models")
+    sentence_transformer = load_sentence_transformer(config.MODEL_SENTENCE_TRANSFORMER)
+    reranker = get_reranker(config.RERANKER)
+
+    if args.index:
+        feature_view = LocalVectorIndex(args.index)
+    else:
+        df = synthetic_reports_df(args.rows)
+        feature_view = StubFeatureView("stanford_reports", df, sentence_transformer.encode(df['text'].tolist()))
+
+    if args.queries_file:
+        with open(args.queries_file) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = synthetic_queries(args.queries)
+
+    queries_and_neighbors = []
+    for query in queries:
+        question_embedding = sentence_transformer.encode(query)
+        queries_and_neighbors.append(
+            (query, question_embedding, find_neighbors(question_embedding, feature_view, k=args.candidates)))
+    rows = evaluate_cascade(queries_and_neighbors, reranker, k=args.top_k,
+                            shortlist_sizes=args.shortlist_sizes, margins=args.margins)
+
+    print(f"\n{'shortlist':>10}{'margin':>9}{f'recall@{args.top_k}':>11}{'reranked':>10}{'early exit':>12}")
+    for row in rows:
+        margin = '-' if row['margin'] is None else f"{row['margin']:.2f}"
+        print(f"{row['shortlist_size']:>10}{margin:>9}{row['recall']:>11.3f}{row['reranked']:>10.1f}"
+              f"{row['early_exit_rate']:>12.1%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
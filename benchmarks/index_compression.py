@@ -0,0 +1,110 @@
+"""
+Recall, memory and latency of the compressed local index against exact search.
+
+Builds the local index with every compression setting over the all-MiniLM-L6-v2 embeddings of an
+index written by the feature pipeline, or of a synthetic corpus, and searches it with encoded queries.
+recall@k is measured against exact top-k, after the compressed first pass alone and after rescoring.
+Settings are written as 'none', 'int8', 'binary', or 'int8:128' to keep 128 principal components.
+
+Usage (from the repository root):
+    python -m benchmarks.index_compression --index data/index/stanford_reports --queries-file queries.txt
+    python -m benchmarks.index_compression --rows 20000 --settings none int8 binary binary:256 --rescore-factors 2 4 8
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+from functions import quantization
+from functions.retrievers import LocalVectorIndex, top_k
+from functions.inference_backends import load_sentence_transformer
+from benchmarks.stubs import synthetic_reports_df, synthetic_queries
+
+import config
+
+
+def parse_setting(value: str) -> tuple:
+    compression, _, pca_dim = value.partition(':')
+    return (None if compression == 'none' else compression), (int(pca_dim) if pca_dim else None)
+
+
+def recall(found: np.ndarray, expected: np.ndarray) -> float:
+    return len(np.intersect1d(found, expected)) / len(expected)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index', default=None, help='Local index whose embeddings are compressed. Default is a synthetic corpus.')
+    parser.add_argument('--queries-file', default=None, help='One query per line. Default is synthetic queries.')
+    parser.add_argument('--queries', type=int, default=200, help='Number of synthetic queries.')
+    parser.add_argument('--rows', type=int, default=10000, help='Rows of the synthetic corpus.')
+    parser.add_argument('--k', type=int, default=10, help='Neighbors per query, recall is measured at k.')
+    parser.add_argument('--settings', type=parse_setting, nargs='+',
+                        default=[parse_setting(s) for s in ('none', 'int8', 'int8:128', 'binary', 'binary:256')])
+    parser.add_argument('--rescore-factors', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args(argv)
+
+    sentence_transformer = load_sentence_transformer(config.MODEL_SENTENCE_TRANSFORMER)
+    if args.index:
+        embeddings = np.array(LocalVectorIndex(args.index).embeddings)
+    else:
+        texts = synthetic_reports_df(args.rows)['text'].tolist()
+        embeddings = sentence_transformer.encode(texts, batch_size=config.EMBEDDING_BATCH_SIZE)
+
+    if args.queries_file:
+        with open(args.queries_file) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = synthetic_queries(args.queries)
+    query_embeddings = np.asarray(sentence_transformer.encode(queries), dtype=np.float32)
+    query_embeddings /= np.maximum(np.linalg.norm(query_embeddings, axis=1, keepdims=True), 1e-12)
+    print(f"[BENCHMARK] {len(embeddings)} x {embeddings.shape[1]} embeddings, {len(queries)} queries, k={args.k}")
+
+    # The single 'row' column makes every neighbor its position in the index
+    df = pd.DataFrame({'row': np.arange(len(embeddings))})
+    full_bytes = len(embeddings) * embeddings.shape[1] * 4
+    with tempfile.TemporaryDirectory() as directory:
+        index = LocalVectorIndex(LocalVectorIndex.build(df, directory, ['row'], 'exact', embeddings=embeddings))
+        expected = [top_k(np.asarray(index.embeddings @ query), args.k) for query in query_embeddings]
+
+        print(f"\n{'setting':<12}{'rescore':>8}{'first-pass MB':>15}{'ratio':>7}{'build s':>9}{'ms/query':>10}"
+              f"{'recall first':>14}{f'recall@{args.k}':>11}")
+        for compression, pca_dim in args.settings:
+            path = os.path.join(directory, f"{compression}-{pca_dim}")
+            started = time.perf_counter()
+            LocalVectorIndex.build(df, path, ['row'], 'compressed', embeddings=embeddings,
+                                   compression=compression, pca_dim=pca_dim)
+            build_seconds = time.perf_counter() - started
+            setting = 'none' if compression is None else compression + (f":{pca_dim}" if pca_dim else '')
+
+            if compression:
+                index = LocalVectorIndex(path)
+                first_scores = [quantization.score(index.codes, query, index.quantizer) for query in query_embeddings]
+
+            for rescore_factor in (args.rescore_factors if compression else [1]):
+                index = LocalVectorIndex(path, rescore_factor=rescore_factor)
+                searched_bytes = index.codes.nbytes if compression else full_bytes
+
+                # Recall of the compressed scores alone, without rescoring
+                first_pass = '-'
+                if compression:
+                    first_pass = np.mean([recall(top_k(scores, args.k), e) for scores, e in zip(first_scores, expected)])
+                    first_pass = f"{first_pass:.3f}"
+
+                # Warm up the memory map before timing
+                index.find_neighbors(query_embeddings[0], k=args.k)
+                started = time.perf_counter()
+                found = [np.array([row[0] for row in index.find_neighbors(query, k=args.k)]) for query in query_embeddings]
+                milliseconds = (time.perf_counter() - started) * 1000 / len(query_embeddings)
+
+                print(f"{setting:<12}{rescore_factor if compression else '-':>8}{searched_bytes / 2 ** 20:>15.2f}"
+                      f"{full_bytes / searched_bytes:>7.1f}{build_seconds:>9.2f}{milliseconds:>10.2f}{first_pass:>14}"
+                      f"{np.mean([recall(f, e) for f, e in zip(found, expected)]):>11.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
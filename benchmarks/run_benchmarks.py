@@ -0,0 +1,286 @@
+"""
+Offline latency benchmark of the inference and ingestion paths.
+
+Runs against a synthetic corpus served by stub feature views and a fake LLM with configurable
+latency, with the real local embedding and reranker models. Every stage is timed separately,
+reported as p50/p95/p99 and throughput, and optionally compared against a stored baseline.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json --threshold 0.2
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import numpy as np
+import pandas as pd
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List
+
+from functions.prompt_engineering import (
+    get_reranker,
+    get_context_and_source,
+    get_multi_source_context_and_source,
+    find_filtered_neighbors,
+    rerank,
+    rerank_cache,
+    build_prompt,
+    get_answer_from_gpt,
+    stream_answer_from_gpt,
+    measure_time_to_first_token,
+)
+from functions.text_preprocess import process_text_data
+from functions.pdf_preprocess import process_pdf_file
+from functions.inference_backends import load_sentence_transformer
+from functions.batching import BatchedEncoder, BatchedReranker
+from benchmarks.stubs import (
+    StubFeatureView,
+    FakeOpenAIClient,
+    synthetic_reports_df,
+    synthetic_portfolio_df,
+    synthetic_queries,
+    synthetic_paragraph,
+    find_sample_pdf,
+)
+
+import config
+
+
+class StageTimer:
+    """
+    Collects wall-clock durations per stage name.
+    """
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+
+    @contextmanager
+    def time(self, stage: str):
+        started = time.perf_counter()
+        yield
+        self.durations[stage].append(time.perf_counter() - started)
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.durations[stage].append(seconds)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns count, mean, p50, p95 and p99 in milliseconds and throughput in calls per second per stage.
+        """
+        summary = {}
+        for stage, durations in self.durations.items():
+            ms = np.array(durations) * 1000
+            summary[stage] = {
+                'count': len(durations),
+                'mean_ms': float(ms.mean()),
+                'p50_ms': float(np.percentile(ms, 50)),
+                'p95_ms': float(np.percentile(ms, 95)),
+                'p99_ms': float(np.percentile(ms, 99)),
+                'throughput_per_s': float(len(durations) / max(sum(durations), 1e-12)),
+            }
+        return summary
+
+
+def benchmark_inference(timer: StageTimer, sentence_transformer, reranker, feature_views, queries: List[str],
+                        llm_client) -> None:
+    stanford_reports_view, eqt_portfolio_view = feature_views
+
+    for query in queries:
+        # Reranker scores must not be served from the cache
+        rerank_cache.clear()
+
+        # Stages of get_context_and_source, timed one by one
+        with timer.time('context.embed'):
+            question_embedding = sentence_transformer.encode(query)
+        with timer.time('context.retrieve'):
+            neighbors, _ = find_filtered_neighbors(question_embedding, stanford_reports_view, k=50, filters={'year': 2024})
+        with timer.time('context.rerank'):
+            rerank(query, neighbors, reranker, k=3, cache=None)
+        with timer.time('context.total'):
+            get_context_and_source(query, sentence_transformer, stanford_reports_view, reranker, year=2024, k=50)
+
+        # Stages of predict
+        rerank_cache.clear()
+        started = time.perf_counter()
+        with timer.time('predict.retrieve_and_rerank'):
+            reports_and_source, companies_and_source = get_multi_source_context_and_source(
+                user_query=query,
+                sentence_transformer=sentence_transformer,
+                sources=[
+                    {'feature_view': stanford_reports_view, 'year': 2024, 'k': 50},
+                    {'feature_view': eqt_portfolio_view},
+                ],
+                reranker=reranker,
+            )
+        context = reports_and_source[0] + companies_and_source[0]
+        with timer.time('predict.build_prompt'):
+            build_prompt(query, context)
+        with timer.time('predict.llm'):
+            get_answer_from_gpt(query, context, reports_and_source[1], config.GPT_MODEL, llm_client)
+        timer.add('predict.total', time.perf_counter() - started)
+
+        metrics = {}
+        for _ in measure_time_to_first_token(
+                stream_answer_from_gpt(query, context, reports_and_source[1], config.GPT_MODEL, llm_client), metrics):
+            pass
+        timer.add('predict.llm_time_to_first_token', metrics['time_to_first_token'])
+
+
+def benchmark_ingestion(timer: StageTimer, sentence_transformer, n_pages: int, iterations: int, pdf_path: str) -> None:
+    rng = random.Random(0)
+    pages = pd.DataFrame({
+        'file_name': 'synthetic',
+        'page_number': np.arange(1, n_pages + 1),
+        'text': ['\n \n'.join(synthetic_paragraph(rng, 20, 200) for _ in range(4)) for _ in range(n_pages)],
+    })
+
+    for _ in range(iterations):
+        with timer.time('ingest.process_text_data'):
+            processed = process_text_data(pages.copy())
+
+    texts = processed['text'].tolist()
+    for _ in range(iterations):
+        with timer.time('ingest.encode'):
+            sentence_transformer.encode(texts, batch_size=config.EMBEDDING_BATCH_SIZE)
+
+    if pdf_path is None:
+        print("[BENCHMARK] No sample PDF found, skipping PDF extraction")
+        return
+    for _ in range(iterations):
+        with timer.time('ingest.pdf_extract_serial'):
+            process_pdf_file([], pdf_path, pdf_path, workers=1)
+        with timer.time('ingest.pdf_extract_parallel'):
+            process_pdf_file([], pdf_path, pdf_path)
+
+
+def benchmark_concurrency(timer: StageTimer, sentence_transformer, reranker, feature_view, queries: List[str],
+                          sessions: int) -> None:
+    """
+    Runs the embed and rerank steps of many queries from concurrent sessions, once on the shared
+    models directly and once through the micro-batching scheduler.
+    """
+    requests = [
+        (query, find_filtered_neighbors(sentence_transformer.encode(query), feature_view, k=50)[0])
+        for query in queries
+    ]
+
+    for mode, encoder, scorer in (
+            ('direct', sentence_transformer, reranker),
+            ('batched', BatchedEncoder(sentence_transformer), BatchedReranker(reranker))):
+
+        def handle(request):
+            query, neighbors = request
+            started = time.perf_counter()
+            encoder.encode(query)
+            scorer.compute_score([[query, neighbor[5]] for neighbor in neighbors],
+                                 batch_size=config.RERANKER_BATCH_SIZE, max_length=config.RERANKER_MAX_LENGTH)
+            timer.add(f'concurrent.{mode}.request', time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            list(executor.map(handle, requests))
+        elapsed = time.perf_counter() - started
+        timer.add(f'concurrent.{mode}.total', elapsed)
+        print(f"[BENCHMARK] {sessions} sessions, {mode}: {len(requests) / elapsed:.2f} requests/s")
+
+
+def compare_with_baseline(summary: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Lists the stages whose p50 or p95 grew by more than threshold (a fraction) over the baseline.
+    """
+    regressions = []
+    for stage, stats in summary.items():
+        if stage not in baseline:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            limit = baseline[stage][metric] * (1 + threshold)
+            if stats[metric] > limit:
+                regressions.append(
+                    f"{stage} {metric}: {stats[metric]:.1f}ms > {limit:.1f}ms "
+                    f"(baseline {baseline[stage][metric]:.1f}ms + {threshold:.0%})"
+                )
+    return regressions
+
+
+def print_summary(summary: Dict) -> None:
+    print(f"\n{'stage':<36}{'n':>5}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'per s':>10}")
+    for stage, stats in sorted(summary.items()):
+        print(f"{stage:<36}{stats['count']:>5}{stats['p50_ms']:>11.1f}{stats['p95_ms']:>11.1f}"
+              f"{stats['p99_ms']:>11.1f}{stats['throughput_per_s']:>10.2f}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=20, help='Number of benchmark queries.')
+    parser.add_argument('--reports-rows', type=int, default=2000, help='Rows of the synthetic stanford_reports corpus.')
+    parser.add_argument('--portfolio-rows', type=int, default=100, help='Rows of the synthetic eqt_portfolio corpus.')
+    parser.add_argument('--lookup-latency', type=float, default=0.0, help='Simulated find_neighbors round trip in seconds.')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Latency of the fake LLM in seconds.')
+    parser.add_argument('--ingest-pages', type=int, default=200, help='Pages of the synthetic ingestion sample.')
+    parser.add_argument('--ingest-iterations', type=int, default=3, help='Repetitions of every ingestion stage.')
+    parser.add_argument('--pdf', default=None, help=f'Sample PDF. Default is the first PDF in {config.DOWNLOAD_PATH}.')
+    parser.add_argument('--backend', default=config.INFERENCE_BACKEND, choices=['torch', 'int8', 'onnx'],
+                        help='Inference backend of the sentence transformer and the reranker.')
+    parser.add_argument('--sessions', type=int, default=0,
+                        help='Concurrent sessions of the shared-model load test. Default 0 skips it.')
+    parser.add_argument('--skip-ingestion', action='store_true', help='Only benchmark the inference path.')
+    parser.add_argument('--baseline', default=None, help='Baseline JSON to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed p50/p95 growth over the baseline, as a fraction.')
+    parser.add_argument('--save-baseline', default=None, help='Write the results to this JSON file.')
+    args = parser.parse_args(argv)
+
+    print(f"[BENCHMARK] Loading models ({args.backend})")
+    sentence_transformer = load_sentence_transformer(config.MODEL_SENTENCE_TRANSFORMER, backend=args.backend)
+    reranker = get_reranker(config.RERANKER, backend=args.backend)
+
+    print("[BENCHMARK] Embedding synthetic corpus")
+    reports_df = synthetic_reports_df(args.reports_rows)
+    portfolio_df = synthetic_portfolio_df(args.portfolio_rows)
+    feature_views = (
+        StubFeatureView("stanford_reports", reports_df, sentence_transformer.encode(reports_df['text'].tolist()),
+                        latency=args.lookup_latency),
+        StubFeatureView("eqt_portfolio", portfolio_df, sentence_transformer.encode(portfolio_df['text'].tolist()),
+                        latency=args.lookup_latency),
+    )
+
+    timer = StageTimer()
+    queries = synthetic_queries(args.queries)
+
+    # One untimed warm-up query
+    benchmark_inference(StageTimer(), sentence_transformer, reranker, feature_views, queries[:1],
+                        FakeOpenAIClient(latency=0))
+    benchmark_inference(timer, sentence_transformer, reranker, feature_views, queries,
+                        FakeOpenAIClient(latency=args.llm_latency))
+
+    if args.sessions:
+        benchmark_concurrency(timer, sentence_transformer, reranker, feature_views[0], queries, args.sessions)
+
+    if not args.skip_ingestion:
+        benchmark_ingestion(timer, sentence_transformer, args.ingest_pages, args.ingest_iterations,
+                            args.pdf or find_sample_pdf(config.DOWNLOAD_PATH))
+
+    summary = timer.summary()
+    print_summary(summary)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"\n[BENCHMARK] Results written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(summary, json.load(f), args.threshold)
+        if regressions:
+            print("\n[BENCHMARK] Regressions:\n - " + "\n - ".join(regressions))
+            return 1
+        print("\n[BENCHMARK] No regressions against the baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
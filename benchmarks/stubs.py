@@ -0,0 +1,161 @@
+import time
+import random
+import numpy as np
+import pandas as pd
+
+from types import SimpleNamespace
+from typing import Iterator, List, Optional
+
+from functions.retrievers import Neighbor, top_k
+
+WORDS = (
+    "artificial intelligence model training compute investment private funding startups patents "
+    "research publications benchmark performance language vision robotics healthcare diagnostics "
+    "fintech payments software platform customers revenue growth adoption regulation policy "
+    "education workforce hiring skills talent chips hardware energy emissions safety responsible "
+    "generative foundation open closed source academia industry government global china europe "
+    "united states survey companies portfolio automation productivity efficiency cloud data"
+).split()
+
+REPORTS = {
+    2022: ("2022-AI-Index-Report_Master", "https://aiindex.stanford.edu/wp-content/uploads/2022/03/2022-AI-Index-Report_Master.pdf"),
+    2023: ("HAI_AI-Index-Report_2023", "https://aiindex.stanford.edu/wp-content/uploads/2023/04/HAI_AI-Index-Report_2023.pdf"),
+    2024: ("HAI_AI-Index-Report-2024", "https://aiindex.stanford.edu/wp-content/uploads/2024/05/HAI_AI-Index-Report-2024.pdf"),
+}
+
+
+def synthetic_paragraph(rng: random.Random, min_words: int = 60, max_words: int = 400) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    sentences = [' '.join(words[i:i + 15]).capitalize() + '.' for i in range(0, len(words), 15)]
+    return ' '.join(sentences)
+
+
+def synthetic_reports_df(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Rows shaped like the 'stanford_reports' feature view: name, url, source, page_number, paragraph, text, year.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n_rows):
+        year = rng.choice(list(REPORTS))
+        name, url = REPORTS[year]
+        rows.append([name, url, "stanford_report", 1 + i // 4, 1 + i % 4, synthetic_paragraph(rng), year])
+    return pd.DataFrame(rows, columns=["name", "url", "source", "page_number", "paragraph", "text", "year"])
+
+
+def synthetic_portfolio_df(n_rows: int, seed: int = 1) -> pd.DataFrame:
+    """
+    Rows shaped like the 'eqt_portfolio' feature view: name, url, source, page_number, paragraph, text.
+    """
+    rng = random.Random(seed)
+    companies = ["AMCS", "Avetta", "Billtrust", "Dechra_Pharmaceuticals", "Hantverksdata", "UTA", "Zeus"]
+    rows = []
+    for i in range(n_rows):
+        company = companies[i % len(companies)]
+        rows.append([company, f"https://example.com/{company.lower()}/", "EQT_X_Portfolio", 1, 1 + i // len(companies),
+                     synthetic_paragraph(rng)])
+    return pd.DataFrame(rows, columns=["name", "url", "source", "page_number", "paragraph", "text"])
+
+
+def synthetic_pages(n_pages: int, seed: int = 3) -> Iterator[List]:
+    """
+    Extracted report pages like the rows of iter_pdf_pages: [file_title, url, page_number, text].
+
+    Pages mix body paragraphs of 5 to 900 words with page numbers, table of contents lines and short
+    headers, separated like PyPDF2 output.
+    """
+    rng = random.Random(seed)
+    for i in range(n_pages):
+        name, url = REPORTS[2022 + i % len(REPORTS)]
+        paragraphs = []
+        for _ in range(rng.randint(2, 8)):
+            kind = rng.random()
+            if kind < 0.1:
+                paragraphs.append(str(rng.randint(1, 400)))
+            elif kind < 0.15:
+                paragraphs.append(f"Chapter {rng.randint(1, 9)} {rng.choice(WORDS).capitalize()} ........ {rng.randint(1, 400)}")
+            else:
+                paragraphs.append(synthetic_paragraph(rng, 5 if kind < 0.4 else 60, 900))
+        yield [name, url, 1 + i, '\n \n'.join(paragraphs)]
+
+
+def synthetic_queries(n: int, seed: int = 2) -> List[str]:
+    rng = random.Random(seed)
+    return [f"How does {rng.choice(WORDS)} {rng.choice(WORDS)} affect {rng.choice(WORDS)} in portfolio companies?"
+            for _ in range(n)]
+
+
+class StubFeatureView:
+    """
+    Stand-in for a hsfs FeatureView serving an in-memory corpus through find_neighbors.
+
+    Filters are not supported, like a feature view without an embedding index on the filtered
+    features, so filtered lookups exercise the over-fetching path. Rows are returned with their
+    embeddings, like a feature view selecting the embedding feature.
+    """
+
+    def __init__(self, name: str, df: pd.DataFrame, embeddings: np.ndarray, latency: float = 0.0):
+        """
+        Parameters:
+        - name (str): Name of the feature view.
+        - df (pd.DataFrame): The rows returned by find_neighbors, in feature view column order.
+        - embeddings (np.ndarray): One embedding per row.
+        - latency (float, optional): Simulated network round trip in seconds.
+        """
+        self.name = name
+        self.rows = [tuple(row) for row in df.itertuples(index=False)]
+        self.embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        self.latency = latency
+
+    def find_neighbors(self, embedding, k: int = 10, filter=None) -> List[tuple]:
+        if filter is not None:
+            raise TypeError("StubFeatureView does not support filters")
+        if self.latency:
+            time.sleep(self.latency)
+        query = np.asarray(embedding, dtype=np.float32)
+        ids = top_k(self.embeddings @ (query / np.linalg.norm(query)), k)
+        return [Neighbor(self.rows[i], self.embeddings[i]) for i in ids]
+
+
+class FakeOpenAIClient:
+    """
+    Minimal stand-in for the OpenAI client with a configurable latency.
+
+    Non-streaming completions answer after `latency` seconds. Streaming completions send the
+    first token after `latency` seconds and the following ones every `token_interval` seconds.
+    """
+
+    def __init__(self, latency: float = 0.5, token_interval: float = 0.01, answer: str = "This is a synthetic answer."):
+        self.latency = latency
+        self.token_interval = token_interval
+        self.answer = answer
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def with_options(self, **kwargs) -> "FakeOpenAIClient":
+        return self
+
+    def _create(self, model: str, messages: List[dict], stream: bool = False, **kwargs):
+        time.sleep(self.latency)
+        if stream:
+            return self._stream()
+        message = SimpleNamespace(content=f'"{self.answer}"')
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def _stream(self) -> Iterator:
+        for i, token in enumerate(self.answer.split(' ')):
+            if i:
+                time.sleep(self.token_interval)
+            delta = SimpleNamespace(content=token if i == 0 else ' ' + token)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+def find_sample_pdf(path: str) -> Optional[str]:
+    """
+    Returns the first PDF in a directory, in sorted order, or None.
+    """
+    import os
+
+    if not os.path.isdir(path):
+        return None
+    pdfs = sorted(f for f in os.listdir(path) if f.endswith('.pdf'))
+    return os.path.join(path, pdfs[0]) if pdfs else None
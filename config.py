@@ -1,8 +1,26 @@
-import torch
+import os
 
 # The local directory path where downloaded data will be saved.
 DOWNLOAD_PATH = "data"
 
+# Number of processes extracting PDF pages in parallel.
+PDF_EXTRACT_WORKERS = os.cpu_count() or 1
+
+# Number of consecutive PDF pages extracted per worker task.
+PDF_PAGES_PER_SHARD = 25
+
+# Number of reports downloaded concurrently.
+DOWNLOAD_WORKERS = 4
+
+# Number of bytes written to disk per downloaded chunk.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Connect and read timeouts of report downloads, in seconds.
+DOWNLOAD_TIMEOUT = (10, 60)
+
+# Maximum number of pooled HTTP connections per host.
+HTTP_POOL_SIZE = 10
+
 REPORTS_URLS = [
         "https://aiindex.stanford.edu/wp-content/uploads/2022/03/2022-AI-Index-Report_Master.pdf",
         "https://aiindex.stanford.edu/wp-content/uploads/2023/04/HAI_AI-Index-Report_2023.pdf",
@@ -19,17 +37,260 @@ EQT_X_COMPANY_URLS = {
     "Zeus": "https://eqtgroup.com/current-portfolio/zeus/"
 }
 
+# Maximum number of portfolio pages fetched concurrently.
+CRAWL_WORKERS = 16
+
+# Maximum number of concurrent requests to the same host while scraping.
+CRAWL_MAX_PER_HOST = 2
+
+# Minimum delay in seconds between the start of two requests to the same host while scraping.
+CRAWL_MIN_INTERVAL = 0.5
+
+# Connect and read timeouts of website requests, in seconds.
+CRAWL_TIMEOUT = (5, 20)
+
+# The local directory path where scraped website text is cached for conditional requests.
+CRAWL_CACHE_PATH = "data/crawl_cache"
+
+# BeautifulSoup parser: 'lxml' is considerably faster, 'html.parser' needs no extra dependency.
+HTML_PARSER = "lxml"
+
+# Feature group and feature view versions, embeddings are stored as array<float> since 2 and 3.
+STANFORD_REPORTS_VERSION = 2
+EQT_PORTFOLIO_VERSION = 3
+
+# The local directory path where the manifests of already indexed chunks are saved.
+MANIFEST_PATH = "data/manifest"
+
+# Maximum number of items waiting between two stages of the streaming ingestion runner, which bounds its memory.
+INGEST_QUEUE_SIZE = 8
+
+# Consecutive PDF pages per unit of work of the ingestion runner, a crashed run resumes after the last finished unit.
+INGEST_PAGES_PER_UNIT = 10
+
+# The local directory path where the ingestion runner checkpoints finished units of work.
+INGEST_CHECKPOINT_PATH = "data/checkpoints"
+
+# Seconds between two progress lines of the ingestion runner.
+INGEST_PROGRESS_INTERVAL = 10
+
 # Reranker 
 RERANKER = 'BAAI/bge-reranker-large'
 
+# Number of (query, context) pairs scored per reranker forward pass.
+RERANKER_BATCH_SIZE = 32
+
+# Maximum token length of a (query, context) pair passed to the reranker.
+RERANKER_MAX_LENGTH = 512
+
+# Maximum number of (query, context_id) reranker scores kept in memory.
+RERANKER_CACHE_SIZE = 4096
+
+# Batch the encode and rerank calls of all app sessions in one process-wide scheduler.
+INFERENCE_BATCHING = True
+
+# Seconds a queued encode or rerank request waits for others to share its batch.
+INFERENCE_BATCH_WINDOW = 0.005
+
+# Maximum number of texts encoded in one scheduled batch.
+INFERENCE_MAX_BATCH_TEXTS = 256
+
+# Maximum number of (query, context) pairs scored in one scheduled batch.
+INFERENCE_MAX_BATCH_PAIRS = 128
+
+# Drop near-duplicate neighbors, and optionally diversify them by maximal marginal relevance, before reranking.
+# Runs on the embeddings returned with the neighbors: the local index and feature views selecting 'embeddings'.
+DIVERSIFY_NEIGHBORS = True
+
+# Number of neighbors per source kept by maximal marginal relevance, None keeps all but near-duplicates.
+MMR_K = None
+
+# Weight of relevance against diversity in maximal marginal relevance, 1 ranks by relevance only.
+MMR_LAMBDA = 0.7
+
+# Cosine similarity above which two neighbors count as near-duplicates.
+MMR_DUPLICATE_THRESHOLD = 0.95
+
+# Chunker of process_text_data: "paragraph" keeps every paragraph above 300 characters as one chunk, "token"
+# merges and splits paragraphs to uniform token sizes but chunks slower. Changing it changes the context ids of
+# all chunks, so the next run re-embeds everything.
+CHUNKER = "paragraph"
+
+# Words per chunk the token chunker aims for. all-MiniLM-L6-v2 reads at most 256 word pieces, about 190 English words.
+CHUNK_TARGET_TOKENS = 150
+
+# Chunks above this many words are split, at sentence boundaries where possible.
+CHUNK_MAX_TOKENS = 190
+
+# Chunks below this many words are merged into a neighbor or dropped.
+CHUNK_MIN_TOKENS = 25
+
+# Words repeated at the start of the next piece when a long paragraph is split.
+CHUNK_OVERLAP_TOKENS = 30
+
+# Near-duplicate paragraph removal during ingestion: None, "simhash" or "minhash". The notebook compares all
+# paragraphs of a source, the ingestion runner those of one unit of work, so do not mix both on one feature group version.
+INGEST_DEDUP = None
+
+# Maximum Hamming distance between the 64-bit SimHash fingerprints of near-duplicate paragraphs.
+SIMHASH_MAX_DISTANCE = 7
+
+# Minimum estimated Jaccard similarity of the word shingles of near-duplicate paragraphs.
+MINHASH_THRESHOLD = 0.8
+
+# Number of MinHash permutations per paragraph.
+MINHASH_NUM_PERM = 64
+
+# Prune the retrieved candidates by bi-encoder cosine before the cross-encoder reranker.
+RERANK_CASCADE = False
+
+# Number of candidates per source kept by the first stage of the cascade and scored by the reranker.
+RERANK_SHORTLIST_SIZE = 15
+
+# Candidates scoring more than this below the k-th best first-stage cosine are pruned; when none but
+# the top k remain the first stage is decisive and the reranker is skipped. None disables both.
+RERANK_CASCADE_MARGIN = 0.1
+
+# Inference backend of the sentence transformer and the reranker: "torch" (fp32 on DEVICE),
+# "int8" (dynamic int8 quantization on the CPU) or "onnx" (ONNX Runtime on the CPU).
+INFERENCE_BACKEND = "torch"
+
+# Directory the ONNX exports of the models are written to on first use.
+ONNX_EXPORT_PATH = "data/onnx"
+
+# ONNX Runtime graph optimization level of the exported models, "O1" to "O3".
+ONNX_OPTIMIZATION_LEVEL = "O2"
+
+# Upper bound on neighbors fetched when a feature view cannot filter and results are over-fetched.
+RETRIEVAL_MAX_K = 400
+
+# Factor k is widened by on every over-fetch round.
+RETRIEVAL_K_GROWTH = 2
+
+# Retrieval backend: 'hopsworks' queries the feature views, 'local' uses the on-disk index written by the feature pipeline.
+RETRIEVER_BACKEND = "hopsworks"
+
+# The local directory path where the local vector indexes are saved.
+LOCAL_INDEX_PATH = "data/index"
+
+# Local index search mode: 'exact' brute force top-k or 'ivf' approximate search for larger corpora.
+LOCAL_INDEX_MODE = "exact"
+
+# Number of inverted lists scanned per query in 'ivf' mode.
+LOCAL_INDEX_N_PROBE = 8
+
+# Compressed copy of the local index embeddings searched first: None, 'int8' (4x smaller) or 'binary' (32x smaller).
+LOCAL_INDEX_COMPRESSION = None
+
+# Number of principal components kept in the compressed copy, None keeps all 384 dimensions.
+LOCAL_INDEX_PCA_DIM = None
+
+# With compression, k * LOCAL_INDEX_RESCORE_FACTOR neighbors are rescored with the full precision embeddings.
+LOCAL_INDEX_RESCORE_FACTOR = 4
+
 # GPT model:
 GPT_MODEL = "gpt-4o-mini-2024-07-18"
 
+# Maximum number of prompt tokens, lower-ranked snippets are truncated or dropped to fit.
+PROMPT_TOKEN_BUDGET = 3000
+
+# tiktoken encoding used to count prompt tokens locally.
+PROMPT_TOKENIZER = "o200k_base"
+
+# Snippets sharing at least this share of their word 5-grams with a higher-ranked snippet are removed.
+PROMPT_OVERLAP_THRESHOLD = 0.6
+
+# A snippet is only truncated to fit the budget if at least this many tokens of it remain.
+PROMPT_MIN_SNIPPET_TOKENS = 50
+
+# Connect and read timeouts of LLM requests, in seconds.
+LLM_TIMEOUT = (5, 60)
+
+# Number of retries of an LLM request failing with 429/5xx or a network error.
+LLM_MAX_RETRIES = 3
+
+# Delay before the first LLM retry in seconds, doubled on every further retry.
+LLM_BACKOFF = 0.5
+
+# Upper bound of a single LLM retry delay in seconds.
+LLM_MAX_BACKOFF = 8
+
+# Hedged requests: if the selected LLM has not answered within LLM_HEDGE_BUDGET seconds, the other one is asked too.
+LLM_HEDGING = False
+LLM_HEDGE_BUDGET = 8.0
+
+# SQLite file holding previously generated answers for the semantic answer cache.
+SEMANTIC_CACHE_PATH = "data/semantic_cache.sqlite"
+
+# Minimum cosine similarity between two queries for a cached answer to be reused.
+SEMANTIC_CACHE_THRESHOLD = 0.92
+
+# Lifetime of a cached answer in seconds.
+SEMANTIC_CACHE_TTL = 7 * 24 * 60 * 60
+
+# Maximum number of cached answers, the least recently used ones are evicted first.
+SEMANTIC_CACHE_MAX_ENTRIES = 2000
+
+# Gemini model endpoint, without the method suffix.
+GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash"
+
 # The identifier of the pre-trained sentence transformer model for producing sentence embeddings.
 MODEL_SENTENCE_TRANSFORMER = 'all-MiniLM-L6-v2'
 
-# The computing device to be used for model inference and training.
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# SQLite file caching sentence embeddings by (model name, normalized text hash).
+EMBEDDING_CACHE_PATH = "data/embedding_cache.sqlite"
+
+# Rows per batch of the feature group bulk insert, which bounds the memory of the insert.
+INSERT_BATCH_ROWS = 5000
+
+# Directory the embedded chunks are staged in as Parquet before they are inserted.
+INSERT_STAGING_PATH = "data/staging"
+
+# Number of texts encoded per sentence transformer call.
+EMBEDDING_BATCH_SIZE = 64
+
+# Worker processes of the feature pipeline encoder on CPU hosts, None starts one per ENCODE_THREADS_PER_PROCESS cores.
+ENCODE_PROCESSES = None
+
+# Torch threads of every feature pipeline encoder process.
+ENCODE_THREADS_PER_PROCESS = 2
+
+# Padded tokens per feature pipeline encoder batch, so batches of short paragraphs hold more texts than batches of long ones.
+ENCODE_MAX_BATCH_TOKENS = 16384
+
+# Upper bound on the number of texts per feature pipeline encoder batch.
+ENCODE_MAX_BATCH_SIZE = 256
+
+def __getattr__(name):
+    # The computing device to be used for model inference and training.
+    # DEVICE is resolved on first access, so importing config does not import torch, and then stored as a
+    # module global, so later accesses no longer reach __getattr__.
+    if name == "DEVICE":
+        import torch
+        globals()["DEVICE"] = "cuda" if torch.cuda.is_available() else "cpu"
+        return globals()["DEVICE"]
+    raise AttributeError(f"module 'config' has no attribute '{name}'")
 
 # The identifier for the Mistral-7B-Instruct model
 MODEL_ID = 'mistralai/Mistral-7B-Instruct-v0.2'
+
+# Master switch of the request tracing, disabled tracing costs a single check per instrumented call.
+TRACING_ENABLED = True
+
+# JSON-lines file every traced request is appended to, None disables the file sink.
+TRACING_JSONL_PATH = "data/traces.jsonl"
+
+# Keep Prometheus-style counters and latency histograms of all spans in memory.
+TRACING_METRICS = True
+
+# Number of recent requests shown in the sidebar trace panel, 0 hides the panel.
+TRACING_SIDEBAR_TRACES = 10
+
+# Load the models and connect to the feature store in background threads while the UI renders.
+STARTUP_BACKGROUND = True
+
+# Run one inference on every model after loading, so the first query does not pay for lazy initialisation.
+STARTUP_WARM_UP = True
+
+# JSON-lines file every app cold start appends its per-phase durations to, None disables it.
+STARTUP_LOG_PATH = "data/startup.jsonl"
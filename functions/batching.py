@@ -0,0 +1,145 @@
+import time
+import queue
+import threading
+import numpy as np
+
+from concurrent.futures import Future
+from typing import Any, Callable, List, Union
+
+import config
+
+
+class MicroBatcher:
+    """
+    Coalesces model calls from many threads into batches.
+
+    Callers submit single items and get a future back. A worker thread takes the first queued item,
+    waits at most max_wait seconds for more, or until max_batch_size items are collected, and runs
+    one batch_fn call for all of them.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int,
+                 max_wait: float = config.INFERENCE_BATCH_WINDOW, name: str = "batcher"):
+        """
+        Parameters:
+        - batch_fn (Callable): Maps a list of items to a list of results of the same length.
+        - max_batch_size (int): Maximum number of items per batch_fn call.
+        - max_wait (float, optional): Seconds the first item of a batch waits for more items.
+        - name (str, optional): Name of the worker thread.
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def map(self, items: List[Any]) -> List[Any]:
+        """
+        Submits all items and waits for their results, in order.
+        """
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+
+    def _collect(self) -> List:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                # Take what is already queued even when the window has passed
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+                # A short result list would leave the callers of the missing items waiting forever
+                if len(results) != len(batch):
+                    raise ValueError(f"{self._worker.name}: batch function returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class BatchedEncoder:
+    """
+    Sentence transformer whose encode calls from all sessions are batched by one MicroBatcher.
+    """
+
+    def __init__(self, sentence_transformer, max_batch_size: int = config.INFERENCE_MAX_BATCH_TEXTS,
+                 max_wait: float = config.INFERENCE_BATCH_WINDOW):
+        self.sentence_transformer = sentence_transformer
+        self.batcher = MicroBatcher(self._encode_batch, max_batch_size, max_wait, name="encode-batcher")
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        return self.sentence_transformer.encode(texts, batch_size=config.EMBEDDING_BATCH_SIZE)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.sentence_transformer.get_sentence_embedding_dimension()
+
+    def encode(self, texts: Union[str, List[str]], **kwargs) -> np.ndarray:
+        """
+        Encodes one or more texts like SentenceTransformer.encode.
+
+        Calls with extra arguments, other than batch_size, go straight to the model.
+        """
+        kwargs.pop('batch_size', None)
+        if kwargs:
+            return self.sentence_transformer.encode(texts, **kwargs)
+        if isinstance(texts, str):
+            return self.batcher.submit(texts).result()
+
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.vstack(self.batcher.map(texts))
+
+
+class BatchedReranker:
+    """
+    Reranker whose compute_score calls from all sessions are batched by one MicroBatcher.
+    """
+
+    def __init__(self, reranker, max_batch_size: int = config.INFERENCE_MAX_BATCH_PAIRS,
+                 max_wait: float = config.INFERENCE_BATCH_WINDOW, max_length: int = config.RERANKER_MAX_LENGTH):
+        self.reranker = reranker
+        self.max_length = max_length
+        self.batcher = MicroBatcher(self._score_batch, max_batch_size, max_wait, name="rerank-batcher")
+
+    def _score_batch(self, pairs: List[List[str]]) -> List[float]:
+        scores = self.reranker.compute_score(pairs, batch_size=config.RERANKER_BATCH_SIZE, max_length=self.max_length)
+        return scores if isinstance(scores, list) else [scores]
+
+    def compute_score(self, sentence_pairs, batch_size: int = config.RERANKER_BATCH_SIZE,
+                      max_length: int = config.RERANKER_MAX_LENGTH) -> Union[float, List[float]]:
+        """
+        Scores (query, passage) pairs like FlagReranker.compute_score, a single pair returns a plain float.
+
+        Calls with a different max_length go straight to the model.
+        """
+        if max_length != self.max_length:
+            return self.reranker.compute_score(sentence_pairs, batch_size=batch_size, max_length=max_length)
+        if isinstance(sentence_pairs[0], str):
+            sentence_pairs = [sentence_pairs]
+
+        scores = self.batcher.map([list(pair) for pair in sentence_pairs])
+        return scores[0] if len(scores) == 1 else scores
@@ -0,0 +1,189 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from typing import Optional
+
+import config
+
+
+def embeddings_to_arrow(embeddings: np.ndarray):
+    """
+    Wraps a contiguous float32 embedding matrix as an Arrow fixed-size list column, without a per-row copy.
+    """
+    import pyarrow as pa
+
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    return pa.FixedSizeListArray.from_arrays(pa.array(embeddings.reshape(-1)), embeddings.shape[1])
+
+
+def to_arrow_table(df: pd.DataFrame, embeddings: np.ndarray, embedding_column: str = 'embeddings'):
+    """
+    Combines the chunk columns of a DataFrame with their embedding matrix into one Arrow table.
+
+    Parameters:
+    - df (pd.DataFrame): The chunk columns, without embeddings.
+    - embeddings (np.ndarray): One embedding per row of df.
+    - embedding_column (str, optional): Name of the embedding column.
+
+    Returns:
+    - pyarrow.Table: The table, the embeddings as a fixed-size list of float32.
+    """
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df.drop(columns=[embedding_column], errors='ignore'), preserve_index=False)
+    return table.append_column(embedding_column, embeddings_to_arrow(embeddings))
+
+
+class ParquetSink:
+    """
+    Appends Arrow tables to one Parquet file, one row group per table.
+
+    Used to stage embedded chunks before the insert, and as a local stand-in for a feature group
+    when benchmarking the write path offline.
+    """
+
+    def __init__(self, path: str, compression: str = 'zstd'):
+        self.path = path
+        self.compression = compression
+        self.rows = 0
+        self._writer = None
+
+    def write(self, table) -> None:
+        import pyarrow.parquet as pq
+
+        if self._writer is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._writer = pq.ParquetWriter(self.path, table.schema, compression=self.compression)
+        self._writer.write_table(table, row_group_size=len(table))
+        self.rows += len(table)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class FeatureGroupSink:
+    """
+    Inserts Arrow tables into a Hopsworks feature group batch by batch.
+
+    Every batch goes to the online store right away, the offline materialization job runs once after the last batch.
+    """
+
+    def __init__(self, feature_group):
+        self.feature_group = feature_group
+        self.rows = 0
+
+    def write(self, table) -> None:
+        self.feature_group.insert(
+            table.to_pandas(),
+            write_options={"start_offline_materialization": False, "wait_for_job": False},
+        )
+        self.rows += len(table)
+
+    def close(self) -> None:
+        if self.rows:
+            self.feature_group.materialization_job.run(await_termination=False)
+
+
+def stage_chunks(df: pd.DataFrame, embeddings: np.ndarray, path: str, batch_rows: int = config.INSERT_BATCH_ROWS,
+                 embedding_column: str = 'embeddings') -> str:
+    """
+    Writes chunks and their embeddings to a Parquet staging file, batch_rows rows at a time.
+
+    Parameters:
+    - df (pd.DataFrame): The chunk columns, without embeddings.
+    - embeddings (np.ndarray): One float32 embedding per row of df.
+    - path (str): The staging file.
+    - batch_rows (int, optional): Rows per row group.
+    - embedding_column (str, optional): Name of the embedding column.
+
+    Returns:
+    - str: The staging file.
+    """
+    if len(df) != len(embeddings):
+        raise ValueError(f"Got {len(embeddings)} embeddings for {len(df)} rows")
+
+    sink = ParquetSink(path)
+    try:
+        for start in range(0, len(df), batch_rows):
+            sink.write(to_arrow_table(
+                df.iloc[start:start + batch_rows],
+                embeddings[start:start + batch_rows],
+                embedding_column,
+            ))
+    finally:
+        sink.close()
+    return path
+
+
+def insert_staged(path: str, sink, batch_rows: int = config.INSERT_BATCH_ROWS) -> int:
+    """
+    Streams a Parquet staging file into a sink, holding only one batch in memory.
+
+    Parameters:
+    - path (str): The staging file.
+    - sink (FeatureGroupSink or ParquetSink): Receives the batches.
+    - batch_rows (int, optional): Rows per batch.
+
+    Returns:
+    - int: Number of rows inserted.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    started = time.perf_counter()
+    rows, batches = 0, 0
+    try:
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+            sink.write(pa.Table.from_batches([batch]))
+            rows += batch.num_rows
+            batches += 1
+    finally:
+        sink.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"[INSERT] {rows} rows in {batches} batches, {rows / max(elapsed, 1e-9):.0f} rows/s")
+    return rows
+
+
+def bulk_insert(df: pd.DataFrame, embeddings: np.ndarray, sink, name: str,
+                staging_path: Optional[str] = config.INSERT_STAGING_PATH, batch_rows: int = config.INSERT_BATCH_ROWS,
+                embedding_column: str = 'embeddings') -> int:
+    """
+    Inserts chunks with their embeddings into a sink in batches of bounded size.
+
+    The chunks are staged as Parquet first, so the embedded data survives a failed insert and the
+    insert only ever holds one batch. The staging file is removed once the insert succeeded.
+
+    Parameters:
+    - df (pd.DataFrame): The chunk columns, without embeddings.
+    - embeddings (np.ndarray): One float32 embedding per row of df.
+    - sink (FeatureGroupSink or ParquetSink): Receives the batches.
+    - name (str): Name of the staging file, usually the feature group name and version.
+    - staging_path (str, optional): Staging directory. None streams the batches to the sink directly.
+    - batch_rows (int, optional): Rows per batch.
+    - embedding_column (str, optional): Name of the embedding column.
+
+    Returns:
+    - int: Number of rows inserted.
+    """
+    if df.empty:
+        return 0
+
+    if staging_path is None:
+        try:
+            for start in range(0, len(df), batch_rows):
+                sink.write(to_arrow_table(df.iloc[start:start + batch_rows], embeddings[start:start + batch_rows],
+                                          embedding_column))
+        finally:
+            sink.close()
+        return len(df)
+
+    path = stage_chunks(df, embeddings, os.path.join(staging_path, f"{name}.parquet"), batch_rows, embedding_column)
+    rows = insert_staged(path, sink, batch_rows)
+    os.remove(path)
+    return rows
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded least-recently-used cache.
+
+    Streamlit serves every session from the same process, so the cache is guarded
+    by a lock and can be shared safely between concurrent chat turns.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        """
+        Parameters:
+        - maxsize (int, optional): Maximum number of entries to keep. Default is 1024.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Return the value stored under key and mark it as most recently used.
+
+        Parameters:
+        - key (Hashable): The cache key.
+        - default (Any, optional): Value returned when the key is not cached. Default is None.
+
+        Returns:
+        - Any: The cached value or default.
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Store value under key, evicting the least recently used entry when full.
+
+        Parameters:
+        - key (Hashable): The cache key.
+        - value (Any): The value to store.
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Remove all entries and reset the hit/miss counters.
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
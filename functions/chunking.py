@@ -0,0 +1,165 @@
+import re
+import pandas as pd
+
+from typing import Iterable, Iterator, Sequence, Tuple
+
+import config
+
+# Paragraph separator of the text extracted by PyPDF2 and joined by gather_portfolio_data
+PARAGRAPH_SEPARATOR = '\n \n'
+
+# Table of contents leaders and separator lines, paragraphs containing them are dropped. One literal
+# pattern each, re searches for a literal far faster than for an alternation or a repeat
+DOT_LEADER_PATTERN = re.compile(r'\.\.\.\.\.')
+SEPARATOR_LINE_PATTERN = re.compile(r'-----')
+
+# Paragraphs holding only a page number, they are dropped rather than merged into the next paragraph
+PAGE_NUMBER_PATTERN = re.compile(r'\s*\d+\s*')
+
+# Last characters of a word that ends a sentence
+SENTENCE_ENDS = ('.', '!', '?')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Number of whitespace-separated words of a text, about 0.75 of its word piece count for English text.
+    """
+    return len(text.split())
+
+
+def split_long(text: str, target_tokens: int = config.CHUNK_TARGET_TOKENS,
+               overlap_tokens: int = config.CHUNK_OVERLAP_TOKENS) -> Iterator[Tuple[str, int]]:
+    """
+    Splits a long text into windows of at most target_tokens words, ending at sentence boundaries where possible.
+
+    Consecutive windows overlap by up to overlap_tokens words, starting at a sentence where possible,
+    so a statement cut by a window boundary is still complete in one of the two chunks.
+
+    Parameters:
+    - text (str): The text to split.
+    - target_tokens (int, optional): Maximum number of words per window.
+    - overlap_tokens (int, optional): Maximum number of words repeated from the end of the previous window.
+
+    Yields:
+    - Tuple[str, int]: The window text, its whitespace normalized, and its number of words.
+    """
+    words = text.split()
+    start = 0
+    while True:
+        end = min(start + target_tokens, len(words))
+        if end < len(words):
+            # End at the last sentence boundary in the second half of the window, if there is one
+            for cut in range(end, start + target_tokens // 2, -1):
+                if words[cut - 1].endswith(SENTENCE_ENDS):
+                    end = cut
+                    break
+        yield ' '.join(words[start:end]), end - start
+        if end >= len(words):
+            return
+
+        # Repeat the end of this window, from the first sentence start within the overlap
+        next_start = max(end - overlap_tokens, start + 1)
+        for cut in range(next_start, end):
+            if words[cut - 1].endswith(SENTENCE_ENDS):
+                next_start = cut
+                break
+        start = next_start
+
+
+def chunk_page(text: str, target_tokens: int = config.CHUNK_TARGET_TOKENS, max_tokens: int = config.CHUNK_MAX_TOKENS,
+               min_tokens: int = config.CHUNK_MIN_TOKENS, overlap_tokens: int = config.CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+    """
+    Chunks the text of one page into pieces of uniform size.
+
+    Consecutive short paragraphs are merged up to target_tokens words, paragraphs above max_tokens
+    are split with overlap. A short last piece is appended to the chunk before it. Page numbers,
+    table of contents lines and pieces below min_tokens that cannot be merged, such as lone headers,
+    are dropped.
+
+    Parameters:
+    - text (str): The page text, paragraphs separated by PARAGRAPH_SEPARATOR.
+    - target_tokens (int, optional): Words per chunk that merging and splitting aim for.
+    - max_tokens (int, optional): Chunks above this many words are split.
+    - min_tokens (int, optional): Chunks below this many words are dropped.
+    - overlap_tokens (int, optional): Words shared by consecutive pieces of a split paragraph.
+
+    Yields:
+    - str: The chunks, in page order.
+    """
+    def pieces():
+        buffer, buffer_tokens = [], 0
+        for paragraph in text.split(PARAGRAPH_SEPARATOR):
+            if (DOT_LEADER_PATTERN.search(paragraph) or SEPARATOR_LINE_PATTERN.search(paragraph)
+                    or PAGE_NUMBER_PATTERN.fullmatch(paragraph)):
+                continue
+            paragraph = paragraph.strip()
+            tokens = estimate_tokens(paragraph)
+            if not tokens:
+                continue
+            if buffer and buffer_tokens >= min_tokens and buffer_tokens + tokens > target_tokens:
+                yield '\n'.join(buffer), buffer_tokens
+                buffer, buffer_tokens = [], 0
+            buffer.append(paragraph)
+            buffer_tokens += tokens
+            if buffer_tokens > max_tokens:
+                yield from split_long('\n'.join(buffer), target_tokens, overlap_tokens)
+                buffer, buffer_tokens = [], 0
+        if buffer:
+            yield '\n'.join(buffer), buffer_tokens
+
+    # Hold back one chunk, so a short piece after it can still be merged into it
+    pending, pending_tokens = None, 0
+    for chunk, tokens in pieces():
+        if pending is not None and tokens < min_tokens and pending_tokens + tokens <= max_tokens:
+            pending, pending_tokens = pending + '\n' + chunk, pending_tokens + tokens
+            continue
+        if pending is not None and pending_tokens >= min_tokens:
+            yield pending
+        pending, pending_tokens = chunk, tokens
+    if pending is not None and pending_tokens >= min_tokens:
+        yield pending
+
+
+def iter_chunks(rows: Iterable[Sequence], **kwargs) -> Iterator[list]:
+    """
+    Streams chunk records from page records, holding one page at a time.
+
+    Parameters:
+    - rows (Iterable[Sequence]): Records whose last field is the page text, such as the
+      [file_title, url, page_number, text] rows of iter_pdf_pages.
+    - kwargs: Chunk sizes, passed on to chunk_page.
+
+    Yields:
+    - list: The fields of the page record before the text, the paragraph number (one based) within
+      the page and the chunk text.
+    """
+    for row in rows:
+        *fields, text = row
+        for paragraph, chunk in enumerate(chunk_page(text, **kwargs), start=1):
+            yield [*fields, paragraph, chunk]
+
+
+def chunk_text_data(df: pd.DataFrame, **kwargs) -> pd.DataFrame:
+    """
+    Chunks every 'text' of a DataFrame, like process_text_data with the 'token' chunker.
+
+    Parameters:
+    - df (pd.DataFrame): One row per page or document with a 'text' column.
+    - kwargs: Chunk sizes, passed on to chunk_page.
+
+    Returns:
+    - pd.DataFrame: One row per chunk with the other columns of its page, the chunk 'text' and a 'paragraph' column.
+    """
+    positions, paragraphs, texts = [], [], []
+    for position, text in enumerate(df['text'].tolist()):
+        for paragraph, chunk in enumerate(chunk_page(text, **kwargs), start=1):
+            positions.append(position)
+            paragraphs.append(paragraph)
+            texts.append(chunk)
+
+    # Gather the page columns of all chunks at once instead of exploding the page rows
+    # without the page texts, which are replaced anyway
+    chunks_df = df.drop(columns='text').iloc[positions].reset_index(drop=True)
+    chunks_df['text'] = texts
+    chunks_df['paragraph'] = paragraphs
+    return chunks_df
@@ -1,38 +1,146 @@
+import os
+import json
+import time
+import hashlib
+import threading
 import requests
 from bs4 import BeautifulSoup
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Union
 
-def fetch_company_website_text(url):
+from functions.http_session import get_session
+
+import config
+
+
+class HostRateLimiter:
+    """
+    Politeness limits per host: at most max_per_host requests in flight and
+    at least min_interval seconds between the starts of two requests to the same host.
+    """
+
+    def __init__(self, max_per_host: int = config.CRAWL_MAX_PER_HOST, min_interval: float = config.CRAWL_MIN_INTERVAL):
+        self.max_per_host = max_per_host
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_start = {}
+
+    @contextmanager
+    def limit(self, url: str):
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.Semaphore(self.max_per_host))
+
+        with semaphore:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start.get(host, now))
+                self._next_start[host] = start + self.min_interval
+            time.sleep(start - now)
+            yield
+
+
+def get_html_parser(parser: str = config.HTML_PARSER) -> str:
+    """
+    Returns the BeautifulSoup parser to use, falling back to html.parser if lxml is not installed.
+    """
+    if parser == "lxml":
+        try:
+            import lxml  # noqa: F401
+        except ImportError:
+            return "html.parser"
+    return parser
+
+
+def get_cache_path(url: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+
+def fetch_company_website_text(url, session: Optional[requests.Session] = None,
+                               rate_limiter: Optional[HostRateLimiter] = None,
+                               timeout=config.CRAWL_TIMEOUT, cache_dir: Optional[str] = config.CRAWL_CACHE_PATH):
     """
     Fetches text from a website using requests + BeautifulSoup.
     Removes script/style content. Returns raw text.
+
+    Pages are requested with If-None-Match / If-Modified-Since when a previous copy is cached
+    in cache_dir, a 304 response returns the cached text without parsing the page again.
     """
+    session = session or get_session('crawler')
+    cache_path = get_cache_path(url, cache_dir) if cache_dir else None
+
+    cached = None
+    headers = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
     try:
-        resp = requests.get(url)
+        if rate_limiter is not None:
+            with rate_limiter.limit(url):
+                resp = session.get(url, headers=headers, timeout=timeout)
+        else:
+            resp = session.get(url, headers=headers, timeout=timeout)
+        if resp.status_code == 304 and cached is not None:
+            return cached['text']
         resp.raise_for_status()
     except requests.RequestException as e:
         print(f"[ERROR] HTTP request failed for {url}: {e}")
         return ""
 
-    soup = BeautifulSoup(resp.text, "html.parser")
+    soup = BeautifulSoup(resp.text, get_html_parser())
     for tag in soup(["script", "style"]):
         tag.decompose()
     text = soup.get_text(separator=" ", strip=True)
+
+    if cache_path and (resp.headers.get('ETag') or resp.headers.get('Last-Modified')):
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, 'w') as f:
+            json.dump({
+                'etag': resp.headers.get('ETag'),
+                'last_modified': resp.headers.get('Last-Modified'),
+                'text': text,
+            }, f)
     return text
 
-def gather_portfolio_data(portfolio, portfolio_name="EQT_X_Portfolio"):
+def gather_portfolio_data(portfolio: Dict[str, Union[str, List[str]]], portfolio_name="EQT_X_Portfolio",
+                          workers: int = config.CRAWL_WORKERS, session: Optional[requests.Session] = None,
+                          rate_limiter: Optional[HostRateLimiter] = None):
     """
     Visits each portfolio company's URL, scrapes basic text,
     and returns a dict {company_name: text_content}.
+
+    A company may list several pages, their texts are joined as separate paragraphs and the
+    first url is reported. All pages are fetched concurrently by at most `workers` threads,
+    while the rate limiter keeps the load on every single host polite.
     """
-    data = []
-    for name, url in portfolio.items():
+    rate_limiter = rate_limiter or HostRateLimiter()
+    companies = {name: [urls] if isinstance(urls, str) else list(urls) for name, urls in portfolio.items()}
+
+    def fetch(name, url):
         print(f"[SCRAPE] Fetching data for {name} from {url}")
-        text = fetch_company_website_text(url)
-        data.append({
-                "company_name": name,
-                "url": url,
-                "text": text, 
-                "source": portfolio_name
-            })
-    return data
+        return fetch_company_website_text(url, session=session, rate_limiter=rate_limiter)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {
+            name: [executor.submit(fetch, name, url) for url in urls]
+            for name, urls in companies.items()
+        }
 
+        data = []
+        for name, urls in companies.items():
+            texts = [future.result() for future in futures[name]]
+            data.append({
+                    "company_name": name,
+                    "url": urls[0],
+                    "text": '\n \n'.join(text for text in texts if text),
+                    "source": portfolio_name
+                })
+    return data
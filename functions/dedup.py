@@ -0,0 +1,164 @@
+import re
+import zlib
+import hashlib
+import numpy as np
+
+from collections import defaultdict
+from typing import List, Optional
+
+import config
+
+# Mersenne prime of the MinHash permutations (a * x + b) mod p
+MINHASH_PRIME = (1 << 31) - 1
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def mmr(query_embedding, embeddings, k: Optional[int] = None, mmr_lambda: float = config.MMR_LAMBDA,
+        duplicate_threshold: Optional[float] = config.MMR_DUPLICATE_THRESHOLD) -> List[int]:
+    """
+    Maximal marginal relevance selection over a candidate embedding matrix.
+
+    Every step picks the candidate maximizing mmr_lambda * relevance - (1 - mmr_lambda) * its highest
+    similarity to the candidates already picked. Candidates at least duplicate_threshold similar to a
+    picked one are dropped as near-duplicates.
+
+    Parameters:
+    - query_embedding (np.ndarray): The query embedding.
+    - embeddings (np.ndarray): One embedding per candidate.
+    - k (int, optional): Number of candidates to pick. None picks all that are not near-duplicates.
+    - mmr_lambda (float, optional): Weight of relevance against diversity, 1 ranks by relevance only.
+    - duplicate_threshold (float, optional): Cosine similarity above which candidates count as duplicates. None keeps them.
+
+    Returns:
+    - List[int]: Indices of the picked candidates, in the order they were picked.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query = query / max(np.linalg.norm(query), 1e-12)
+
+    relevance = embeddings @ query
+    similarity = embeddings @ embeddings.T
+
+    n = len(embeddings)
+    k = n if k is None else min(k, n)
+    available = np.ones(n, dtype=bool)
+    max_similarity = np.zeros(n, dtype=np.float32)
+
+    selected = []
+    while len(selected) < k and available.any():
+        scores = relevance if not selected else mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        i = int(np.argmax(np.where(available, scores, -np.inf)))
+        selected.append(i)
+        available[i] = False
+        if duplicate_threshold is not None:
+            available &= similarity[i] < duplicate_threshold
+        np.maximum(max_similarity, similarity[i], out=max_similarity)
+
+    return selected
+
+
+def get_shingles(text: str, size: int = 3) -> List[str]:
+    """
+    Word n-grams of a lowercased text, the whole text if it has fewer than size words.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    return [' '.join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))]
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """
+    64-bit SimHash of the word shingles of a text. Near-identical texts differ in few bits.
+    """
+    hashes = np.frombuffer(
+        b''.join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in get_shingles(text, shingle_size)),
+        dtype=np.uint8,
+    ).reshape(-1, 8)
+    bits = np.unpackbits(hashes, axis=1).astype(np.int32)
+    fingerprint = np.packbits(bits.sum(axis=0) * 2 > len(bits))
+    return int.from_bytes(fingerprint.tobytes(), 'big')
+
+
+def get_minhash_permutations(num_perm: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signature(text: str, a: np.ndarray, b: np.ndarray, shingle_size: int = 3) -> np.ndarray:
+    """
+    MinHash signature of the word shingles of a text, one minimum per (a, b) permutation.
+    """
+    shingles = np.array([zlib.crc32(shingle.encode('utf-8')) for shingle in set(get_shingles(text, shingle_size))],
+                        dtype=np.uint64)
+    return ((np.outer(shingles, a) + b) % MINHASH_PRIME).min(axis=0)
+
+
+def get_lsh_bands(num_perm: int, threshold: float) -> int:
+    """
+    Number of LSH bands whose candidate threshold (1 / bands) ** (1 / rows) is closest to the Jaccard threshold.
+    """
+    divisors = [bands for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(divisors, key=lambda bands: abs((1 / bands) ** (bands / num_perm) - threshold))
+
+
+def find_near_duplicates(texts: List[str], method: str = "simhash",
+                         max_distance: int = config.SIMHASH_MAX_DISTANCE,
+                         threshold: float = config.MINHASH_THRESHOLD,
+                         num_perm: int = config.MINHASH_NUM_PERM) -> np.ndarray:
+    """
+    Flag texts that nearly duplicate an earlier text.
+
+    Candidate pairs are found by locality-sensitive hashing and then verified, so the cost grows
+    with the number of texts rather than the number of pairs.
+
+    Parameters:
+    - texts (List[str]): The texts, earlier texts are kept over later duplicates.
+    - method (str, optional): 'simhash' (Hamming distance of 64-bit fingerprints) or 'minhash' (estimated Jaccard similarity of word shingles).
+    - max_distance (int, optional): Maximum Hamming distance of SimHash duplicates.
+    - threshold (float, optional): Minimum estimated Jaccard similarity of MinHash duplicates.
+    - num_perm (int, optional): Number of MinHash permutations.
+
+    Returns:
+    - np.ndarray: Boolean mask, True for every text that duplicates an earlier one.
+    """
+    if method == "simhash":
+        fingerprints = [simhash(text) for text in texts]
+        # Two fingerprints within max_distance bits agree exactly on at least one of max_distance + 1 bands
+        n_bands = max_distance + 1
+        band_bits = 64 // n_bands
+        keys = [
+            [(band, (fingerprint >> (band * band_bits)) & ((1 << band_bits) - 1)) for band in range(n_bands)]
+            for fingerprint in fingerprints
+        ]
+
+        def is_duplicate(i, j):
+            return bin(fingerprints[i] ^ fingerprints[j]).count('1') <= max_distance
+    elif method == "minhash":
+        a, b = get_minhash_permutations(num_perm)
+        signatures = [minhash_signature(text, a, b) for text in texts]
+        n_bands = get_lsh_bands(num_perm, threshold)
+        rows = num_perm // n_bands
+        keys = [
+            [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(n_bands)]
+            for signature in signatures
+        ]
+
+        def is_duplicate(i, j):
+            return np.mean(signatures[i] == signatures[j]) >= threshold
+    else:
+        raise ValueError(f"Unknown dedup method '{method}', expected 'simhash' or 'minhash'")
+
+    buckets = defaultdict(list)
+    duplicates = np.zeros(len(texts), dtype=bool)
+    for i, text_keys in enumerate(keys):
+        candidates = {j for key in text_keys for j in buckets[key]}
+        if any(is_duplicate(i, j) for j in candidates):
+            duplicates[i] = True
+            continue
+        # Only kept texts become candidates of later ones
+        for key in text_keys:
+            buckets[key].append(i)
+    return duplicates
@@ -0,0 +1,165 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+from typing import List, Union
+
+from functions.caching import LRUCache
+
+import config
+
+# Arguments of SentenceTransformer.encode that do not change the returned embeddings, left out of the cache key
+NEUTRAL_ENCODE_KWARGS = {'batch_size', 'show_progress_bar', 'device', 'convert_to_numpy'}
+
+
+def normalize_text(text: str) -> str:
+    """
+    Collapses whitespace so that formatting-only differences map to the same cache entry.
+    """
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def get_text_hash(text: str) -> str:
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class EmbeddingService:
+    """
+    SentenceTransformer wrapper with a persistent embedding cache.
+
+    Embeddings are stored in SQLite keyed by (model name and encode options, normalized text hash),
+    or only in the in-memory LRU without a cache_path. Only cache misses are sent to the model, in batches. The service can be passed anywhere a
+    SentenceTransformer is used to encode queries or chunks, such as get_neighbors and get_context_and_source.
+    """
+
+    def __init__(self, sentence_transformer, model_name: str, cache_path: str = config.EMBEDDING_CACHE_PATH,
+                 batch_size: int = config.EMBEDDING_BATCH_SIZE, memory_cache_size: int = 1024):
+        """
+        Parameters:
+        - sentence_transformer (SentenceTransformer): The sentence transformer model.
+        - model_name (str): Name of the model, part of every cache key.
+        - cache_path (str, optional): SQLite file holding the cached embeddings. None keeps only the in-memory LRU,
+          so that encoding never writes to disk.
+        - batch_size (int, optional): Number of texts encoded per model call.
+        - memory_cache_size (int, optional): Number of embeddings kept in an in-memory LRU in front of SQLite.
+        """
+        self.sentence_transformer = sentence_transformer
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.memory_cache = LRUCache(maxsize=memory_cache_size)
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = None
+        if cache_path is None:
+            return
+
+        if os.path.dirname(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self._connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, embedding BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._connection.commit()
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.sentence_transformer.get_sentence_embedding_dimension()
+
+    def encode(self, texts: Union[str, List[str]], **kwargs) -> np.ndarray:
+        """
+        Encodes one or more texts, reusing cached embeddings where available.
+
+        Parameters:
+        - texts (Union[str, List[str]]): A single text or a list (or Series) of texts.
+        - kwargs: Passed on to SentenceTransformer.encode for the cache misses. Options that change the
+          embeddings, such as normalize_embeddings or precision, are part of the cache key.
+
+        Returns:
+        - np.ndarray: A float32 vector for a single text, or a matrix with one row per text.
+        """
+        if isinstance(texts, str):
+            return self.encode([texts], **kwargs)[0]
+
+        batch_size = kwargs.pop('batch_size', self.batch_size)
+        model_key = self.get_model_key(kwargs)
+        texts = list(texts)
+        hashes = [get_text_hash(text) for text in texts]
+        embeddings = [self.memory_cache.get((model_key, text_hash)) for text_hash in hashes]
+
+        # Look up the remaining texts in the persistent cache
+        pending = {text_hash for text_hash, embedding in zip(hashes, embeddings) if embedding is None}
+        stored = self._load(model_key, pending)
+
+        missing = {}
+        for i, text_hash in enumerate(hashes):
+            if embeddings[i] is None and text_hash in stored:
+                embeddings[i] = stored[text_hash]
+            elif embeddings[i] is None:
+                missing.setdefault(text_hash, []).append(i)
+
+        # Both count texts, a text repeated in one call counts once per occurrence
+        missing_count = sum(len(positions) for positions in missing.values())
+        self.hits += len(texts) - missing_count
+        self.misses += missing_count
+
+        if missing:
+            missing_hashes = list(missing)
+            missing_texts = [texts[missing[text_hash][0]] for text_hash in missing_hashes]
+            new_embeddings = np.asarray(
+                self.sentence_transformer.encode(missing_texts, batch_size=batch_size, **kwargs),
+                dtype=np.float32,
+            )
+            self._store(model_key, missing_hashes, new_embeddings)
+            for text_hash, embedding in zip(missing_hashes, new_embeddings):
+                for i in missing[text_hash]:
+                    embeddings[i] = embedding
+
+        for text_hash, embedding in zip(hashes, embeddings):
+            self.memory_cache.put((model_key, text_hash), embedding)
+
+        if not embeddings:
+            return np.empty((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.vstack(embeddings)
+
+    def get_model_key(self, kwargs: dict) -> str:
+        """
+        Model part of the cache key: the model name, followed by the encode options that change the embeddings.
+        """
+        options = sorted((name, value) for name, value in kwargs.items() if name not in NEUTRAL_ENCODE_KWARGS)
+        if not options:
+            return self.model_name
+        return self.model_name + '?' + '&'.join(f"{name}={value}" for name, value in options)
+
+    def _load(self, model_key: str, hashes: set) -> dict:
+        stored = {}
+        if self._connection is None:
+            return stored
+        hashes = list(hashes)
+        with self._lock:
+            # Stay below SQLite's limit on query parameters
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT text_hash, embedding FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(chunk))})",
+                    [model_key, *chunk],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    stored[text_hash] = np.frombuffer(blob, dtype=np.float32)
+        return stored
+
+    def _store(self, model_key: str, hashes: List[str], embeddings: np.ndarray) -> None:
+        if self._connection is None:
+            return
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, embedding) VALUES (?, ?, ?)",
+                [(model_key, text_hash, embedding.tobytes()) for text_hash, embedding in zip(hashes, embeddings)],
+            )
+            self._connection.commit()
@@ -0,0 +1,33 @@
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+
+import config
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def get_session(name: str = 'default', pool_size: int = config.HTTP_POOL_SIZE) -> requests.Session:
+    """
+    Returns a process-wide requests.Session with a connection pool, created on first use.
+
+    Sessions are keyed by name so that independent clients (downloads, scraping, LLM calls)
+    do not compete for the same pool.
+
+    Parameters:
+    - name (str, optional): Name of the session. Default is 'default'.
+    - pool_size (int, optional): Maximum number of pooled connections per host.
+
+    Returns:
+    - requests.Session: The shared session.
+    """
+    with _lock:
+        if name not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[name] = session
+        return _sessions[name]
@@ -0,0 +1,124 @@
+import os
+import json
+import pandas as pd
+
+from typing import Dict, Iterable, List, Set, Tuple
+
+import config
+
+
+def get_manifest_path(name: str, path: str = config.MANIFEST_PATH) -> str:
+    return os.path.join(path, f"{name}.json")
+
+
+def load_manifest(name: str, path: str = config.MANIFEST_PATH) -> Set[int]:
+    """
+    Loads the context ids that are already indexed in a feature group.
+
+    Parameters:
+    - name (str): Manifest name, usually the feature group name and version.
+    - path (str, optional): Directory holding the manifests.
+
+    Returns:
+    - Set[int]: The indexed context ids, empty on the first run.
+    """
+    manifest_path = get_manifest_path(name, path)
+    if not os.path.exists(manifest_path):
+        return set()
+    with open(manifest_path) as f:
+        return set(json.load(f)['context_ids'])
+
+
+def save_manifest(name: str, context_ids: Iterable[int], path: str = config.MANIFEST_PATH) -> None:
+    """
+    Saves the context ids that are indexed in a feature group.
+
+    The file is written to a temporary path first and renamed, so a crash never leaves a partial manifest.
+
+    Parameters:
+    - name (str): Manifest name, usually the feature group name and version.
+    - context_ids (Iterable[int]): All context ids currently in the feature group.
+    - path (str, optional): Directory holding the manifests.
+    """
+    os.makedirs(path, exist_ok=True)
+    manifest_path = get_manifest_path(name, path)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump({'context_ids': sorted(int(i) for i in context_ids)}, f)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def get_delta(df: pd.DataFrame, indexed_ids: Set[int]) -> Tuple[pd.DataFrame, List[int]]:
+    """
+    Splits a freshly processed DataFrame into the chunks to upsert and the chunk ids to delete.
+
+    Parameters:
+    - df (pd.DataFrame): DataFrame with a 'context_id' column, as returned by add_context_ids.
+    - indexed_ids (Set[int]): The context ids already indexed, as returned by load_manifest.
+
+    Returns:
+    - Tuple[pd.DataFrame, List[int]]: The new or changed chunks and the ids of chunks that disappeared.
+    """
+    new_df = df[~df['context_id'].isin(indexed_ids)].reset_index(drop=True)
+    deleted_ids = sorted(indexed_ids - set(df['context_id']))
+
+    print(f"[DELTA] {len(df)} chunks: {len(new_df)} new or changed, "
+          f"{len(df) - len(new_df)} unchanged, {len(deleted_ids)} deleted")
+    return new_df, deleted_ids
+
+
+def delete_chunks(feature_group, deleted_ids: List[int]) -> None:
+    """
+    Deletes chunks that no longer exist upstream from a feature group.
+
+    Parameters:
+    - feature_group (FeatureGroup): The feature group keyed by 'context_id'.
+    - deleted_ids (List[int]): The context ids to delete.
+    """
+    if not deleted_ids:
+        return
+    feature_group.commit_delete_record(pd.DataFrame({'context_id': deleted_ids}))
+
+
+def get_checkpoint_path(name: str, path: str = config.INGEST_CHECKPOINT_PATH) -> str:
+    return os.path.join(path, f"{name}.json")
+
+
+def load_checkpoint(name: str, path: str = config.INGEST_CHECKPOINT_PATH) -> Dict[str, Set]:
+    """
+    Loads the progress of an interrupted ingestion run.
+
+    Parameters:
+    - name (str): Manifest name, usually the feature group name and version.
+    - path (str, optional): Directory holding the checkpoints.
+
+    Returns:
+    - Dict[str, Set]: The keys of the finished units of work ('completed'), the context ids they produced
+      ('seen_ids') and the ones inserted into the feature group ('inserted_ids'). All empty without a checkpoint.
+    """
+    checkpoint_path = get_checkpoint_path(name, path)
+    if not os.path.exists(checkpoint_path):
+        return {'completed': set(), 'seen_ids': set(), 'inserted_ids': set()}
+    with open(checkpoint_path) as f:
+        return {key: set(values) for key, values in json.load(f).items()}
+
+
+def save_checkpoint(name: str, checkpoint: Dict[str, Set], path: str = config.INGEST_CHECKPOINT_PATH) -> None:
+    """
+    Saves the progress of an ingestion run, atomically like save_manifest.
+
+    Parameters:
+    - name (str): Manifest name, usually the feature group name and version.
+    - checkpoint (Dict[str, Set]): As returned by load_checkpoint.
+    - path (str, optional): Directory holding the checkpoints.
+    """
+    os.makedirs(path, exist_ok=True)
+    checkpoint_path = get_checkpoint_path(name, path)
+    with open(checkpoint_path + '.tmp', 'w') as f:
+        json.dump({key: sorted(values) for key, values in checkpoint.items()}, f)
+    os.replace(checkpoint_path + '.tmp', checkpoint_path)
+
+
+def remove_checkpoint(name: str, path: str = config.INGEST_CHECKPOINT_PATH) -> None:
+    checkpoint_path = get_checkpoint_path(name, path)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
@@ -0,0 +1,271 @@
+import os
+import time
+import numpy as np
+
+from typing import Dict, List, Sequence, Tuple, Union
+
+import config
+
+BACKENDS = ("torch", "int8", "onnx")
+
+
+def get_model_id(model_name: str, backend: str = config.INFERENCE_BACKEND) -> str:
+    """
+    Name under which outputs of a model are cached. Quantized and exported models get their own name,
+    since their outputs differ slightly from the fp32 model.
+    """
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+def get_export_path(model_name: str, export_path: str = config.ONNX_EXPORT_PATH) -> str:
+    return os.path.join(export_path, model_name.replace('/', '__'))
+
+
+def check_backend(backend: str) -> None:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {BACKENDS}")
+    if backend != "torch" and config.DEVICE != "cpu":
+        print(f"[BACKEND] The '{backend}' backend runs on the CPU, ignoring device {config.DEVICE}")
+
+
+def quantize_dynamic(model):
+    """
+    Replaces the Linear layers of a PyTorch model by int8 dynamically quantized ones, in place.
+    """
+    import torch
+
+    return torch.quantization.quantize_dynamic(model.cpu(), {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def load_sentence_transformer(model_name: str = config.MODEL_SENTENCE_TRANSFORMER,
+                              backend: str = config.INFERENCE_BACKEND,
+                              optimization_level: str = config.ONNX_OPTIMIZATION_LEVEL):
+    """
+    Load the sentence transformer with the given inference backend.
+
+    Parameters:
+    - model_name (str, optional): The sentence transformer model.
+    - backend (str, optional): 'torch' (fp32 on config.DEVICE), 'int8' (dynamic int8 quantization on the CPU)
+      or 'onnx' (ONNX Runtime on the CPU, exported once to config.ONNX_EXPORT_PATH).
+    - optimization_level (str, optional): ONNX Runtime graph optimization level of the export, 'O1' to 'O3'.
+
+    Returns:
+    - SentenceTransformer: The model, its encode signature does not depend on the backend.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    check_backend(backend)
+    if backend == "torch":
+        return SentenceTransformer(model_name).to(config.DEVICE)
+
+    if backend == "int8":
+        sentence_transformer = SentenceTransformer(model_name, device="cpu")
+        quantize_dynamic(sentence_transformer)
+        return sentence_transformer
+
+    from sentence_transformers import export_optimized_onnx_model
+
+    path = get_export_path(model_name)
+    file_name = f"onnx/model_{optimization_level}.onnx"
+    if not os.path.exists(os.path.join(path, file_name)):
+        print(f"[BACKEND] Exporting {model_name} to ONNX ({optimization_level})")
+        sentence_transformer = SentenceTransformer(model_name, device="cpu", backend="onnx")
+        sentence_transformer.save(path)
+        export_optimized_onnx_model(sentence_transformer, optimization_level, path)
+    return SentenceTransformer(path, device="cpu", backend="onnx", model_kwargs={"file_name": file_name})
+
+
+class OnnxReranker:
+    """
+    Cross-encoder on ONNX Runtime with the compute_score interface of FlagReranker.
+    """
+
+    def __init__(self, model_name: str, optimization_level: str = config.ONNX_OPTIMIZATION_LEVEL):
+        """
+        Parameters:
+        - model_name (str): The cross-encoder model, exported once to config.ONNX_EXPORT_PATH.
+        - optimization_level (str, optional): ONNX Runtime graph optimization level of the export, 'O1' to 'O3'.
+        """
+        from optimum.onnxruntime import ORTModelForSequenceClassification, ORTOptimizer
+        from optimum.onnxruntime.configuration import AutoOptimizationConfig
+        from transformers import AutoTokenizer
+
+        path = os.path.join(get_export_path(model_name), optimization_level)
+        if not os.path.exists(os.path.join(path, "model_optimized.onnx")):
+            print(f"[BACKEND] Exporting {model_name} to ONNX ({optimization_level})")
+            model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+            ORTOptimizer.from_pretrained(model).optimize(
+                save_dir=path,
+                optimization_config=AutoOptimizationConfig.with_optimization_level(optimization_level),
+            )
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(path)
+
+        self.model = ORTModelForSequenceClassification.from_pretrained(path, file_name="model_optimized.onnx")
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+
+    def compute_score(self, sentence_pairs: Union[List[List[str]], List[str]], batch_size: int = 32,
+                      max_length: int = 512) -> Union[float, List[float]]:
+        """
+        Scores (query, passage) pairs. Like FlagReranker, a single pair returns a plain float.
+        """
+        if isinstance(sentence_pairs[0], str):
+            sentence_pairs = [sentence_pairs]
+
+        # Batch pairs of similar length together to limit padding
+        order = np.argsort([-len(query) - len(passage) for query, passage in sentence_pairs], kind='stable')
+        scores = np.empty(len(sentence_pairs), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            inputs = self.tokenizer(
+                [list(sentence_pairs[i]) for i in batch],
+                padding=True,
+                truncation=True,
+                max_length=max_length,
+                return_tensors='np',
+            )
+            scores[batch] = np.asarray(self.model(**inputs).logits).reshape(-1)
+
+        scores = scores.tolist()
+        return scores[0] if len(scores) == 1 else scores
+
+
+def load_reranker(model_name: str = config.RERANKER, backend: str = config.INFERENCE_BACKEND,
+                  optimization_level: str = config.ONNX_OPTIMIZATION_LEVEL):
+    """
+    Load the cross-encoder reranker with the given inference backend.
+
+    Parameters:
+    - model_name (str, optional): The reranker model.
+    - backend (str, optional): 'torch', 'int8' or 'onnx', see load_sentence_transformer.
+    - optimization_level (str, optional): ONNX Runtime graph optimization level of the export, 'O1' to 'O3'.
+
+    Returns:
+    - FlagReranker or OnnxReranker: The reranker, both provide compute_score.
+    """
+    check_backend(backend)
+    if backend == "onnx":
+        return OnnxReranker(model_name, optimization_level)
+
+    from FlagEmbedding import FlagReranker
+
+    # fp16 only pays off on a GPU, on the CPU it is emulated
+    reranker = FlagReranker(model_name, use_fp16=backend == "torch" and config.DEVICE == "cuda")
+    if backend == "int8":
+        # FlagReranker keeps the model and its device in these attributes as of the FlagEmbedding pinned in requirements.txt
+        reranker.model = quantize_dynamic(reranker.model)
+        reranker.device = "cpu"
+    return reranker
+
+
+def get_ranks(values: np.ndarray) -> np.ndarray:
+    return np.argsort(np.argsort(values, kind='stable'), kind='stable').astype(np.float64)
+
+
+def spearman(a: Sequence[float], b: Sequence[float]) -> float:
+    """
+    Spearman rank correlation of two score lists.
+    """
+    ranks_a, ranks_b = get_ranks(np.asarray(a)), get_ranks(np.asarray(b))
+    if ranks_a.std() == 0 or ranks_b.std() == 0:
+        return 1.0
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+
+def top_k_agreement(a: Sequence[float], b: Sequence[float], k: int) -> float:
+    """
+    Share of the top-k items of the reference scores a that are also in the top-k of b.
+    """
+    k = min(k, len(a))
+    if k == 0:
+        return 1.0
+    top_a = set(np.argsort(-np.asarray(a), kind='stable')[:k])
+    top_b = set(np.argsort(-np.asarray(b), kind='stable')[:k])
+    return len(top_a & top_b) / k
+
+
+def embedding_parity(reference, candidate, queries: List[str], passages: List[str], k: int = 10) -> Dict[str, float]:
+    """
+    Compare a sentence transformer backend against the fp32 reference.
+
+    Parameters:
+    - reference (SentenceTransformer): The fp32 model.
+    - candidate (SentenceTransformer): The model on the backend under test.
+    - queries (List[str]): Queries searched against the passages.
+    - passages (List[str]): The corpus.
+    - k (int, optional): Depth of the retrieval agreement.
+
+    Returns:
+    - Dict[str, float]: Mean and minimum cosine similarity of the embeddings, top-k retrieval
+      agreement, Spearman correlation of the query-passage similarities and the speed-up of encoding the passages.
+    """
+    def encode(model, texts):
+        started = time.perf_counter()
+        embeddings = np.asarray(model.encode(texts, batch_size=config.EMBEDDING_BATCH_SIZE), dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings, time.perf_counter() - started
+
+    reference_passages, reference_seconds = encode(reference, passages)
+    candidate_passages, candidate_seconds = encode(candidate, passages)
+    reference_queries, _ = encode(reference, queries)
+    candidate_queries, _ = encode(candidate, queries)
+
+    cosine = np.sum(reference_passages * candidate_passages, axis=1)
+    reference_scores = reference_queries @ reference_passages.T
+    candidate_scores = candidate_queries @ candidate_passages.T
+
+    return {
+        'cosine_mean': float(cosine.mean()),
+        'cosine_min': float(cosine.min()),
+        f'top_{k}_agreement': float(np.mean([top_k_agreement(r, c, k) for r, c in zip(reference_scores, candidate_scores)])),
+        'spearman': float(np.mean([spearman(r, c) for r, c in zip(reference_scores, candidate_scores)])),
+        'speedup': reference_seconds / candidate_seconds,
+    }
+
+
+def reranker_parity(reference, candidate, queries_and_passages: List[Tuple[str, List[str]]], k: int = 3,
+                    batch_size: int = config.RERANKER_BATCH_SIZE,
+                    max_length: int = config.RERANKER_MAX_LENGTH) -> Dict[str, float]:
+    """
+    Compare a reranker backend against the fp32 reference.
+
+    Parameters:
+    - reference (FlagReranker): The fp32 reranker.
+    - candidate: The reranker on the backend under test.
+    - queries_and_passages (List[Tuple[str, List[str]]]): Every query with the candidate passages to rank.
+    - k (int, optional): Depth of the ranking agreement, the number of contexts kept after reranking.
+    - batch_size (int, optional): Number of pairs per forward pass.
+    - max_length (int, optional): Maximum sequence length of a pair in tokens.
+
+    Returns:
+    - Dict[str, float]: Mean and maximum absolute score drift, top-k agreement, Spearman correlation
+      of the rankings, the pairs scored per second by both rerankers and the speed-up.
+    """
+    drift, agreement, correlation = [], [], []
+    reference_seconds, candidate_seconds, n_pairs = 0.0, 0.0, 0
+
+    for query, passages in queries_and_passages:
+        pairs = [[query, passage] for passage in passages]
+        n_pairs += len(pairs)
+
+        started = time.perf_counter()
+        reference_scores = np.atleast_1d(reference.compute_score(pairs, batch_size=batch_size, max_length=max_length))
+        reference_seconds += time.perf_counter() - started
+
+        started = time.perf_counter()
+        candidate_scores = np.atleast_1d(candidate.compute_score(pairs, batch_size=batch_size, max_length=max_length))
+        candidate_seconds += time.perf_counter() - started
+
+        drift.append(np.abs(reference_scores - candidate_scores))
+        agreement.append(top_k_agreement(reference_scores, candidate_scores, k))
+        correlation.append(spearman(reference_scores, candidate_scores))
+
+    drift = np.concatenate(drift)
+    return {
+        'score_drift_mean': float(drift.mean()),
+        'score_drift_max': float(drift.max()),
+        f'top_{k}_agreement': float(np.mean(agreement)),
+        'spearman': float(np.mean(correlation)),
+        'reference_pairs_per_s': n_pairs / reference_seconds,
+        'candidate_pairs_per_s': n_pairs / candidate_seconds,
+        'speedup': reference_seconds / candidate_seconds,
+    }
@@ -0,0 +1,158 @@
+import time
+import random
+import requests
+
+from typing import Callable, Optional, TypeVar
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from functions.http_session import get_session
+
+import config
+
+T = TypeVar('T')
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Decides whether a failed LLM call is worth another attempt: rate limits, server errors and network failures.
+    """
+    import openai
+
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, openai.APIConnectionError)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRY_STATUS_CODES
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRY_STATUS_CODES
+    return False
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    value = response.headers.get('Retry-After') if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def call_with_retries(fn: Callable[[], T], max_retries: int = config.LLM_MAX_RETRIES,
+                      backoff: float = config.LLM_BACKOFF, max_backoff: float = config.LLM_MAX_BACKOFF) -> T:
+    """
+    Calls fn, retrying retryable failures with exponential backoff and jitter.
+
+    Parameters:
+    - fn (Callable): The call to make.
+    - max_retries (int, optional): Number of retries after the first attempt.
+    - backoff (float, optional): Delay before the first retry in seconds, doubled on every retry.
+    - max_backoff (float, optional): Upper bound of a single delay in seconds, also caps the server's Retry-After.
+
+    Returns:
+    - The result of fn. The last error is raised when all attempts fail.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            retry_after = get_retry_after(e)
+            if retry_after:
+                delay = min(retry_after, max_backoff)
+            else:
+                delay = min(backoff * 2 ** attempt, max_backoff) * (0.5 + random.random() / 2)
+            print(f"[LLM] Attempt {attempt + 1} failed ({e}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+def post_with_retries(url: str, json: dict, session: Optional[requests.Session] = None,
+                      timeout=config.LLM_TIMEOUT, stream: bool = False, **retry_kwargs) -> requests.Response:
+    """
+    POSTs JSON over the shared LLM session with connect/read timeouts and retries on 429/5xx.
+
+    Parameters:
+    - url (str): The endpoint.
+    - json (dict): The request body.
+    - session (requests.Session, optional): Session to use. Default is the shared 'llm' session.
+    - timeout (Tuple[float, float], optional): Connect and read timeouts in seconds.
+    - stream (bool, optional): Leave the body unread so it can be consumed incrementally.
+    - retry_kwargs: Passed on to call_with_retries.
+
+    Returns:
+    - requests.Response: A successful response.
+    """
+    session = session or get_session('llm')
+
+    def post():
+        response = session.post(url, headers={"Content-Type": "application/json"}, json=json,
+                                timeout=timeout, stream=stream)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+        return response
+
+    return call_with_retries(post, **retry_kwargs)
+
+
+def configure_openai_client(client, timeout=config.LLM_TIMEOUT):
+    """
+    Returns a copy of an OpenAI client with connect/read timeouts, leaving retries to call_with_retries.
+    """
+    import httpx
+
+    connect_timeout, read_timeout = timeout
+    return client.with_options(
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        max_retries=0,
+    )
+
+
+def hedged_call(primary: Callable[[], T], secondary: Callable[[], T], budget: float = config.LLM_HEDGE_BUDGET,
+                is_valid: Callable[[T], bool] = lambda result: result is not None) -> T:
+    """
+    Calls primary and, if it has not answered within the latency budget, also secondary.
+
+    The first valid result wins. If primary fails before the budget runs out, secondary is fired immediately.
+
+    Parameters:
+    - primary (Callable): The preferred provider call.
+    - secondary (Callable): The fallback provider call.
+    - budget (float, optional): Seconds to wait for primary before hedging.
+    - is_valid (Callable, optional): Decides whether a result counts as an answer. Default accepts anything but None.
+
+    Returns:
+    - The first valid result. The last error is raised, or None returned, when both calls fail.
+    """
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        pending = {executor.submit(primary): 'primary'}
+        done, _ = wait(pending, timeout=budget)
+        if not done or not _succeeded(next(iter(done)), is_valid):
+            print(f"[LLM] Primary provider did not answer within {budget}s, hedging")
+            pending[executor.submit(secondary)] = 'secondary'
+
+        error, result = None, None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                del pending[future]
+                if _succeeded(future, is_valid):
+                    return future.result()
+                if future.exception() is not None:
+                    error = future.exception()
+                else:
+                    result = future.result()
+        if error is not None:
+            raise error
+        return result
+    finally:
+        # Do not wait for the slower call
+        executor.shutdown(wait=False)
+
+
+def _succeeded(future, is_valid: Callable) -> bool:
+    return future.exception() is None and is_valid(future.result())
@@ -0,0 +1,200 @@
+import os
+import time
+import threading
+import numpy as np
+
+from multiprocessing import get_context
+from typing import List, Optional, Union
+
+from functions.inference_backends import load_sentence_transformer
+from functions.tokenizer import count_tokens
+
+import config
+
+# The sentence transformer of an encoder worker process, loaded once by _init_worker
+_worker_model = None
+
+
+def get_token_lengths(sentence_transformer, texts: List[str]) -> np.ndarray:
+    """
+    Number of tokens of every text as the model sees it, after truncation to its max_seq_length.
+
+    Models without a tokenizer attribute are measured with the local prompt tokenizer instead.
+    """
+    max_length = getattr(sentence_transformer, 'max_seq_length', None) or 512
+    tokenizer = getattr(sentence_transformer, 'tokenizer', None)
+    if tokenizer is None:
+        return np.minimum([count_tokens(text) for text in texts], max_length).astype(np.int64)
+
+    input_ids = tokenizer(texts, truncation=True, max_length=max_length)['input_ids']
+    return np.array([len(ids) for ids in input_ids], dtype=np.int64)
+
+
+def make_batches(lengths: np.ndarray, max_batch_tokens: int = config.ENCODE_MAX_BATCH_TOKENS,
+                 max_batch_size: int = config.ENCODE_MAX_BATCH_SIZE) -> List[np.ndarray]:
+    """
+    Groups texts of similar token length into batches of at most max_batch_tokens padded tokens.
+
+    Texts are sorted longest first, so every batch is padded to the length of its first text and
+    batches of short texts hold more texts than batches of long ones.
+
+    Parameters:
+    - lengths (np.ndarray): Token length of every text.
+    - max_batch_tokens (int, optional): Maximum of batch size times the longest text of the batch.
+    - max_batch_size (int, optional): Maximum number of texts per batch.
+
+    Returns:
+    - List[np.ndarray]: Indices into lengths, one array per batch.
+    """
+    lengths = np.asarray(lengths)
+    order = np.argsort(-lengths, kind='stable')
+
+    batches, start = [], 0
+    while start < len(order):
+        longest = max(int(lengths[order[start]]), 1)
+        size = max(min(max_batch_tokens // longest, max_batch_size), 1)
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+
+def _init_worker(model_name: str, backend: str, threads: int) -> None:
+    global _worker_model
+    import torch
+
+    torch.set_num_threads(threads)
+    _worker_model = load_sentence_transformer(model_name, backend)
+
+
+def _encode_batch(task):
+    indices, texts, kwargs = task
+    return indices, np.asarray(_worker_model.encode(texts, batch_size=len(texts), **kwargs), dtype=np.float32)
+
+
+class ParallelEncoder:
+    """
+    Sentence transformer encoder for bulk ingestion.
+
+    Texts are bucketed by token length into batches of a fixed padded-token budget, and on CPU hosts
+    the batches are spread over a pool of worker processes, each holding its own copy of the model.
+    Embeddings come back in the order of the input texts. Like BatchedEncoder, it can be passed to
+    EmbeddingService in place of a SentenceTransformer.
+    """
+
+    def __init__(self, model_name: str = config.MODEL_SENTENCE_TRANSFORMER, backend: str = config.INFERENCE_BACKEND,
+                 processes: Optional[int] = config.ENCODE_PROCESSES,
+                 threads_per_process: int = config.ENCODE_THREADS_PER_PROCESS,
+                 max_batch_tokens: int = config.ENCODE_MAX_BATCH_TOKENS,
+                 max_batch_size: int = config.ENCODE_MAX_BATCH_SIZE):
+        """
+        Parameters:
+        - model_name (str, optional): The sentence transformer model.
+        - backend (str, optional): Inference backend of the model, see load_sentence_transformer.
+        - processes (int, optional): Number of worker processes. None starts one per threads_per_process
+          cores on CPU hosts and encodes in this process on GPU hosts. 1 never starts a pool.
+        - threads_per_process (int, optional): Torch threads of every worker process.
+        - max_batch_tokens (int, optional): Padded tokens per batch.
+        - max_batch_size (int, optional): Maximum number of texts per batch.
+        """
+        self.model_name = model_name
+        self.backend = backend
+        self.threads_per_process = threads_per_process
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+
+        # The local model measures token lengths and encodes when no pool is used
+        self.sentence_transformer = load_sentence_transformer(model_name, backend)
+        if processes is None:
+            on_cpu = str(getattr(self.sentence_transformer, 'device', 'cpu')) == 'cpu'
+            processes = max((os.cpu_count() or 1) // threads_per_process, 1) if on_cpu else 1
+        self.processes = processes
+        self.stats = {}
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.sentence_transformer.get_sentence_embedding_dimension()
+
+    def _get_pool(self):
+        # Several pipelines may share one encoder, only the first call starts the pool
+        with self._lock:
+            if self._pool is None:
+                print(f"[ENCODE] Starting {self.processes} encoder processes with {self.threads_per_process} threads each")
+                self._pool = get_context('spawn').Pool(
+                    self.processes,
+                    initializer=_init_worker,
+                    initargs=(self.model_name, self.backend, self.threads_per_process),
+                )
+            return self._pool
+
+    def start(self) -> None:
+        """
+        Starts the worker processes and loads their models ahead of the first encode call.
+        """
+        if self.processes > 1:
+            warm_up = (np.arange(1), ["warm up"], {'show_progress_bar': False})
+            self._get_pool().map(_encode_batch, [warm_up] * self.processes, chunksize=1)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def encode(self, texts: Union[str, List[str]], batch_size: Optional[int] = None, **kwargs) -> np.ndarray:
+        """
+        Encodes texts like SentenceTransformer.encode, batched by token budget instead of batch_size.
+
+        Parameters:
+        - texts (Union[str, List[str]]): A single text or a list (or Series) of texts.
+        - batch_size (int, optional): Ignored, batches are sized by max_batch_tokens.
+        - kwargs: Passed on to SentenceTransformer.encode.
+
+        Returns:
+        - np.ndarray: A float32 vector for a single text, or a matrix with one row per text in input order.
+        """
+        if isinstance(texts, str):
+            return self.encode([texts], **kwargs)[0]
+
+        texts = list(texts)
+        embeddings = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        if not texts:
+            return embeddings
+
+        started = time.perf_counter()
+        lengths = get_token_lengths(self.sentence_transformer, texts)
+        batches = make_batches(lengths, self.max_batch_tokens, self.max_batch_size)
+
+        kwargs.setdefault('show_progress_bar', False)
+        tasks = [(batch, [texts[i] for i in batch], kwargs) for batch in batches]
+        if self.processes > 1 and len(batches) > 1:
+            results = self._get_pool().imap_unordered(_encode_batch, tasks)
+        else:
+            results = (
+                (batch, self.sentence_transformer.encode(batch_texts, batch_size=len(batch_texts), **batch_kwargs))
+                for batch, batch_texts, batch_kwargs in tasks
+            )
+        for batch, batch_embeddings in results:
+            embeddings[batch] = batch_embeddings
+
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        tokens = int(lengths.sum())
+        padded_tokens = sum(len(batch) * int(lengths[batch[0]]) for batch in batches)
+        self.stats = {
+            'texts': len(texts),
+            'tokens': tokens,
+            'batches': len(batches),
+            'seconds': elapsed,
+            'texts_per_s': len(texts) / elapsed,
+            'tokens_per_s': tokens / elapsed,
+            'padding': 1 - tokens / max(padded_tokens, 1),
+        }
+        print(f"[ENCODE] {len(texts)} texts in {len(batches)} batches: {self.stats['texts_per_s']:.1f} texts/s, "
+              f"{self.stats['tokens_per_s']:.0f} tokens/s, {self.stats['padding']:.1%} padding")
+        return embeddings
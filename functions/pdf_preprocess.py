@@ -1,41 +1,105 @@
 import os
 import re
+import json
+import time
 import requests
 import PyPDF2
-from typing import List, Dict, Union
+from typing import Iterator, List, Dict, Optional, Tuple, Union
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+from functions.http_session import get_session
 
-def download_pdf(url, output_path):
+import config
+
+
+def download_pdf(url, output_path, session: Optional[requests.Session] = None,
+                 chunk_size: int = config.DOWNLOAD_CHUNK_SIZE) -> bool:
     """
     Downloads a PDF from a given URL and saves it to output_path.
+
+    The response is streamed to a temporary file in chunks and renamed into place, so memory stays flat
+    and a failed download never leaves a truncated PDF behind. The ETag and Last-Modified headers are
+    kept next to the file and sent back on the next run, so unchanged reports are not transferred again.
+
+    Parameters:
+    - url (str): Link to the PDF file.
+    - output_path (str): Path the PDF is written to.
+    - session (requests.Session, optional): Session to download with. Default is the shared download session.
+    - chunk_size (int, optional): Number of bytes written per chunk.
+
+    Returns:
+    - bool: True if output_path holds a current copy of the PDF.
     """
+    session = session or get_session('downloads')
+    meta_path = f"{output_path}.meta.json"
+
+    headers = {}
+    if os.path.exists(output_path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    tmp_path = f"{output_path}.part"
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        with open(output_path, "wb") as f:
-            f.write(response.content)
+        with session.get(url, headers=headers, stream=True, timeout=config.DOWNLOAD_TIMEOUT) as response:
+            if response.status_code == 304:
+                print(f"Not modified, skipping download: {output_path}")
+                return True
+            response.raise_for_status()
+
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+            os.replace(tmp_path, output_path)
+
+            with open(meta_path, 'w') as f:
+                json.dump({
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                }, f)
         print(f"Downloaded PDF: {output_path}")
-    except requests.RequestException as e:
+        return True
+    except (requests.RequestException, OSError) as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         print(f"Failed to download {url}. Error: {e}")
+        return False
+
+
+def download_pdfs(urls: List[str], pdfs_path: str = 'data', workers: int = config.DOWNLOAD_WORKERS) -> Dict[str, str]:
+    """
+    Downloads several PDFs concurrently over the shared download session.
+
+    Parameters:
+    - urls (List[str]): Links to the PDF files.
+    - pdfs_path (str, optional): Directory the PDFs are saved to. Default is 'data'.
+    - workers (int, optional): Number of concurrent downloads.
+
+    Returns:
+    - Dict[str, str]: Mapping of url to local path for every PDF that is available locally, in the order of urls.
+    """
+    pdf_files = {url: f"{pdfs_path}/{url.split('/')[-1]}" for url in urls}
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        available = list(executor.map(download_pdf, pdf_files.keys(), pdf_files.values()))
+
+    return {url: path for (url, path), ok in zip(pdf_files.items(), available) if ok}
+
 
 def download_stanford_ai_reports(urls: List[str], ai_report_text: List, pdfs_path: str = 'data') -> List[str]:
     """
     Download 2022, 2023, and 2024 Stanford AI Index reports.
     (Check official Stanford AI Index website for correct or updated links)
     """
-    
-    for url in urls:
-        filename = url.split('/')[-1]
-    
-        # Output filenames
-        pdf_file = f"{pdfs_path}/{filename}"
-    
-        # Initialize a list to store information about new files
-        print('⛳️ Dowloading Stanford ai index report...')
-        # Download each
-        download_pdf(url, pdf_file)
-        
+    print('⛳️ Dowloading Stanford ai index reports...')
+    pdf_files = download_pdfs(urls, pdfs_path)
+
+    for url, pdf_file in pdf_files.items():
         process_pdf_file(ai_report_text, pdf_file, url)
 
     return ai_report_text
@@ -43,7 +107,7 @@ def download_stanford_ai_reports(urls: List[str], ai_report_text: List, pdfs_pat
 
 
 def process_pdf_file(document_text: List,
-                     pdf_path: str, url: str) -> List:
+                     pdf_path: str, url: str, workers: int = config.PDF_EXTRACT_WORKERS) -> List:
     """
     Process content of a PDF file and append information to the document_text list.
 
@@ -51,21 +115,106 @@ def process_pdf_file(document_text: List,
     - file_info (Dict): Information about the PDF file.
     - document_text (List): List containing document information.
     - pdf_path (str): Path to the folder containing PDF files (default is 'data/').
+    - workers (int, optional): Number of processes extracting pages in parallel.
 
     Returns:
     - List: Updated document_text list.
     """    
     if pdf_path.split('.')[-1] == 'pdf':
-        file_path = Path(pdf_path)
-        file_title = file_path.stem        
-        pdf_reader = PyPDF2.PdfReader(pdf_path)
-        pages_amount = len(pdf_reader.pages)
-        print(f'Amount of pages: {pages_amount} in {file_title}')
-            
-        for i, page in enumerate(pdf_reader.pages):
-            document_text.append([file_title, url, i+1, page.extract_text()])
+        page_timings = []
+        document_text.extend(iter_pdf_pages(pdf_path, url, workers=workers, page_timings=page_timings))
+        report_page_timings(Path(pdf_path).stem, page_timings)
     return document_text
 
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> List[Tuple[int, str, float]]:
+    """
+    Extract the text of pages [start, end) of a PDF file.
+
+    Runs inside a worker process, so the file is opened here rather than passed in.
+
+    Parameters:
+    - pdf_path (str): Path to the PDF file.
+    - start (int): Index of the first page, zero based.
+    - end (int): Index one past the last page.
+
+    Returns:
+    - List[Tuple[int, str, float]]: Page number (one based), extracted text and extraction time in seconds per page.
+    """
+    pdf_reader = PyPDF2.PdfReader(pdf_path)
+    pages = []
+    for i in range(start, end):
+        started = time.perf_counter()
+        text = pdf_reader.pages[i].extract_text()
+        pages.append((i + 1, text, time.perf_counter() - started))
+    return pages
+
+
+def iter_pdf_pages(pdf_path: str, url: str, workers: int = config.PDF_EXTRACT_WORKERS,
+                   pages_per_shard: int = config.PDF_PAGES_PER_SHARD,
+                   page_timings: Optional[List[Tuple[int, float]]] = None) -> Iterator[List]:
+    """
+    Extract the pages of a PDF file in parallel, yielding rows in page order.
+
+    Page ranges are sharded across a process pool, each worker opens the file itself.
+
+    Parameters:
+    - pdf_path (str): Path to the PDF file.
+    - url (str): Link to the PDF file.
+    - workers (int, optional): Number of worker processes. 1 extracts in the current process.
+    - pages_per_shard (int, optional): Number of consecutive pages extracted per task.
+    - page_timings (List[Tuple[int, float]], optional): If given, (page number, seconds) is appended for every page.
+
+    Yields:
+    - List: [file_title, url, page_number, text] for every page.
+    """
+    file_title = Path(pdf_path).stem
+    pages_amount = len(PyPDF2.PdfReader(pdf_path).pages)
+    print(f'Amount of pages: {pages_amount} in {file_title}')
+
+    shards = [(start, min(start + pages_per_shard, pages_amount)) for start in range(0, pages_amount, pages_per_shard)]
+
+    if workers <= 1 or len(shards) <= 1:
+        results = (extract_page_range(pdf_path, start, end) for start, end in shards)
+        yield from _page_rows(results, file_title, url, page_timings)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map yields shard results in submission order, so pages come out in order
+        results = executor.map(
+            extract_page_range,
+            [pdf_path] * len(shards),
+            [start for start, _ in shards],
+            [end for _, end in shards],
+        )
+        yield from _page_rows(results, file_title, url, page_timings)
+
+
+def _page_rows(results, file_title: str, url: str, page_timings: Optional[List[Tuple[int, float]]]) -> Iterator[List]:
+    for pages in results:
+        for page_number, text, seconds in pages:
+            if page_timings is not None:
+                page_timings.append((page_number, seconds))
+            yield [file_title, url, page_number, text]
+
+
+def report_page_timings(file_title: str, page_timings: List[Tuple[int, float]], top: int = 5) -> None:
+    """
+    Print extraction time statistics of a PDF file and its slowest pages.
+
+    Parameters:
+    - file_title (str): Name of the PDF file.
+    - page_timings (List[Tuple[int, float]]): (page number, seconds) for every page.
+    - top (int, optional): Number of slowest pages to list. Default is 5.
+    """
+    if not page_timings:
+        return
+    seconds = sorted(t for _, t in page_timings)
+    slowest = sorted(page_timings, key=lambda x: x[1], reverse=True)[:top]
+    print(f"[EXTRACT] {file_title}: {len(seconds)} pages, total {sum(seconds):.2f}s, "
+          f"median {seconds[len(seconds) // 2] * 1000:.1f}ms, max {seconds[-1] * 1000:.1f}ms")
+    print(f"[EXTRACT] Slowest pages: " + ', '.join(f"{page} ({t * 1000:.1f}ms)" for page, t in slowest))
+
 def extract_year_regex(filename):
     pattern = re.compile(r'^(?P<start>\d{4})|(?P<end>\d{4})')
     match = pattern.search(filename)
@@ -1,16 +1,47 @@
+from __future__ import annotations
+
 import os
+import json
+import time
 import requests
 import json_repair
+import numpy as np
+
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+from functions.caching import LRUCache
+from functions.retrievers import get_retriever, get_neighbor_embeddings
+from functions.text_preprocess import get_chunk_id
+from functions.tokenizer import count_tokens, truncate_tokens
+from functions.llm_transport import call_with_retries, post_with_retries, configure_openai_client, hedged_call
+from functions.tracing import span, detached_span, traced, set_attributes, run_in_context
+from functions.inference_backends import load_reranker
+from functions.dedup import mmr
+
+import config
+
+# The model and feature store libraries are only imported when they are used, to keep the app start fast
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+    from FlagEmbedding import FlagReranker
+    from hsfs import feature_view
+
+# Cross-encoder scores keyed by (query, context_id), shared by all sessions of the app.
+rerank_cache = LRUCache(maxsize=config.RERANKER_CACHE_SIZE)
 
-from typing import List, Tuple
-from sentence_transformers import SentenceTransformer
-from FlagEmbedding import FlagReranker
-from hsfs import feature_view
+# Position of the filterable features in the rows returned by the feature views.
+FILTER_COLUMNS = {'name': 0, 'source': 2, 'year': 6}
 
-def get_reranker(reranker_model: str) -> FlagReranker:
-    reranker = FlagReranker(
+# Answer shown when no provider answered a hedged call.
+HEDGED_FAILURE_MESSAGE = "No model returned an answer."
+
+def get_reranker(reranker_model: str, backend: str = config.INFERENCE_BACKEND) -> FlagReranker:
+    # fp32, int8 quantized or ONNX Runtime reranker, all with the compute_score interface of FlagReranker
+    reranker = load_reranker(
         reranker_model, 
-        use_fp16=True,
+        backend=backend,
     ) 
     return reranker
     
@@ -46,45 +77,311 @@ def get_context(neighbors: List[Tuple[str]]) -> str:
 
 
 
-def get_neighbors(query: str, sentence_transformer: SentenceTransformer, feature_view, k: int = 10) -> List[Tuple[str, float]]:
+def get_neighbors(query: str, sentence_transformer: SentenceTransformer, feature_view, k: int = 10,
+                  filters: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
     """
     Get the k closest neighbors for a given query using sentence embeddings.
 
     Parameters:
     - query (str): The input query string.
     - sentence_transformer (SentenceTransformer): The sentence transformer model.
-    - feature_view (FeatureView): The feature view for retrieving neighbors.
+    - feature_view (FeatureView or retriever): The feature view or local index for retrieving neighbors.
     - k (int, optional): Number of neighbors to retrieve. Default is 10.
+    - filters (Dict[str, Any], optional): Equality filters on 'year', 'source' and/or 'name'.
 
     Returns:
     - List[Tuple[str, float]]: A list of tuples containing the neighbor context.
     """
-    question_embedding = sentence_transformer.encode(query)
+    with span('get_neighbors', k=k) as current:
+        with span('embed_query'):
+            question_embedding = sentence_transformer.encode(query)
 
-    # Retrieve closest neighbors
-    neighbors = feature_view.find_neighbors(
-        question_embedding, 
-        k=k,
-    )
+        # Retrieve closest neighbors
+        if filters:
+            neighbors, _ = find_filtered_neighbors(question_embedding, feature_view, k=k, filters=filters)
+        else:
+            neighbors = find_neighbors(question_embedding, feature_view, k=k)
+        current.set(candidates=len(neighbors))
 
     return neighbors
 
 
-def rerank(query: str, neighbors: List[str], reranker, k: int = 3) -> List[str]:
+def find_neighbors(question_embedding, feature_view, k: int = 10, filters: Optional[Dict[str, Any]] = None) -> List[Tuple]:
+    """
+    Get the k closest neighbors for an already computed query embedding.
+
+    Parameters:
+    - question_embedding (np.ndarray): The query embedding.
+    - feature_view (FeatureView or retriever): The feature view or local index for retrieving neighbors.
+    - k (int, optional): Number of neighbors to retrieve. Default is 10.
+    - filters (Dict[str, Any], optional): Equality filters evaluated by the vector index.
+
+    Returns:
+    - List[Tuple]: A list of neighbor rows.
+    """
+    return get_retriever(feature_view).find_neighbors(question_embedding, k=k, filters=filters)
+
+
+def matches_filters(neighbor: Tuple, filters: Dict[str, Any]) -> bool:
+    """
+    Check a neighbor row against equality filters client side.
+
+    Parameters:
+    - neighbor (Tuple): A row returned by the feature view.
+    - filters (Dict[str, Any]): Mapping of feature name to required value.
+
+    Returns:
+    - bool: True if the row satisfies every filter.
+    """
+    for name, value in filters.items():
+        column = FILTER_COLUMNS[name]
+        if len(neighbor) <= column or neighbor[column] != value:
+            return False
+    return True
+
+
+@traced('find_filtered_neighbors')
+def find_filtered_neighbors(question_embedding, feature_view, k: int = 10, filters: Optional[Dict[str, Any]] = None,
+                            max_k: int = config.RETRIEVAL_MAX_K,
+                            growth: int = config.RETRIEVAL_K_GROWTH) -> Tuple[List[Tuple], Dict[str, Any]]:
+    """
+    Get the k closest neighbors that satisfy the given filters.
+
+    The filters are pushed down into the vector index when the retriever supports it. Otherwise
+    k is widened by the growth factor until k matching rows are found, the index is exhausted or max_k is reached.
+
+    Parameters:
+    - question_embedding (np.ndarray): The query embedding.
+    - feature_view (FeatureView or retriever): The feature view or local index for retrieving neighbors.
+    - k (int, optional): Number of matching neighbors to retrieve. Default is 10.
+    - filters (Dict[str, Any], optional): Equality filters on 'year', 'source' and/or 'name'.
+    - max_k (int, optional): Upper bound on the number of neighbors fetched when over-fetching.
+    - growth (int, optional): Factor k is multiplied by on every over-fetch round.
+
+    Returns:
+    - Tuple[List[Tuple], Dict[str, Any]]: The matching neighbors and retrieval statistics with
+      'fetched', 'discarded', 'rounds' and 'pushdown' keys.
+    """
+    stats = {'fetched': 0, 'discarded': 0, 'rounds': 0, 'pushdown': False}
+
+    if not filters:
+        neighbors = find_neighbors(question_embedding, feature_view, k=k)
+        stats.update(fetched=len(neighbors), rounds=1)
+        set_attributes(candidates=len(neighbors), **stats)
+        return neighbors, stats
+
+    if get_retriever(feature_view).supports_filters(filters):
+        try:
+            neighbors = find_neighbors(question_embedding, feature_view, k=k, filters=filters)
+        except Exception as e:
+            print(f"[RETRIEVE] Filter pushdown failed, over-fetching instead: {e}")
+        else:
+            # Guard against backends that ignore the filter
+            matching = [neighbor for neighbor in neighbors if matches_filters(neighbor, filters)]
+            stats.update(fetched=len(neighbors), discarded=len(neighbors) - len(matching), rounds=1, pushdown=True)
+            set_attributes(candidates=len(matching), **stats)
+            return matching, stats
+
+    fetch_k = k
+    while True:
+        neighbors = find_neighbors(question_embedding, feature_view, k=fetch_k)
+        matching = [neighbor for neighbor in neighbors if matches_filters(neighbor, filters)]
+        stats['rounds'] += 1
+        stats['fetched'] += len(neighbors)
+
+        # Stop when the quota is met, the index has no more rows or the fetch limit is reached
+        if len(matching) >= k or len(neighbors) < fetch_k or fetch_k >= max_k:
+            break
+        fetch_k = min(fetch_k * growth, max_k)
+
+    stats['discarded'] = stats['fetched'] - len(matching)
+    set_attributes(candidates=len(matching[:k]), **stats)
+    return matching[:k], stats
+
+
+def get_context_id(neighbor: Tuple) -> int:
+    """
+    Derive the stable context_id of a retrieved context from its name, source, page, paragraph and text.
+
+    Parameters:
+    - neighbor (Tuple): A row returned by the feature view (name, url, source, page_number, paragraph, text, ...).
+
+    Returns:
+    - int: The context_id the feature pipeline assigned to this chunk.
+    """
+    return get_chunk_id(neighbor[0], neighbor[2], neighbor[3], neighbor[4], neighbor[5])
+
+
+@traced('compute_scores')
+def compute_scores(query: str, neighbors: List[Tuple], reranker, batch_size: int = config.RERANKER_BATCH_SIZE,
+                   max_length: int = config.RERANKER_MAX_LENGTH, cache: LRUCache = rerank_cache) -> List[float]:
+    """
+    Score every neighbor against the query with the cross-encoder in batched calls.
+
+    Scores already present in the cache are reused, only the misses are sent to the reranker.
+
+    Parameters:
+    - query (str): The input query string.
+    - neighbors (List[Tuple]): List of neighbor contexts, the text is expected at index 5.
+    - reranker (Reranker): The reranking model.
+    - batch_size (int, optional): Number of (query, context) pairs per forward pass.
+    - max_length (int, optional): Maximum sequence length of a (query, context) pair in tokens.
+    - cache (LRUCache, optional): Cache of scores keyed by (query, context_id). None disables caching.
+
+    Returns:
+    - List[float]: One score per neighbor, in the order of neighbors.
+    """
+    scores = [None] * len(neighbors)
+    missing = []
+    for i, neighbor in enumerate(neighbors):
+        if cache is not None:
+            scores[i] = cache.get((query, get_context_id(neighbor)))
+        if scores[i] is None:
+            missing.append(i)
+
+    set_attributes(candidates=len(neighbors), cache_hits=len(neighbors) - len(missing), cache_misses=len(missing))
+
+    if missing:
+        new_scores = reranker.compute_score(
+            [[query, neighbors[i][5]] for i in missing],
+            batch_size=batch_size,
+            max_length=max_length,
+        )
+        # A single pair is returned as a plain float
+        if not isinstance(new_scores, list):
+            new_scores = [new_scores]
+
+        for i, score in zip(missing, new_scores):
+            scores[i] = score
+            if cache is not None:
+                cache.put((query, get_context_id(neighbors[i])), score)
+
+    return scores
+
+
+@traced('diversify')
+def diversify_neighbors(question_embedding, neighbors: List[Tuple], k: Optional[int] = config.MMR_K,
+                        mmr_lambda: float = config.MMR_LAMBDA,
+                        duplicate_threshold: Optional[float] = config.MMR_DUPLICATE_THRESHOLD) -> List[Tuple]:
+    """
+    Drop near-duplicate neighbors and optionally keep a diverse subset by maximal marginal relevance.
+
+    Runs on the embeddings the retriever returned with the neighbors. Neighbors retrieved without
+    embeddings are returned unchanged rather than encoded again.
+
+    Parameters:
+    - question_embedding (np.ndarray): The query embedding.
+    - neighbors (List[Tuple]): Neighbor rows returned by a retriever, see Neighbor.
+    - k (int, optional): Number of neighbors to keep. None keeps all but near-duplicates.
+    - mmr_lambda (float, optional): Weight of relevance against diversity, 1 ranks by relevance only.
+    - duplicate_threshold (float, optional): Cosine similarity above which neighbors count as duplicates.
+
+    Returns:
+    - List[Tuple]: The kept neighbors, in the order maximal marginal relevance picked them.
+    """
+    if len(neighbors) < 2:
+        return neighbors
+    embeddings = get_neighbor_embeddings(neighbors)
+    if embeddings is None:
+        set_attributes(candidates=len(neighbors), kept=len(neighbors), skipped=True)
+        return neighbors
+    selected = mmr(question_embedding, embeddings, k=k, mmr_lambda=mmr_lambda, duplicate_threshold=duplicate_threshold)
+    set_attributes(candidates=len(neighbors), kept=len(selected))
+    return [neighbors[i] for i in selected]
+
+
+@traced('first_stage')
+def get_first_stage_scores(question_embedding, neighbors: List[Tuple]) -> Optional[List[float]]:
+    """
+    Cheap first-stage score of the cascade: the bi-encoder cosine between query and context.
+
+    Computed from the query embedding of the retrieval and the embeddings returned with the
+    neighbors, nothing is encoded.
+
+    Parameters:
+    - question_embedding (np.ndarray): The query embedding used for retrieval.
+    - neighbors (List[Tuple]): Neighbor rows returned by a retriever, see Neighbor.
+
+    Returns:
+    - List[float] or None: One cosine similarity per neighbor, or None if the neighbors were retrieved
+      without embeddings, in which case all of them are reranked.
+    """
+    set_attributes(candidates=len(neighbors))
+    if not neighbors:
+        return []
+    embeddings = get_neighbor_embeddings(neighbors)
+    if embeddings is None:
+        set_attributes(skipped=True)
+        return None
+    query = np.asarray(question_embedding, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query)
+    return (embeddings @ query / np.maximum(norms, 1e-12)).tolist()
+
+
+def select_shortlist(first_stage_scores: List[float], k: int = 3, shortlist_size: int = config.RERANK_SHORTLIST_SIZE,
+                     margin: Optional[float] = config.RERANK_CASCADE_MARGIN) -> Tuple[List[int], bool]:
+    """
+    Pick the candidates worth scoring with the cross-encoder.
+
+    The shortlist holds the shortlist_size best candidates by first-stage score, without those
+    scoring more than margin below the k-th best. If only the top k are left, the first stage is
+    decisive and the reranker can be skipped.
+
+    Parameters:
+    - first_stage_scores (List[float]): One cheap score per candidate.
+    - k (int, optional): Number of contexts kept after reranking.
+    - shortlist_size (int, optional): Maximum number of candidates passed on to the reranker.
+    - margin (float, optional): Score distance to the k-th best candidate beyond which candidates are pruned. None disables it.
+
+    Returns:
+    - Tuple[List[int], bool]: Indices of the shortlisted candidates in descending first-stage order, and whether the first stage is decisive.
+    """
+    scores = np.asarray(first_stage_scores, dtype=np.float32)
+    order = np.argsort(-scores, kind='stable')[:max(shortlist_size, k)]
+    if margin is not None and len(order) > k:
+        order = order[scores[order] >= scores[order[k - 1]] - margin]
+    return order.tolist(), len(order) <= k < len(scores)
+
+
+@traced('rerank')
+def rerank(query: str, neighbors: List[str], reranker, k: int = 3, batch_size: int = config.RERANKER_BATCH_SIZE,
+           max_length: int = config.RERANKER_MAX_LENGTH, cache: LRUCache = rerank_cache,
+           first_stage_scores: Optional[List[float]] = None, shortlist_size: int = config.RERANK_SHORTLIST_SIZE,
+           margin: Optional[float] = config.RERANK_CASCADE_MARGIN) -> List[str]:
     """
     Rerank a list of neighbors based on a reranking model.
 
+    Given first_stage_scores, reranking runs as a cascade: only a shortlist of the best candidates
+    by first-stage score is scored by the reranker, and none if the first stage is decisive.
+
     Parameters:
     - query (str): The input query string.
     - neighbors (List[str]): List of neighbor contexts.
     - reranker (Reranker): The reranking model.
     - k (int, optional): Number of top-ranked neighbors to return. Default is 3.
+    - batch_size (int, optional): Number of (query, context) pairs per forward pass.
+    - max_length (int, optional): Maximum sequence length of a (query, context) pair in tokens.
+    - cache (LRUCache, optional): Cache of scores keyed by (query, context_id). None disables caching.
+    - first_stage_scores (List[float], optional): Cheap score per neighbor, see get_first_stage_scores. None reranks all neighbors.
+    - shortlist_size (int, optional): Maximum number of candidates passed on to the reranker in the cascade.
+    - margin (float, optional): First-stage score distance to the k-th best candidate beyond which candidates are pruned.
 
     Returns:
     - List[str]: The top-ranked neighbor contexts after reranking.
     """
-    # Compute scores for each context using the reranker
-    scores = [reranker.compute_score([query, context[5]]) for context in neighbors]
+    set_attributes(candidates=len(neighbors), k=k)
+    if not neighbors:
+        return []
+
+    if first_stage_scores is not None:
+        shortlist, decisive = select_shortlist(first_stage_scores, k=k, shortlist_size=shortlist_size, margin=margin)
+        set_attributes(shortlist=len(shortlist), early_exit=decisive)
+        neighbors = [neighbors[i] for i in shortlist]
+        if decisive:
+            return neighbors[:k]
+
+    # Compute scores for all contexts in batched reranker calls
+    scores = compute_scores(query, neighbors, reranker, batch_size=batch_size, max_length=max_length, cache=cache)
 
     combined_data = [*zip(scores, neighbors)]
 
@@ -94,31 +391,94 @@ def rerank(query: str, neighbors: List[str], reranker, k: int = 3) -> List[str]:
     # Return the top-k ranked contexts
     return [context for score, context in sorted_data][:k]
 
+
+def evaluate_cascade(queries_and_neighbors: List[Tuple[str, Any, List[Tuple]]], reranker, k: int = 3, shortlist_sizes: List[int] = (5, 10, 15, 20, 30),
+                     margins: List[Optional[float]] = (None, config.RERANK_CASCADE_MARGIN)) -> List[Dict[str, float]]:
+    """
+    Measure how well the cascade reproduces full reranking, to pick the shortlist size and margin with data.
+
+    Every query's candidates are scored once by the first stage and once in full by the reranker.
+    The cascade's top-k is then derived for every setting and compared with the top-k of full reranking.
+
+    Parameters:
+    - queries_and_neighbors (List[Tuple[str, np.ndarray, List[Tuple]]]): Queries with the embedding they
+      were retrieved with and their retrieved neighbors, which must carry embeddings.
+    - reranker (Reranker): The reranking model.
+    - k (int, optional): Number of contexts kept after reranking.
+    - shortlist_sizes (List[int], optional): Shortlist sizes to evaluate.
+    - margins (List[float], optional): Margins to evaluate, None evaluates the cascade without a margin.
+
+    Returns:
+    - List[Dict[str, float]]: One row per setting with 'shortlist_size', 'margin', 'recall' of the full
+      top-k, 'reranked' (mean candidates scored by the reranker) and 'early_exit_rate'.
+    """
+    scored = []
+    for query, question_embedding, neighbors in queries_and_neighbors:
+        first_stage_scores = get_first_stage_scores(question_embedding, neighbors)
+        if first_stage_scores is None:
+            raise ValueError("The cascade can only be evaluated on neighbors retrieved with their embeddings.")
+        full_scores = np.asarray(compute_scores(query, neighbors, reranker, cache=None), dtype=np.float32)
+        scored.append((first_stage_scores, full_scores))
+
+    rows = []
+    for shortlist_size in shortlist_sizes:
+        for margin in margins:
+            recall, reranked, early_exits = [], [], 0
+            for first_stage_scores, full_scores in scored:
+                if len(full_scores) == 0:
+                    continue
+                full_top_k = set(np.argsort(-full_scores, kind='stable')[:k])
+                shortlist, decisive = select_shortlist(first_stage_scores, k=k, shortlist_size=shortlist_size, margin=margin)
+                if decisive:
+                    cascade_top_k = set(shortlist[:k])
+                    early_exits += 1
+                    reranked.append(0)
+                else:
+                    cascade_top_k = set(sorted(shortlist, key=lambda i: -full_scores[i])[:k])
+                    reranked.append(len(shortlist))
+                recall.append(len(full_top_k & cascade_top_k) / len(full_top_k))
+
+            rows.append({
+                'shortlist_size': shortlist_size,
+                'margin': margin,
+                'recall': float(np.mean(recall)) if recall else 1.0,
+                'reranked': float(np.mean(reranked)) if reranked else 0.0,
+                'early_exit_rate': early_exits / max(len(recall), 1),
+            })
+    return rows
+
+@traced('get_context_and_source')
 def get_context_and_source(user_query: str, sentence_transformer: SentenceTransformer,
-                           feature_view: feature_view.FeatureView, reranker: FlagReranker, year: int = None, k: int = 10) -> Tuple[str, str]:
+                           feature_view: feature_view.FeatureView, reranker: FlagReranker, year: int = None, k: int = 10,
+                           filters: Optional[Dict[str, Any]] = None, cascade: bool = config.RERANK_CASCADE,
+                           diversify: bool = config.DIVERSIFY_NEIGHBORS) -> Tuple[str, str]:
     """
     Retrieve context and source based on user query using a combination of embedding, feature view, and reranking.
 
     Parameters:
     - user_query (str): The user's input query string.
     - sentence_transformer (SentenceTransformer): The sentence transformer model.
-    - feature_view (FeatureView): The feature view for retrieving neighbors.
+    - feature_view (FeatureView or retriever): The feature view or local index for retrieving neighbors.
     - reranker (Reranker): The reranking model.
     - year: filter to select only findigs of this particular year.
     - k: number of nearest neighbors to find
+    - filters: equality filters on 'year', 'source' and/or 'name' pushed down into the vector lookup.
+    - cascade: prune the neighbors by bi-encoder cosine before the reranker.
+    - diversify: drop near-duplicate neighbors before the reranker, see diversify_neighbors.
 
     Returns:
     - Tuple[str, str]: A tuple containing the retrieved context and source.
     """
+    filters = get_filters(year=year, filters=filters)
+
     # Retrieve closest neighbors
-    neighbors = get_neighbors(
-        user_query,
-        sentence_transformer,
-        feature_view,
-        k=k,
-    )
-    if year is not None:
-        neighbors = [i for i in neighbors if i[6]==year]
+    with span('embed_query'):
+        question_embedding = sentence_transformer.encode(user_query)
+    neighbors, stats = find_filtered_neighbors(question_embedding, feature_view, k=k, filters=filters)
+    log_retrieval_stats(feature_view, stats)
+
+    if diversify:
+        neighbors = diversify_neighbors(question_embedding, neighbors)
     
     # Rerank the neighbors to get top-k
     context_reranked = rerank(
@@ -126,6 +486,7 @@ def get_context_and_source(user_query: str, sentence_transformer: SentenceTransf
         neighbors,
         reranker,
         k=3,
+        first_stage_scores=get_first_stage_scores(question_embedding, neighbors) if cascade else None,
     )
 
     # Retrieve source
@@ -134,49 +495,137 @@ def get_context_and_source(user_query: str, sentence_transformer: SentenceTransf
     return context_reranked, source
 
 
-def build_prompt(query, context):
+def get_filters(year: int = None, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
     """
-    Build a multi-shot prompt for LLM to provide more detailed and relevant answers.
+    Merge the legacy year argument into the filters dict.
     """
-    # -- MULTI-SHOT EXAMPLES --
-    example_q1 = "What does the 2022 AI Index report highlight about global AI investments?"
-    example_a1 = (
-        "According to the 2022 AI Index report (Pages 20-21), global AI investments increased "
-        "significantly, especially in fintech and healthcare sectors."
-    )
+    filters = dict(filters or {})
+    if year is not None:
+        filters['year'] = year
+    return filters
 
-    example_q2 = "Does the 2023 report mention the impact on any EQT X portfolio companies?"
-    example_a2 = (
-        "Based on the 2023 AI Index (Chapter 2, Page 35) and the EQT X data from company 'ABC Health', "
-        "there is evidence of AI-driven diagnostics improving patient outcomes."
-    )
 
-    example_q3 = "How is AI driving new revenue streams in e-commerce according to 2024 data?"
-    example_a3 = (
-        "In the 2024 AI Index report (Pages 45-46), AI-driven product recommendations have increased "
-        "average order value. One EQT X portfolio company specializing in e-commerce solutions saw a 15% "
-        "boost in sales from personalized recommendations."
-    )
+def log_retrieval_stats(feature_view, stats: Dict[str, Any]) -> None:
+    """
+    Print how many candidates were fetched and discarded by a filtered lookup.
+    """
+    print(f"[RETRIEVE] {get_retriever(feature_view).name}: fetched {stats['fetched']}, "
+          f"discarded {stats['discarded']}, rounds {stats['rounds']}, pushdown {stats['pushdown']}")
 
-    # Build the context snippet references
-    snippet_texts = []
-    for c in context:
-        ref_str = ""
-        # Identify the source in a more explicit, structured format
-        if c[2] == "stanford_report":
-            ref_str = f"[source: Stanford AI Index, link: {c[1]}, page {c[3]}, paragraph {c[4]}]"
-        elif c[2] == "EQT_X_Portfolio":
-            ref_str = f"[source: EQT X portfolio, website: {c[1]}]"
-        else:
-            ref_str = "[source: Unknown or mislabeled context]"
 
-        snippet_texts.append(f"Context snippet:\n{ref_str}\n{c[5]}\n")
+@traced('get_multi_source_context_and_source')
+def get_multi_source_context_and_source(user_query: str, sentence_transformer: SentenceTransformer,
+                                        sources: List[Dict], reranker: FlagReranker,
+                                        cascade: bool = config.RERANK_CASCADE,
+                                        diversify: bool = config.DIVERSIFY_NEIGHBORS) -> List[Tuple[List, str]]:
+    """
+    Retrieve reranked context and source from several feature views for a single user query.
 
-    # Combine all snippet texts
-    context_snippets = "\n".join(snippet_texts)
+    The query is embedded once, the vector lookups of all sources run concurrently and all
+    candidates are scored by the reranker in one batched pass. Each source then keeps its own
+    top-k quota, so total latency is close to the slowest single lookup.
+
+    Parameters:
+    - user_query (str): The user's input query string.
+    - sentence_transformer (SentenceTransformer): The sentence transformer model.
+    - sources (List[Dict]): One dict per source with keys 'feature_view' and optionally
+      'k' (neighbors to fetch, default 10), 'year' (year filter), 'filters' (equality filters on
+      'year', 'source' and/or 'name') and 'top_k' (reranked contexts to keep, default 3).
+    - reranker (Reranker): The reranking model.
+    - cascade (bool, optional): Prune every source to a shortlist by bi-encoder cosine before the reranker.
+    - diversify (bool, optional): Drop near-duplicate neighbors of every source before the reranker.
+
+    Returns:
+    - List[Tuple[List, str]]: For each source, in order, a tuple containing the retrieved context and source.
+    """
+    set_attributes(sources=len(sources))
+    with span('embed_query'):
+        question_embedding = sentence_transformer.encode(user_query)
+
+    # Fan out the vector lookups, their spans nest under the current one
+    with ThreadPoolExecutor(max_workers=max(len(sources), 1)) as executor:
+        futures = [
+            executor.submit(
+                run_in_context(find_filtered_neighbors),
+                question_embedding,
+                source['feature_view'],
+                source.get('k', 10),
+                get_filters(year=source.get('year'), filters=source.get('filters')),
+            )
+            for source in sources
+        ]
+        neighbors_per_source = []
+        for source, future in zip(sources, futures):
+            neighbors, stats = future.result()
+            log_retrieval_stats(source['feature_view'], stats)
+            neighbors_per_source.append(neighbors)
+
+    if diversify:
+        neighbors_per_source = [
+            diversify_neighbors(question_embedding, neighbors)
+            for neighbors in neighbors_per_source
+        ]
 
-    # Construct the improved prompt
-    prompt = f"""
+    # Sources whose first stage is decisive skip the reranker
+    decided = [None] * len(sources)
+    if cascade:
+        for i, (source, neighbors) in enumerate(zip(sources, neighbors_per_source)):
+            first_stage_scores = get_first_stage_scores(question_embedding, neighbors)
+            if first_stage_scores is None:
+                continue
+            shortlist, decisive = select_shortlist(first_stage_scores, k=source.get('top_k', 3))
+            neighbors_per_source[i] = [neighbors[j] for j in shortlist]
+            if decisive:
+                decided[i] = neighbors_per_source[i]
+        set_attributes(early_exits=sum(neighbors is not None for neighbors in decided))
+
+    # Score the candidates of all sources in one batched reranker pass
+    candidates = [
+        neighbor
+        for neighbors, decision in zip(neighbors_per_source, decided) if decision is None
+        for neighbor in neighbors
+    ]
+    scores = compute_scores(user_query, candidates, reranker)
+
+    results = []
+    offset = 0
+    for source, neighbors, decision in zip(sources, neighbors_per_source, decided):
+        if decision is not None:
+            results.append((decision, get_source(decision)))
+            continue
+
+        source_scores = scores[offset:offset + len(neighbors)]
+        offset += len(neighbors)
+
+        sorted_data = sorted(zip(source_scores, neighbors), key=lambda x: x[0], reverse=True)
+        context_reranked = [context for score, context in sorted_data][:source.get('top_k', 3)]
+        results.append((context_reranked, get_source(context_reranked)))
+
+    return results
+
+
+# -- MULTI-SHOT EXAMPLES --
+EXAMPLE_Q1 = "What does the 2022 AI Index report highlight about global AI investments?"
+EXAMPLE_A1 = (
+    "According to the 2022 AI Index report (Pages 20-21), global AI investments increased "
+    "significantly, especially in fintech and healthcare sectors."
+)
+
+EXAMPLE_Q2 = "Does the 2023 report mention the impact on any EQT X portfolio companies?"
+EXAMPLE_A2 = (
+    "Based on the 2023 AI Index (Chapter 2, Page 35) and the EQT X data from company 'ABC Health', "
+    "there is evidence of AI-driven diagnostics improving patient outcomes."
+)
+
+EXAMPLE_Q3 = "How is AI driving new revenue streams in e-commerce according to 2024 data?"
+EXAMPLE_A3 = (
+    "In the 2024 AI Index report (Pages 45-46), AI-driven product recommendations have increased "
+    "average order value. One EQT X portfolio company specializing in e-commerce solutions saw a 15% "
+    "boost in sales from personalized recommendations."
+)
+
+# The static part of the prompt before the context snippets
+PROMPT_PREFIX = f"""
 You are a knowledgeable assistant referencing the Stanford AI Index Reports (2022, 2023, 2024) 
 and EQT portfolio data to explain how AI impacts EQT X fund's portfolio companies.
 
@@ -187,26 +636,29 @@ Your objective is to provide a concise but specific answer to the user's query,
 Below are multiple example Q&A pairs showing the style of referencing:
 
 EXAMPLE Q1:
-{example_q1}
+{EXAMPLE_Q1}
 
 EXAMPLE A1:
-{example_a1}
+{EXAMPLE_A1}
 
 EXAMPLE Q2:
-{example_q2}
+{EXAMPLE_Q2}
 
 EXAMPLE A2:
-{example_a2}
+{EXAMPLE_A2}
 
 EXAMPLE Q3:
-{example_q3}
+{EXAMPLE_Q3}
 
 EXAMPLE A3:
-{example_a3}
+{EXAMPLE_A3}
 
 Now, here are the context snippets from your knowledge base (Stanford reports and/or EQT X data):
 
-{context_snippets}
+"""
+
+# The part of the prompt after the context snippets
+PROMPT_SUFFIX = """
 
 USER QUESTION: {query}
 
@@ -221,12 +673,126 @@ Remember: Use the provided context whenever possible.
 If the question extends beyond the provided snippets, highlight that 
 the context does not fully answer the question.
 """
+
+
+@lru_cache(maxsize=None)
+def get_static_prompt_tokens() -> int:
+    """
+    Token count of the static template, computed once.
+    """
+    return count_tokens(PROMPT_PREFIX) + count_tokens(PROMPT_SUFFIX.format(query=''))
+
+
+def get_reference(c: Tuple) -> str:
+    """
+    Formats the citation of a context snippet.
+    """
+    # Identify the source in a more explicit, structured format
+    if c[2] == "stanford_report":
+        return f"[source: Stanford AI Index, link: {c[1]}, page {c[3]}, paragraph {c[4]}]"
+    elif c[2] == "EQT_X_Portfolio":
+        return f"[source: EQT X portfolio, website: {c[1]}]"
+    return "[source: Unknown or mislabeled context]"
+
+
+def get_shingles(text: str, size: int = 5) -> set:
+    words = text.lower().split()
+    return {' '.join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def remove_overlapping(context: List[Tuple], threshold: float = config.PROMPT_OVERLAP_THRESHOLD) -> List[Tuple]:
+    """
+    Drops snippets whose text largely overlaps with a higher-ranked snippet.
+
+    Parameters:
+    - context (List[Tuple]): Context rows, highest priority first.
+    - threshold (float, optional): Share of the smaller snippet's word 5-grams found in the other one above which it is dropped.
+
+    Returns:
+    - List[Tuple]: The remaining rows in their original order.
+    """
+    kept, kept_shingles = [], []
+    for c in context:
+        shingles = get_shingles(c[5])
+        if any(len(shingles & other) / max(min(len(shingles), len(other)), 1) >= threshold for other in kept_shingles):
+            continue
+        kept.append(c)
+        kept_shingles.append(shingles)
+    return kept
+
+
+@traced('build_prompt')
+def build_prompt(query, context, token_budget: int = config.PROMPT_TOKEN_BUDGET,
+                 stats: Optional[Dict[str, int]] = None):
+    """
+    Build a multi-shot prompt for LLM to provide more detailed and relevant answers.
+
+    The snippets are taken in the given order, which is treated as their priority. Overlapping
+    snippets are removed, then snippets are added until the token budget is reached. The last one
+    that does not fit is truncated if enough room is left, the rest is dropped.
+
+    Parameters:
+    - query (str): The user's input query string.
+    - context (List[Tuple]): The reranked context rows, highest priority first.
+    - token_budget (int, optional): Maximum number of prompt tokens. None disables the budget.
+    - stats (Dict[str, int], optional): Receives the prompt token count and how many snippets were used, truncated and dropped.
+
+    Returns:
+    - str: The prompt.
+    """
+    suffix = PROMPT_SUFFIX.format(query=query)
+    unique_context = remove_overlapping(context)
+
+    remaining = None
+    if token_budget is not None:
+        remaining = token_budget - get_static_prompt_tokens() - count_tokens(query)
+
+    # Build the context snippet references
+    snippet_texts = []
+    truncated = 0
+    for c in unique_context:
+        header = f"Context snippet:\n{get_reference(c)}\n"
+        snippet = f"{header}{c[5]}\n"
+
+        if remaining is not None:
+            # Snippets are joined by a newline
+            snippet_tokens = count_tokens(snippet) + 1
+            if snippet_tokens > remaining:
+                room = remaining - count_tokens(header) - 2
+                if room < config.PROMPT_MIN_SNIPPET_TOKENS:
+                    break
+                snippet = f"{header}{truncate_tokens(c[5], room)}\n"
+                snippet_tokens = count_tokens(snippet) + 1
+                truncated += 1
+            remaining -= snippet_tokens
+
+        snippet_texts.append(snippet)
+
+    # Combine all snippet texts
+    context_snippets = "\n".join(snippet_texts)
+
+    prompt = PROMPT_PREFIX + context_snippets + suffix
+
+    prompt_stats = {
+        'prompt_tokens': count_tokens(prompt),
+        'snippets': len(context),
+        'snippets_used': len(snippet_texts),
+        'snippets_truncated': truncated,
+        'snippets_overlapping': len(context) - len(unique_context),
+        'snippets_dropped': len(unique_context) - len(snippet_texts),
+    }
+    if stats is not None:
+        stats.update(prompt_stats)
+    set_attributes(**prompt_stats)
     return prompt
 
-def get_answer_from_gemini(query: str, context: str, source: str, api_key: str):
+@traced('get_answer_from_gemini')
+def get_answer_from_gemini(query: str, context: str, source: str, api_key: str, api_url: str = config.GEMINI_API_URL):
     """
     Calls the Google Gemini REST API with the given prompt_text.
     Returns the response as a string (if parsing is successful) or a raw JSON fallback.
+
+    The request goes through the pooled LLM session with timeouts and retries on 429/5xx.
     
     Example usage:
         response = call_gemini_api("Explain how AI works")
@@ -235,7 +801,7 @@ def get_answer_from_gemini(query: str, context: str, source: str, api_key: str):
     prompt_text = build_prompt(query, context)
     
     # Gemini Endpoint 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_key}"
+    url = f"{api_url}:generateContent?key={api_key}"
 
     # Gemini payload structure
     data = {
@@ -248,15 +814,9 @@ def get_answer_from_gemini(query: str, context: str, source: str, api_key: str):
         ]
     }
     
-    # Set headers
-    headers = {
-        "Content-Type": "application/json"
-    }
-    
     try:
         # Make the POST request
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
+        response = post_with_retries(url, json=data)
         
         # Parse the JSON response
         response_data = response.json()
@@ -274,19 +834,179 @@ def get_answer_from_gemini(query: str, context: str, source: str, api_key: str):
 
 
 # Function to query the OpenAI API
+@traced('get_answer_from_gpt')
 def get_answer_from_gpt(query: str, context: str, source: str, gpt_model: str, client) -> str:
     # Build the prompt
     prompt = build_prompt(query, context)
 
     # Create a chatbot
-    completion = client.chat.completions.create(
+    completion = call_with_retries(lambda: configure_openai_client(client).chat.completions.create(
         model=gpt_model,
         # Pre-define conversation messages for the possible roles 
         messages=[
             {"role": "user", "content": prompt},
         ]
-    )
+    ))
     response = json_repair.loads(completion.choices[0].message.content) + "\n\n" + str(source)
         
     return response
 
+
+@traced('get_hedged_answer')
+def get_hedged_answer(query: str, context: str, source: str, primary: str, gpt_model: str, client, api_key: str,
+                      budget: float = config.LLM_HEDGE_BUDGET) -> Tuple[str, Optional[str]]:
+    """
+    Asks the primary provider and, if it has not answered within the latency budget, also the other one.
+
+    Parameters:
+    - query (str): The user's input query string.
+    - context (str): The reranked context snippets.
+    - source (str): The formatted references appended at the end of the answer.
+    - primary (str): 'GPT' or 'Gemini'.
+    - gpt_model (str): The OpenAI model name.
+    - client (OpenAI): The OpenAI client.
+    - api_key (str): The Gemini API key.
+    - budget (float, optional): Seconds to wait for the primary provider before hedging.
+
+    Returns:
+    - Tuple[str, Optional[str]]: The first answer that arrives and the provider ('GPT' or 'Gemini') that
+      gave it, or HEDGED_FAILURE_MESSAGE and None if both providers fail.
+    """
+    def ask_gpt():
+        return "GPT", get_answer_from_gpt(query=query, context=context, source=source, gpt_model=gpt_model,
+                                          client=client)
+
+    def ask_gemini():
+        return "Gemini", get_answer_from_gemini(query=query, context=context, source=source, api_key=api_key)
+
+    calls = (ask_gpt, ask_gemini) if primary == "GPT" else (ask_gemini, ask_gpt)
+    calls = [run_in_context(call) for call in calls]
+    try:
+        result = hedged_call(*calls, budget=budget, is_valid=lambda result: isinstance(result[1], str))
+    except Exception as e:
+        print(f"[LLM] Both providers failed: {e}")
+        set_attributes(error=type(e).__name__)
+        return HEDGED_FAILURE_MESSAGE, None
+    if result is None or not isinstance(result[1], str):
+        return HEDGED_FAILURE_MESSAGE, None
+    set_attributes(provider=result[0])
+    return result[1], result[0]
+
+
+def stream_answer_from_gpt(query: str, context: str, source: str, gpt_model: str, client) -> Iterator[str]:
+    """
+    Streams the answer of an OpenAI chat completion token by token, followed by the references.
+
+    Parameters:
+    - query (str): The user's input query string.
+    - context (str): The reranked context snippets.
+    - source (str): The formatted references appended at the end of the answer.
+    - gpt_model (str): The OpenAI model name.
+    - client (OpenAI): The OpenAI client, its base_url can point at a local fake endpoint.
+
+    Yields:
+    - str: Pieces of the answer as they arrive.
+    """
+    with detached_span('stream_answer_from_gpt') as current:
+        prompt = build_prompt(query, context)
+
+        started = time.perf_counter()
+        stream = call_with_retries(lambda: configure_openai_client(client).chat.completions.create(
+            model=gpt_model,
+            messages=[
+                {"role": "user", "content": prompt},
+            ],
+            stream=True,
+        ))
+        chunks = 0
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not chunks:
+                    current.set(time_to_first_token_ms=(time.perf_counter() - started) * 1000)
+                chunks += 1
+                yield chunk.choices[0].delta.content
+        current.set(completion_chunks=chunks)
+
+    yield "\n\n" + str(source)
+
+
+def stream_answer_from_gemini(query: str, context: str, source: str, api_key: str,
+                              api_url: str = config.GEMINI_API_URL) -> Iterator[str]:
+    """
+    Streams the answer of the Gemini streamGenerateContent endpoint, followed by the references.
+
+    The response is requested as server-sent events and every 'data:' line is parsed as it arrives.
+
+    Parameters:
+    - query (str): The user's input query string.
+    - context (str): The reranked context snippets.
+    - source (str): The formatted references appended at the end of the answer.
+    - api_key (str): The Gemini API key.
+    - api_url (str, optional): Model endpoint without the method, can point at a local fake endpoint.
+
+    Yields:
+    - str: Pieces of the answer as they arrive.
+    """
+    with detached_span('stream_answer_from_gemini') as current:
+        prompt_text = build_prompt(query, context)
+
+        url = f"{api_url}:streamGenerateContent?alt=sse&key={api_key}"
+        data = {
+            "contents": [
+                {
+                    "parts": [
+                        {"text": prompt_text}
+                    ]
+                }
+            ]
+        }
+
+        started = time.perf_counter()
+        chunks = 0
+        try:
+            with post_with_retries(url, json=data, stream=True) as response:
+                # Server-sent events are UTF-8, requests would decode a response without charset as ISO-8859-1
+                response.encoding = 'utf-8'
+                # chunk_size=None hands over data as soon as it arrives instead of waiting for full blocks
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    # Keep-alives and partial lines are skipped like events without text
+                    try:
+                        chunk = json.loads(line[len("data:"):])
+                        text = chunk['candidates'][0]["content"]["parts"][0]["text"]
+                    except (ValueError, KeyError, IndexError, TypeError):
+                        continue
+                    if text:
+                        if not chunks:
+                            current.set(time_to_first_token_ms=(time.perf_counter() - started) * 1000)
+                        chunks += 1
+                        yield text
+        except requests.RequestException as e:
+            print(f"Gemini API request failed: {e}")
+            current.set(error=type(e).__name__)
+            yield "Gemini API request failed."
+            return
+        current.set(completion_chunks=chunks)
+
+    yield "\n\n" + source
+
+
+def measure_time_to_first_token(chunks: Iterator[str], metrics: Dict[str, float]) -> Iterator[str]:
+    """
+    Passes a token stream through while recording its latency.
+
+    Parameters:
+    - chunks (Iterator[str]): The token stream.
+    - metrics (Dict[str, float]): Receives 'time_to_first_token' and 'total_time' in seconds.
+
+    Yields:
+    - str: The chunks of the stream, unchanged.
+    """
+    started = time.perf_counter()
+    for chunk in chunks:
+        if 'time_to_first_token' not in metrics:
+            metrics['time_to_first_token'] = time.perf_counter() - started
+            print(f"[LLM] Time to first token: {metrics['time_to_first_token'] * 1000:.0f}ms")
+        yield chunk
+    metrics['total_time'] = time.perf_counter() - started
@@ -0,0 +1,105 @@
+import numpy as np
+
+from typing import Dict, Optional
+
+# Rows scored per block in the first pass, keeps the float32 copy of an int8 block in cache
+SCORE_BLOCK_ROWS = 2048
+
+# Number of set bits of every byte value, for numpy versions without np.bitwise_count
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def fit_quantizer(embeddings: np.ndarray, compression: str, pca_dim: Optional[int] = None,
+                  sample_size: int = 100000, seed: int = 0) -> Dict[str, np.ndarray]:
+    """
+    Fit the parameters of a compressed copy of row-normalized embeddings.
+
+    Embeddings are centered on their mean and, with pca_dim, projected on their first principal
+    components. 'int8' then maps every dimension linearly onto 256 levels between its 0.1 and 99.9
+    percentiles, 'binary' keeps one sign bit per dimension.
+
+    Parameters:
+    - embeddings (np.ndarray): Row-normalized float32 embedding matrix.
+    - compression (str): 'int8' or 'binary'.
+    - pca_dim (int, optional): Number of principal components kept. None keeps all dimensions.
+    - sample_size (int, optional): Maximum number of rows the mean, components and ranges are fitted on.
+    - seed (int, optional): Random seed of the sample.
+
+    Returns:
+    - Dict[str, np.ndarray]: 'mean', 'components' (one row per kept dimension) and, for 'int8', 'scale' and 'offset'.
+    """
+    if compression not in ('int8', 'binary'):
+        raise ValueError(f"Unknown compression '{compression}', expected 'int8' or 'binary'.")
+
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(embeddings), min(sample_size, len(embeddings)), replace=False))
+    sample = np.asarray(embeddings[rows], dtype=np.float32)
+    mean = sample.mean(axis=0)
+    if pca_dim:
+        _, _, vt = np.linalg.svd(sample - mean, full_matrices=False)
+        components = vt[:min(pca_dim, len(vt))].astype(np.float32)
+    else:
+        components = np.eye(sample.shape[1], dtype=np.float32)
+    quantizer = {'mean': mean, 'components': components}
+
+    if compression == 'int8':
+        projected = (sample - mean) @ components.T
+        low, high = np.percentile(projected, [0.1, 99.9], axis=0)
+        quantizer['scale'] = (np.maximum(high - low, 1e-6) / 255).astype(np.float32)
+        quantizer['offset'] = low.astype(np.float32)
+    return quantizer
+
+
+def encode(embeddings: np.ndarray, quantizer: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Compress embeddings with a fitted quantizer.
+
+    Parameters:
+    - embeddings (np.ndarray): Embedding matrix, or a block of it.
+    - quantizer (Dict[str, np.ndarray]): Parameters returned by fit_quantizer.
+
+    Returns:
+    - np.ndarray: int8 codes with one byte per kept dimension, or uint8 codes with the sign bits packed eight per byte.
+    """
+    projected = (np.asarray(embeddings, dtype=np.float32) - quantizer['mean']) @ quantizer['components'].T
+    if 'scale' in quantizer:
+        levels = np.rint((projected - quantizer['offset']) / quantizer['scale'])
+        return (np.clip(levels, 0, 255) - 128).astype(np.int8)
+    return np.packbits(projected > 0, axis=1)
+
+
+def score(codes: np.ndarray, query: np.ndarray, quantizer: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Approximate similarity of a normalized query to every compressed row, for ranking only.
+
+    int8 codes are scored by the dot product of the query with the reconstructed rows, leaving out
+    the terms shared by all rows. Binary codes are scored by the number of sign bits equal to the
+    query's, computed on the packed bytes.
+
+    Parameters:
+    - codes (np.ndarray): Codes returned by encode.
+    - query (np.ndarray): Row-normalized float32 query embedding.
+    - quantizer (Dict[str, np.ndarray]): Parameters returned by fit_quantizer.
+
+    Returns:
+    - np.ndarray: One float32 score per row, higher is more similar.
+    """
+    scores = np.empty(len(codes), dtype=np.float32)
+    if 'scale' in quantizer:
+        # q . x = q . mean + (q P^T) . (offset + scale * (code + 128)), only the code term varies
+        weights = (quantizer['components'] @ query) * quantizer['scale']
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ weights
+        return scores
+
+    query_bits = np.packbits(quantizer['components'] @ (query - quantizer['mean']) > 0)
+    n_bits = len(quantizer['components'])
+    for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+        block = np.bitwise_xor(codes[start:start + SCORE_BLOCK_ROWS], query_bits)
+        if hasattr(np, 'bitwise_count'):
+            distances = np.bitwise_count(block).sum(axis=1, dtype=np.int32)
+        else:
+            distances = _POPCOUNT[block].sum(axis=1, dtype=np.int32)
+        scores[start:start + len(block)] = n_bits - distances
+    return scores
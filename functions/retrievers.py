@@ -0,0 +1,520 @@
+import os
+import json
+import uuid
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from functions import quantization
+
+# Name of the embedding feature, returned as Neighbor.embedding rather than as a column of the row
+EMBEDDING_FEATURE = 'embeddings'
+
+
+class Neighbor(tuple):
+    """
+    A retrieved row, carrying the stored embedding of the row so that it does not have to be encoded again.
+
+    Indexing and comparison are those of the plain row, embedding is None when the retriever does not return it.
+    """
+
+    def __new__(cls, row, embedding=None):
+        neighbor = super().__new__(cls, row)
+        neighbor.embedding = embedding
+        return neighbor
+
+
+def get_neighbor_embeddings(neighbors: List[Tuple]) -> Optional[np.ndarray]:
+    """
+    Stack the stored embeddings of retrieved neighbors.
+
+    Parameters:
+    - neighbors (List[Tuple]): Rows returned by a retriever.
+
+    Returns:
+    - np.ndarray or None: One float32 embedding per neighbor, or None if any neighbor was returned without one.
+    """
+    embeddings = [getattr(neighbor, 'embedding', None) for neighbor in neighbors]
+    if not embeddings or any(embedding is None for embedding in embeddings):
+        return None
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+class FeatureViewRetriever:
+    """
+    Retriever backed by the vector index of a Hopsworks feature view.
+
+    If the feature view query selects the embedding feature, it is taken out of every returned row
+    and attached as Neighbor.embedding.
+    """
+
+    def __init__(self, feature_view):
+        """
+        Parameters:
+        - feature_view (FeatureView): The feature view for retrieving neighbors.
+        """
+        self.feature_view = feature_view
+        self.name = getattr(feature_view, 'name', str(feature_view))
+        names = [feature.name for feature in getattr(feature_view, 'features', None) or []]
+        self.embedding_position = names.index(EMBEDDING_FEATURE) if EMBEDDING_FEATURE in names else None
+        self._filters = {}
+
+    def get_filter(self, filters: Dict[str, Any]):
+        """
+        Translate equality filters with build_filter, once per distinct set of filters.
+        """
+        try:
+            key = frozenset(filters.items())
+        except TypeError:
+            return build_filter(self.feature_view, filters)
+        if key not in self._filters:
+            self._filters[key] = build_filter(self.feature_view, filters)
+        return self._filters[key]
+
+    def supports_filters(self, filters: Dict[str, Any]) -> bool:
+        """
+        Check whether the vector index can evaluate the given filters.
+        """
+        return self.get_filter(filters) is not None
+
+    def find_neighbors(self, embedding, k: int = 10, filters: Optional[Dict[str, Any]] = None) -> List[Tuple]:
+        """
+        Get the k closest neighbors of an embedding.
+
+        Parameters:
+        - embedding (np.ndarray): The query embedding.
+        - k (int, optional): Number of neighbors to retrieve. Default is 10.
+        - filters (Dict[str, Any], optional): Equality filters evaluated by the vector index.
+
+        Returns:
+        - List[Tuple]: A list of neighbor rows.
+        """
+        if not filters:
+            rows = self.feature_view.find_neighbors(
+                embedding,
+                k=k,
+            )
+        else:
+            rows = self.feature_view.find_neighbors(
+                embedding,
+                k=k,
+                filter=self.get_filter(filters),
+            )
+        if self.embedding_position is None:
+            return rows
+
+        position = self.embedding_position
+        return [
+            Neighbor(list(row[:position]) + list(row[position + 1:]), np.asarray(row[position], dtype=np.float32))
+            for row in rows
+        ]
+
+
+class LocalVectorIndex:
+    """
+    In-process retriever over a memory-mapped float32 embedding matrix.
+
+    The index lives in a directory holding 'embeddings.npy' (row-normalized float32 matrix),
+    'rows.json' (the feature view rows in the same order), 'meta.json' and 'version' (the build id).
+    When built in 'ivf' mode it also holds the k-means centroids and the inverted lists used for approximate search.
+    When built with compression, 'codes.npy' and 'quantizer.npz' hold an int8 or binary copy of the
+    embeddings that is loaded in memory and scanned first; only the shortlist it returns is read
+    from the full precision matrix and rescored.
+
+    The directory is never rewritten in place: a new build replaces it as a whole, so an open index
+    keeps searching its own files until it is reopened, see is_stale.
+    """
+
+    def __init__(self, path: str, n_probe: Optional[int] = None, rescore_factor: Optional[int] = None):
+        """
+        Parameters:
+        - path (str): Directory the index was written to with LocalVectorIndex.build.
+        - n_probe (int, optional): Number of inverted lists scanned per query in 'ivf' mode.
+        - rescore_factor (int, optional): With compression, k * rescore_factor rows are rescored at full precision.
+        """
+        self.path = path
+        # Open again if a new build was swapped in while the files were read
+        while True:
+            self.version = LocalVectorIndex.get_version(path)
+            self._open(path, n_probe, rescore_factor)
+            if LocalVectorIndex.get_version(path) == self.version:
+                break
+
+    def _open(self, path: str, n_probe: Optional[int], rescore_factor: Optional[int]):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        with open(os.path.join(path, 'rows.json')) as f:
+            self.rows = [tuple(row) for row in json.load(f)]
+
+        self.name = meta['name']
+        self.columns = meta['columns']
+        self.mode = meta['mode']
+        self.embeddings = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+        self.context_ids = meta.get('context_ids')
+        self._column_values = {}
+
+        if self.mode == 'ivf':
+            self.centroids = np.load(os.path.join(path, 'centroids.npy'))
+            self.list_order = np.load(os.path.join(path, 'list_order.npy'))
+            self.list_offsets = np.load(os.path.join(path, 'list_offsets.npy'))
+            self.n_probe = n_probe or meta['n_probe']
+
+        self.compression = meta.get('compression')
+        if self.compression:
+            self.codes = np.load(os.path.join(path, 'codes.npy'))
+            with np.load(os.path.join(path, 'quantizer.npz')) as quantizer:
+                self.quantizer = dict(quantizer)
+            self.rescore_factor = rescore_factor or meta['rescore_factor']
+
+    @staticmethod
+    def get_version(path: str) -> Optional[str]:
+        """
+        Identify the build of the index currently at path, without loading it.
+
+        Parameters:
+        - path (str): The index directory.
+
+        Returns:
+        - str or None: The build id of the index, or None if there is no index at path.
+        """
+        try:
+            with open(os.path.join(path, 'version')) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def is_stale(self) -> bool:
+        """
+        Check whether the index directory was replaced by a newer build since this index was opened.
+        """
+        version = LocalVectorIndex.get_version(self.path)
+        return version is not None and version != self.version
+
+    @staticmethod
+    def build(df: pd.DataFrame, path: str, columns: List[str], name: str, embedding_column: str = 'embeddings',
+              mode: str = 'exact', n_lists: Optional[int] = None, n_probe: int = 8, seed: int = 0,
+              embeddings: Optional[np.ndarray] = None, compression: Optional[str] = None,
+              pca_dim: Optional[int] = None, rescore_factor: int = 4) -> str:
+        """
+        Write the rows and embeddings of a feature pipeline DataFrame to a local index directory.
+
+        Parameters:
+        - df (pd.DataFrame): DataFrame with the feature view columns and an embeddings column.
+        - path (str): Output directory.
+        - columns (List[str]): Columns returned for every neighbor, in feature view order.
+        - name (str): Name of the index, usually the feature view name.
+        - embedding_column (str, optional): Column holding the embeddings. Default is 'embeddings'.
+        - mode (str, optional): 'exact' for brute force search or 'ivf' for an inverted file index. Default is 'exact'.
+        - n_lists (int, optional): Number of k-means lists in 'ivf' mode. Default is sqrt(len(df)).
+        - n_probe (int, optional): Default number of lists scanned per query in 'ivf' mode.
+        - seed (int, optional): Random seed of the k-means initialisation.
+        - embeddings (np.ndarray, optional): Embedding matrix with one row per row of df, used instead of the embeddings column.
+        - compression (str, optional): 'int8' or 'binary' to search a compressed copy first, see functions.quantization.
+        - pca_dim (int, optional): Number of principal components kept in the compressed copy. Default keeps all dimensions.
+        - rescore_factor (int, optional): Default shortlist size per neighbor rescored with compression.
+
+        Returns:
+        - str: The index directory.
+        """
+        # Write the new build next to the index and swap it in once complete, the files of the
+        # current build may be memory-mapped by a running app
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=parent)
+        try:
+            LocalVectorIndex._write(df, staging, columns, name, embedding_column, mode, n_lists, n_probe, seed,
+                                    embeddings, compression, pca_dim, rescore_factor)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        replace_directory(staging, path)
+        return path
+
+    @staticmethod
+    def _write(df, path, columns, name, embedding_column, mode, n_lists, n_probe, seed, embeddings, compression,
+               pca_dim, rescore_factor):
+        # An empty index is searched exactly, there is nothing to cluster or compress
+        if df.empty:
+            mode, compression = 'exact', None
+
+        # Write the normalized embeddings straight into a contiguous float32 file
+        vectors = embeddings
+        embeddings = np.lib.format.open_memmap(
+            os.path.join(path, 'embeddings.npy'),
+            mode='w+',
+            dtype=np.float32,
+            shape=(len(df), vectors.shape[1] if vectors is not None else len(df[embedding_column].iloc[0])),
+        )
+        if vectors is not None:
+            embeddings[:] = vectors
+        else:
+            for i, vector in enumerate(df[embedding_column]):
+                embeddings[i] = vector
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        embeddings.flush()
+
+        df[columns].to_json(os.path.join(path, 'rows.json'), orient='values')
+
+        meta = {'name': name, 'columns': columns, 'mode': mode}
+        if 'context_id' in df.columns:
+            meta['context_ids'] = [int(i) for i in df['context_id']]
+        if mode == 'ivf':
+            n_lists = n_lists or max(int(np.sqrt(len(df))), 1)
+            centroids, assignments = spherical_kmeans(np.asarray(embeddings), n_lists, seed=seed)
+            list_order = np.argsort(assignments, kind='stable')
+            list_offsets = np.searchsorted(assignments[list_order], np.arange(n_lists + 1))
+            np.save(os.path.join(path, 'centroids.npy'), centroids)
+            np.save(os.path.join(path, 'list_order.npy'), list_order)
+            np.save(os.path.join(path, 'list_offsets.npy'), list_offsets)
+            meta['n_probe'] = min(n_probe, n_lists)
+        if compression:
+            quantizer = quantization.fit_quantizer(embeddings, compression, pca_dim=pca_dim, seed=seed)
+            block_rows = quantization.SCORE_BLOCK_ROWS
+            codes = np.concatenate([quantization.encode(embeddings[i:i + block_rows], quantizer)
+                                    for i in range(0, len(embeddings), block_rows)])
+            np.save(os.path.join(path, 'codes.npy'), codes)
+            np.savez(os.path.join(path, 'quantizer.npz'), **quantizer)
+            meta.update(compression=compression, pca_dim=pca_dim, rescore_factor=rescore_factor)
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        with open(os.path.join(path, 'version'), 'w') as f:
+            f.write(uuid.uuid4().hex)
+
+    @staticmethod
+    def update(new_df: pd.DataFrame, deleted_ids: List[int], path: str, columns: List[str], name: str,
+               embedding_column: str = 'embeddings', embeddings: Optional[np.ndarray] = None, **build_kwargs) -> str:
+        """
+        Apply an incremental delta to a local index, building it if it does not exist yet.
+
+        Rows whose context_id is deleted or re-inserted are dropped, the new rows are appended and the index is rewritten.
+
+        Parameters:
+        - new_df (pd.DataFrame): New or changed rows with the feature view columns, 'context_id' and embeddings.
+        - deleted_ids (List[int]): The context ids to remove.
+        - path (str): The index directory.
+        - columns (List[str]): Columns returned for every neighbor, in feature view order.
+        - name (str): Name of the index, usually the feature view name.
+        - embedding_column (str, optional): Column holding the embeddings. Default is 'embeddings'.
+        - embeddings (np.ndarray, optional): Embedding matrix with one row per row of new_df, used instead of the embeddings column.
+        - build_kwargs: Passed on to LocalVectorIndex.build.
+
+        Returns:
+        - str: The index directory.
+        """
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            if new_df.empty and not deleted_ids:
+                return path
+
+            index = LocalVectorIndex(path)
+            if index.context_ids is None:
+                raise ValueError(f"Local index {path} was built without context ids and cannot be updated incrementally.")
+
+            dimension = index.embeddings.shape[1]
+            dropped = set(deleted_ids) | set(new_df['context_id'])
+            keep = [i for i, context_id in enumerate(index.context_ids) if context_id not in dropped]
+
+            existing_df = pd.DataFrame([index.rows[i] for i in keep], columns=index.columns)
+            if embeddings is None:
+                existing_df[embedding_column] = list(np.array(index.embeddings[keep]))
+            else:
+                embeddings = np.concatenate([np.array(index.embeddings[keep]), np.asarray(embeddings, dtype=np.float32)])
+            existing_df['context_id'] = [index.context_ids[i] for i in keep]
+            del index
+
+            new_df = pd.concat(
+                [existing_df, new_df[columns + ([embedding_column] if embeddings is None else []) + ['context_id']]],
+                ignore_index=True,
+            )
+
+            # Write an empty index rather than keep serving the deleted rows
+            if new_df.empty:
+                embeddings = np.empty((0, dimension), dtype=np.float32)
+
+        if new_df.empty and embeddings is None:
+            return path
+        return LocalVectorIndex.build(new_df, path, columns, name, embedding_column=embedding_column,
+                                      embeddings=embeddings, **build_kwargs)
+
+    def supports_filters(self, filters: Dict[str, Any]) -> bool:
+        """
+        Check whether all filtered features are stored in the index.
+        """
+        return all(name in self.columns for name in filters)
+
+    def find_neighbors(self, embedding, k: int = 10, filters: Optional[Dict[str, Any]] = None) -> List[Tuple]:
+        """
+        Get the k closest neighbors of an embedding by cosine similarity.
+
+        Parameters:
+        - embedding (np.ndarray): The query embedding.
+        - k (int, optional): Number of neighbors to retrieve. Default is 10.
+        - filters (Dict[str, Any], optional): Equality filters on the stored columns.
+
+        Returns:
+        - List[Tuple]: A list of neighbor rows, most similar first, with their normalized embeddings attached.
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        if self.mode == 'ivf':
+            candidates = self._probe(query)
+        else:
+            candidates = None
+
+        if filters:
+            mask = self._filter_mask(filters)
+            candidates = np.flatnonzero(mask) if candidates is None else candidates[mask[candidates]]
+
+        if self.compression:
+            # Shortlist on the compressed codes, then rank the shortlist by exact similarity
+            codes = self.codes if candidates is None else self.codes[candidates]
+            shortlist = top_k(quantization.score(codes, query, self.quantizer), k * self.rescore_factor)
+            candidates = np.sort(shortlist if candidates is None else candidates[shortlist])
+
+        if candidates is None:
+            scores = self.embeddings @ query
+            ids = top_k(scores, k)
+        else:
+            scores = self.embeddings[candidates] @ query
+            ids = candidates[top_k(scores, k)]
+
+        vectors = np.array(self.embeddings[ids])
+        return [Neighbor(self.rows[i], vector) for i, vector in zip(ids, vectors)]
+
+    def _probe(self, query: np.ndarray) -> np.ndarray:
+        lists = top_k(self.centroids @ query, self.n_probe)
+        return np.sort(np.concatenate(
+            [self.list_order[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists]
+        ))
+
+    def _filter_mask(self, filters: Dict[str, Any]) -> np.ndarray:
+        mask = np.ones(len(self.rows), dtype=bool)
+        for name, value in filters.items():
+            if name not in self._column_values:
+                column = self.columns.index(name)
+                self._column_values[name] = np.array([row[column] for row in self.rows], dtype=object)
+            mask &= self._column_values[name] == value
+        return mask
+
+
+def replace_directory(source: str, path: str):
+    """
+    Move a complete directory to path, replacing the directory there.
+
+    Each step is a rename, so path holds either the old or the new directory, never a partly written one.
+    Processes that memory-mapped files of the old directory keep reading them until they reopen path.
+
+    Parameters:
+    - source (str): The directory to move, on the same file system as path.
+    - path (str): The destination.
+    """
+    if not os.path.exists(path):
+        os.rename(source, path)
+        return
+
+    retired = f"{path}.{uuid.uuid4().hex}.old"
+    os.rename(path, retired)
+    os.rename(source, path)
+    shutil.rmtree(retired, ignore_errors=True)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Return the positions of the k highest scores, highest first.
+
+    Parameters:
+    - scores (np.ndarray): One-dimensional array of scores.
+    - k (int): Number of positions to return.
+
+    Returns:
+    - np.ndarray: Positions of the top-k scores in descending score order.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    ids = np.argpartition(-scores, k - 1)[:k]
+    return ids[np.argsort(-scores[ids], kind='stable')]
+
+
+def spherical_kmeans(embeddings: np.ndarray, n_lists: int, n_iter: int = 20, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cluster row-normalized embeddings by cosine similarity.
+
+    Parameters:
+    - embeddings (np.ndarray): Row-normalized embedding matrix.
+    - n_lists (int): Number of clusters.
+    - n_iter (int, optional): Number of Lloyd iterations. Default is 20.
+    - seed (int, optional): Random seed of the initial centroids.
+
+    Returns:
+    - Tuple[np.ndarray, np.ndarray]: The normalized centroids and the cluster of every row.
+    """
+    rng = np.random.default_rng(seed)
+    n_lists = min(n_lists, len(embeddings))
+    centroids = embeddings[rng.choice(len(embeddings), n_lists, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignments = np.argmax(embeddings @ centroids.T, axis=1)
+        for i in range(n_lists):
+            members = embeddings[assignments == i]
+            if len(members):
+                centroids[i] = members.sum(axis=0)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    assignments = np.argmax(embeddings @ centroids.T, axis=1)
+    return centroids, assignments
+
+
+def build_filter(feature_view, filters: Dict[str, Any]):
+    """
+    Translate equality filters into a hsfs filter that the vector index can evaluate.
+
+    Parameters:
+    - feature_view (FeatureView): The feature view the filter is meant for.
+    - filters (Dict[str, Any]): Mapping of feature name to required value.
+
+    Returns:
+    - Filter or None: The combined filter, or None if the feature view cannot filter on all of the features.
+    """
+    # The features of the view know the feature group they are selected from
+    try:
+        features = {feature.name: feature for feature in feature_view.features}
+        conditions = [
+            features[name].feature_group.get_feature(name) == value
+            for name, value in filters.items()
+        ]
+    except Exception:
+        return None
+
+    combined = conditions[0]
+    for condition in conditions[1:]:
+        combined = combined & condition
+    return combined
+
+
+# Retrievers of the feature views wrapped so far, by id of the feature view they hold
+_RETRIEVERS: Dict[int, FeatureViewRetriever] = {}
+
+
+def get_retriever(feature_view):
+    """
+    Wrap a Hopsworks feature view in a retriever, retrievers are returned unchanged.
+
+    The retriever of a feature view is created once and reused by later lookups.
+
+    Parameters:
+    - feature_view (FeatureView or retriever): The feature view or an object already implementing find_neighbors/supports_filters.
+
+    Returns:
+    - The retriever.
+    """
+    if hasattr(feature_view, 'supports_filters'):
+        return feature_view
+    retriever = _RETRIEVERS.get(id(feature_view))
+    if retriever is None or retriever.feature_view is not feature_view:
+        retriever = _RETRIEVERS[id(feature_view)] = FeatureViewRetriever(feature_view)
+    return retriever
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+
+from typing import Iterable, Optional
+
+import config
+
+
+class SemanticCache:
+    """
+    Cache of answered queries looked up by embedding similarity.
+
+    An entry is returned for a new query when its cosine similarity to a previously answered query
+    reaches the threshold and both were answered by the same model against the same index version.
+    Entries are persisted in SQLite, expire after ttl seconds, are evicted least recently used beyond
+    max_entries and are dropped when one of the context ids they were answered from is invalidated.
+    """
+
+    def __init__(self, path: Optional[str] = config.SEMANTIC_CACHE_PATH, threshold: float = config.SEMANTIC_CACHE_THRESHOLD,
+                 ttl: float = config.SEMANTIC_CACHE_TTL, max_entries: int = config.SEMANTIC_CACHE_MAX_ENTRIES):
+        """
+        Parameters:
+        - path (str, optional): SQLite file holding the entries. None keeps the cache in memory only.
+        - threshold (float, optional): Minimum cosine similarity for a hit.
+        - ttl (float, optional): Lifetime of an entry in seconds.
+        - max_entries (int, optional): Maximum number of entries kept.
+        """
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path or ':memory:', check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, model TEXT NOT NULL, index_version TEXT NOT NULL, "
+            "query TEXT NOT NULL, embedding BLOB NOT NULL, answer TEXT NOT NULL, context_ids TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.commit()
+        self._load()
+
+    def _load(self) -> None:
+        rows = self._connection.execute(
+            "SELECT id, model, index_version, embedding, context_ids, created_at, last_used FROM answers"
+        ).fetchall()
+        self._ids = [row[0] for row in rows]
+        self._keys = [(row[1], row[2]) for row in rows]
+        self._context_ids = [set(json.loads(row[4])) for row in rows]
+        self._created_at = np.array([row[5] for row in rows], dtype=np.float64)
+        self._last_used = {row[0]: row[6] for row in rows}
+
+        # One embedding matrix per model, index version and dimension, only the matching one is searched
+        positions = {}
+        for position, row in enumerate(rows):
+            positions.setdefault((row[1], row[2], len(row[3]) // 4), []).append(position)
+        self._groups = {
+            key: (np.array(group), np.vstack([np.frombuffer(rows[i][3], dtype=np.float32) for i in group]))
+            for key, group in positions.items()
+        }
+
+        # Changes whenever another connection commits to the file, such as an invalidation by the feature pipeline
+        self._data_version = self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def _refresh(self) -> None:
+        if self._connection.execute("PRAGMA data_version").fetchone()[0] != self._data_version:
+            self._load()
+
+    def lookup(self, query_embedding: np.ndarray, model: str, index_version: str) -> Optional[str]:
+        """
+        Returns the stored answer of the most similar previously answered query, if similar enough.
+
+        Parameters:
+        - query_embedding (np.ndarray): Embedding of the incoming query.
+        - model (str): The selected LLM, answers of other models never match.
+        - index_version (str): Version of the indexes answered from, answers of other versions never match.
+
+        Returns:
+        - str or None: The cached answer including its references, or None on a miss.
+        """
+        query = normalize(query_embedding)
+        with self._lock:
+            self._refresh()
+            self._expire()
+            group = self._groups.get((model, index_version, len(query)))
+            if group is None:
+                self.misses += 1
+                return None
+
+            positions, embeddings = group
+            similarities = embeddings @ query
+            best = int(np.argmax(similarities))
+
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entry_id = self._ids[positions[best]]
+            row = self._connection.execute("SELECT answer FROM answers WHERE id = ?", (entry_id,)).fetchone()
+            if row is None:
+                # Deleted through another connection since the entries were loaded
+                self._load()
+                self.misses += 1
+                return None
+
+            answer, = row
+            self._last_used[entry_id] = time.time()
+            self._connection.execute("UPDATE answers SET last_used = ? WHERE id = ?", (self._last_used[entry_id], entry_id))
+            self._connection.commit()
+            self.hits += 1
+            return answer
+
+    def put(self, query: str, query_embedding: np.ndarray, model: str, index_version: str, answer: str,
+            context_ids: Iterable[int]) -> None:
+        """
+        Stores an answer.
+
+        Parameters:
+        - query (str): The answered query.
+        - query_embedding (np.ndarray): Embedding of the query.
+        - model (str): The LLM that produced the answer.
+        - index_version (str): Version of the indexes the context was retrieved from.
+        - answer (str): The answer including its references.
+        - context_ids (Iterable[int]): Ids of the contexts the answer was generated from.
+        """
+        embedding = normalize(query_embedding)
+        context_ids = sorted(int(i) for i in context_ids)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO answers (model, index_version, query, embedding, answer, context_ids, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (model, index_version, query, embedding.tobytes(), answer, json.dumps(context_ids), now, now),
+            )
+            self._evict()
+            self._connection.commit()
+            self._load()
+
+    def invalidate_context_ids(self, context_ids: Iterable[int]) -> int:
+        """
+        Drops every entry that was answered from one of the given contexts.
+
+        Parameters:
+        - context_ids (Iterable[int]): Ids of deleted or changed contexts.
+
+        Returns:
+        - int: Number of dropped entries.
+        """
+        context_ids = set(int(i) for i in context_ids)
+        with self._lock:
+            self._refresh()
+            stale = [entry_id for entry_id, ids in zip(self._ids, self._context_ids) if ids & context_ids]
+            self._delete(stale)
+            return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._refresh()
+            self._delete(self._ids)
+            self.hits = 0
+            self.misses = 0
+
+    def _expire(self) -> None:
+        if not self._ids:
+            return
+        expired = [self._ids[i] for i in np.flatnonzero(self._created_at < time.time() - self.ttl)]
+        self._delete(expired)
+
+    def _evict(self) -> None:
+        self._connection.execute(
+            "DELETE FROM answers WHERE id NOT IN (SELECT id FROM answers ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def _delete(self, entry_ids) -> None:
+        if not entry_ids:
+            return
+        self._connection.executemany("DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id in entry_ids])
+        self._connection.commit()
+        self._load()
+
+
+def normalize(embedding: np.ndarray) -> np.ndarray:
+    embedding = np.asarray(embedding, dtype=np.float32)
+    return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import threading
+
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import config
+
+
+class StartupTimer:
+    """
+    Records how long every phase of the app start takes, from the first import to the moment all models are ready.
+    """
+
+    def __init__(self, started: float = None, log_path: Optional[str] = config.STARTUP_LOG_PATH):
+        """
+        Parameters:
+        - started (float, optional): time.perf_counter() value at which the start began. Default is now.
+        - log_path (str, optional): JSON-lines file the phase durations are appended to once the app is ready.
+        """
+        self.started = started if started is not None else time.perf_counter()
+        self.log_path = log_path
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            if phase in self.phases:
+                return
+            self.phases[phase] = seconds
+        print(f"[STARTUP] {phase}: {seconds * 1000:.0f}ms")
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        yield
+        self.record(name, time.perf_counter() - started)
+
+    def mark(self, name: str) -> None:
+        """
+        Records the time elapsed since the start of the app under the given phase name.
+        """
+        self.record(name, time.perf_counter() - self.started)
+
+    def save(self) -> None:
+        """
+        Appends the recorded phases as one JSON line, so cold start times can be compared across releases.
+        """
+        if not self.log_path:
+            return
+        if os.path.dirname(self.log_path):
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        with self._lock:
+            line = json.dumps({'time': time.time(), 'phases_ms': {k: v * 1000 for k, v in self.phases.items()}})
+        with open(self.log_path, 'a') as f:
+            f.write(line + '\n')
+
+
+def start_in_background(fn: Callable, timer: StartupTimer, phase: str, background: bool = True) -> Future:
+    """
+    Runs fn on its own thread and times it as a startup phase.
+
+    Parameters:
+    - fn (Callable): The loader to run.
+    - timer (StartupTimer): Receives the duration of the phase.
+    - phase (str): Name of the phase.
+    - background (bool, optional): Run fn on its own thread. False runs it right away and returns a completed future.
+
+    Returns:
+    - Future: Resolves to the result of fn, callers block on it until the resource is ready.
+    """
+    def run():
+        with timer.phase(phase):
+            return fn()
+
+    if not background:
+        future = Future()
+        try:
+            future.set_result(run())
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    # One short-lived thread per loader, the executor does not keep any thread alive afterwards
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"startup-{phase}")
+    future = executor.submit(run)
+    executor.shutdown(wait=False)
+    return future
+
+
+def when_all_done(futures: Dict[str, Future], callback: Callable[[], None]) -> None:
+    """
+    Calls callback once every future has finished, whether it succeeded or not.
+    """
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            callback()
+
+    for future in futures.values():
+        future.add_done_callback(done)
+
+
+def warm_up_sentence_transformer(sentence_transformer) -> None:
+    """
+    Runs one encode call, so lazy initialisation does not slow down the first query.
+    """
+    sentence_transformer.encode("warm up")
+
+
+def warm_up_reranker(reranker) -> None:
+    """
+    Runs one compute_score call, so lazy initialisation does not slow down the first query.
+    """
+    reranker.compute_score([["warm up", "warm up"]])
@@ -0,0 +1,224 @@
+import time
+import queue
+import threading
+
+from typing import Any, Callable, Iterable, List, Optional
+
+import config
+
+# Marks the end of the stream on a stage queue, one per worker of the stage
+_DONE = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class Stage:
+    """
+    One step of a StreamingPipeline, run by its own pool of worker threads.
+
+    fn maps one input item to an iterable of output items, so a stage can drop items, pass them on
+    or fan them out, e.g. one PDF into batches of pages. Generators are consumed as they yield, so
+    downstream stages start on the first pages while the rest are still being extracted.
+    """
+
+    def __init__(self, name: str, fn: Callable[[Any], Iterable], workers: int = 1,
+                 queue_size: int = config.INGEST_QUEUE_SIZE, unit: str = "items",
+                 size: Optional[Callable[[Any], int]] = None):
+        """
+        Parameters:
+        - name (str): Name of the stage in progress lines.
+        - fn (Callable): Maps an input item to an iterable of output items.
+        - workers (int, optional): Number of worker threads.
+        - queue_size (int, optional): Maximum number of items waiting for this stage, a full queue blocks the stage before.
+        - unit (str, optional): What size counts, e.g. 'pages' or 'chunks'.
+        - size (Callable, optional): Number of units in an output item, or in an input item of the last stage.
+          Default counts every item as one.
+        """
+        self.name = name
+        self.fn = fn
+        self.workers = max(workers, 1)
+        self.queue_size = queue_size
+        self.unit = unit
+        self.size = size or (lambda item: 1)
+        self.processed = 0
+        self.produced = 0
+        self.units = 0
+        self.busy = 0.0
+        self.active = 0
+        self._finished = 0
+        self._lock = threading.Lock()
+
+    def get_stats(self, elapsed: float) -> dict:
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'processed': self.processed,
+            'produced': self.produced,
+            'units': self.units,
+            'unit': self.unit,
+            'busy_seconds': self.busy,
+            'units_per_s': self.units / max(elapsed, 1e-9),
+            # Share of the run the workers of this stage spent working rather than waiting
+            'utilization': self.busy / max(elapsed * self.workers, 1e-9),
+        }
+
+
+class StreamingPipeline:
+    """
+    Runs items through a chain of stages concurrently, connected by bounded queues.
+
+    A slow stage fills the queue in front of it, which blocks the stages before it, so memory stays
+    bounded however large the input. The first error in any stage stops all stages and is raised by run.
+    """
+
+    def __init__(self, name: str, stages: List[Stage], progress_interval: Optional[float] = config.INGEST_PROGRESS_INTERVAL):
+        """
+        Parameters:
+        - name (str): Name of the pipeline in progress lines.
+        - stages (List[Stage]): The stages, in order.
+        - progress_interval (float, optional): Seconds between two progress lines, None prints only the summary.
+        """
+        self.name = name
+        self.stages = stages
+        self.progress_interval = progress_interval
+        self.stats = []
+        self._queues = []
+        self._stop = threading.Event()
+        self._errors = []
+        self._started = None
+
+    def _put(self, q: queue.Queue, item) -> None:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise _Stopped()
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        raise _Stopped()
+
+    def _fail(self, e: Exception) -> None:
+        self._errors.append(e)
+        self._stop.set()
+
+    def _feed(self, items: Iterable) -> None:
+        try:
+            for item in items:
+                self._put(self._queues[0], item)
+            for _ in range(self.stages[0].workers):
+                self._put(self._queues[0], _DONE)
+        except _Stopped:
+            pass
+        except Exception as e:
+            self._fail(e)
+
+    def _work(self, index: int) -> None:
+        stage = self.stages[index]
+        next_queue = self._queues[index + 1] if index + 1 < len(self.stages) else None
+        try:
+            while True:
+                item = self._get(self._queues[index])
+                if item is _DONE:
+                    break
+
+                with stage._lock:
+                    stage.active += 1
+                started = time.perf_counter()
+                try:
+                    for output in stage.fn(item):
+                        # Time spent blocked on a full queue is not work of this stage
+                        with stage._lock:
+                            stage.busy += time.perf_counter() - started
+                            stage.produced += 1
+                            if next_queue is not None:
+                                stage.units += stage.size(output)
+                        if next_queue is not None:
+                            self._put(next_queue, output)
+                        started = time.perf_counter()
+                    with stage._lock:
+                        stage.busy += time.perf_counter() - started
+                        if next_queue is None:
+                            stage.units += stage.size(item)
+                finally:
+                    with stage._lock:
+                        stage.active -= 1
+                        stage.processed += 1
+
+            with stage._lock:
+                stage._finished += 1
+                last = stage._finished == stage.workers
+            # The last worker of a stage to finish ends the stream of the next stage
+            if last and next_queue is not None:
+                for _ in range(self.stages[index + 1].workers):
+                    self._put(next_queue, _DONE)
+        except _Stopped:
+            pass
+        except Exception as e:
+            print(f"[PIPELINE] {self.name}: stage '{stage.name}' failed: {e!r}")
+            self._fail(e)
+
+    def format_progress(self) -> str:
+        elapsed = time.perf_counter() - self._started
+        return f"[PIPELINE] {self.name} {elapsed:.0f}s | " + " | ".join(
+            f"{stage.name} {stage.units} {stage.unit} ({stage.units / max(elapsed, 1e-9):.1f}/s, "
+            f"{stage.active}/{stage.workers} busy, {queue_.qsize()} queued)"
+            for stage, queue_ in zip(self.stages, self._queues)
+        )
+
+    def _report(self) -> None:
+        while not self._stop.wait(self.progress_interval):
+            print(self.format_progress())
+
+    def run(self, items: Iterable) -> List[dict]:
+        """
+        Streams items through all stages and waits until every item is processed.
+
+        Parameters:
+        - items (Iterable): Input items of the first stage, consumed lazily.
+
+        Returns:
+        - List[dict]: Per-stage statistics, see Stage.get_stats.
+        """
+        self._queues = [queue.Queue(maxsize=max(stage.queue_size, 1)) for stage in self.stages]
+        self._started = time.perf_counter()
+
+        threads = [threading.Thread(target=self._feed, args=(items,), name=f"{self.name}-feed", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads.extend(
+                threading.Thread(target=self._work, args=(index,), name=f"{self.name}-{stage.name}-{i}", daemon=True)
+                for i in range(stage.workers)
+            )
+        for thread in threads:
+            thread.start()
+
+        reporter = None
+        if self.progress_interval:
+            reporter = threading.Thread(target=self._report, name=f"{self.name}-progress", daemon=True)
+            reporter.start()
+
+        for thread in threads:
+            thread.join()
+        self._stop.set()
+        if reporter is not None:
+            reporter.join()
+
+        elapsed = time.perf_counter() - self._started
+        self.stats = [stage.get_stats(elapsed) for stage in self.stages]
+        print(f"[PIPELINE] {self.name} {'failed' if self._errors else 'finished'} in {elapsed:.1f}s")
+        for stats in self.stats:
+            print(f"[PIPELINE]   {stats['stage']:<10} {stats['processed']:>6} in {stats['produced']:>6} out "
+                  f"{stats['units']:>8} {stats['unit']:<8} {stats['units_per_s']:>9.1f}/s "
+                  f"{stats['utilization']:>6.0%} busy")
+
+        if self._errors:
+            raise self._errors[0]
+        return self.stats
@@ -1,5 +1,14 @@
+import hashlib
 import pandas as pd
-from typing import List
+from typing import List, Optional
+
+from functions.dedup import find_near_duplicates
+from functions.chunking import chunk_text_data
+
+import config
+
+# Columns of the chunks of every source, as stored in the feature groups
+CHUNK_COLUMNS = ['name', 'url', 'source', 'page_number', 'paragraph', 'text', 'year', 'timestamp']
 
 def split_page(document: str) -> List[str]:
     """
@@ -14,6 +23,46 @@ def split_page(document: str) -> List[str]:
     return document.split('\n \n')
 
 
+def get_chunk_id(name: str, source: str, page_number: int, paragraph: int, text: str) -> int:
+    """
+    Derives a stable chunk identifier from where the chunk comes from and what it contains.
+
+    The same chunk always gets the same id across pipeline runs, a changed text gets a new one.
+
+    Parameters:
+    - name (str): File or company name of the chunk.
+    - source (str): Source of the chunk, e.g. 'stanford_report'.
+    - page_number (int): Page the chunk was extracted from.
+    - paragraph (int): Paragraph index within the page.
+    - text (str): The chunk text.
+
+    Returns:
+    - int: A non-negative 63-bit integer usable as a bigint primary key.
+    """
+    key = '|'.join(str(value) for value in (name, source, page_number, paragraph, text))
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') >> 1
+
+
+def add_context_ids(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds a 'context_id' column holding the stable chunk id of every row and drops exact duplicate chunks.
+
+    Parameters:
+    - df (pd.DataFrame): DataFrame with 'name', 'source', 'page_number', 'paragraph' and 'text' columns.
+
+    Returns:
+    - pd.DataFrame: The DataFrame with an added 'context_id' column.
+    """
+    df = df.copy()
+    df['context_id'] = [
+        get_chunk_id(*row)
+        for row
+        in df[['name', 'source', 'page_number', 'paragraph', 'text']].itertuples(index=False)
+    ]
+    return df.drop_duplicates('context_id').reset_index(drop=True)
+
+
 def get_paragraphs(data: pd.DataFrame) -> pd.DataFrame:
     """
     Explodes the 'text' column in the DataFrame, adds a 'paragraph' column indicating the index
@@ -41,16 +90,26 @@ def get_paragraphs(data: pd.DataFrame) -> pd.DataFrame:
     return data_text_exploded
 
 
-def process_text_data(df: pd.DataFrame) -> pd.DataFrame:
+def process_text_data(df: pd.DataFrame, dedup: Optional[str] = config.INGEST_DEDUP,
+                      chunker: str = config.CHUNKER) -> pd.DataFrame:
     """
-    Processes text data by applying the split_page, get_paragraphs functions.
+    Processes text data into chunks, with the token chunker or by applying the split_page, get_paragraphs functions.
 
     Parameters:
     - df (pd.DataFrame): The input DataFrame containing 'file_name' and 'text' columns.
+    - dedup (str, optional): Drop paragraphs nearly duplicating an earlier one, such as repeated headers
+      and footers, with 'simhash' or 'minhash'. None keeps them.
+    - chunker (str, optional): 'token' merges and splits paragraphs to uniform token sizes with chunk_text_data,
+      'paragraph' keeps every paragraph above 300 characters as one chunk.
 
     Returns:
     - pd.DataFrame: The processed DataFrame with 'file_name', 'page_number', 'paragraph', and 'text' columns.
     """
+    if chunker == "token":
+        return remove_near_duplicates(chunk_text_data(df), dedup)
+    if chunker != "paragraph":
+        raise ValueError(f"Unknown chunker '{chunker}', expected 'token' or 'paragraph'")
+
     # Apply split_page function to split text into paragraphs
     df['text'] = df['text'].apply(split_page)
 
@@ -69,7 +128,21 @@ def process_text_data(df: pd.DataFrame) -> pd.DataFrame:
     # Remove rows matching the pattern
     df_filtered = df[~df['text'].str.contains(pattern_to_remove, regex=True)]
 
+    # Remove near-duplicate paragraphs, keeping the first occurrence
+    df_filtered = remove_near_duplicates(df_filtered, dedup)
+
     # Reset index
     df_filtered.reset_index(drop=True, inplace=True)
 
     return df_filtered
+
+
+def remove_near_duplicates(df: pd.DataFrame, dedup: Optional[str] = config.INGEST_DEDUP) -> pd.DataFrame:
+    """
+    Drops rows whose 'text' nearly duplicates an earlier one, with 'simhash' or 'minhash'. None keeps them.
+    """
+    if dedup is None:
+        return df
+    duplicates = find_near_duplicates(df['text'].tolist(), method=dedup)
+    print(f"[DEDUP] Removed {duplicates.sum()} of {len(df)} paragraphs as near-duplicates ({dedup})")
+    return df[~duplicates].reset_index(drop=True)
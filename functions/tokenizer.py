@@ -0,0 +1,78 @@
+import re
+from functools import lru_cache
+from typing import List
+
+import config
+
+# Appended to a text cut in the middle of a sentence
+TRUNCATION_MARK = ' ...'
+
+
+class ApproximateTokenizer:
+    """
+    Whitespace tokenizer used when tiktoken is not installed.
+
+    Every word with its trailing whitespace is one token, which slightly underestimates
+    the count of a BPE tokenizer but keeps encode/decode lossless.
+    """
+
+    def encode(self, text: str) -> List[str]:
+        return re.findall(r'\s*\S+\s*', text)
+
+    def decode(self, tokens: List[str]) -> str:
+        return ''.join(tokens)
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(encoding: str = config.PROMPT_TOKENIZER):
+    """
+    Returns a local tokenizer with encode/decode, tiktoken if it is installed.
+
+    Parameters:
+    - encoding (str, optional): The tiktoken encoding name.
+
+    Returns:
+    - The tokenizer.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return ApproximateTokenizer()
+    return tiktoken.get_encoding(encoding)
+
+
+def count_tokens(text: str, encoding: str = config.PROMPT_TOKENIZER) -> int:
+    """
+    Counts the tokens of a text with the local tokenizer.
+    """
+    return len(get_tokenizer(encoding).encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int, encoding: str = config.PROMPT_TOKENIZER) -> str:
+    """
+    Cuts a text to at most max_tokens tokens, preferring to end at a sentence boundary.
+
+    Parameters:
+    - text (str): The text to cut.
+    - max_tokens (int): Maximum number of tokens to keep.
+    - encoding (str, optional): The tiktoken encoding name.
+
+    Returns:
+    - str: The truncated text, unchanged if it already fits.
+    """
+    tokenizer = get_tokenizer(encoding)
+    tokens = tokenizer.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+
+    truncated = tokenizer.decode(tokens[:max_tokens])
+    # Prefer a cut at the end of a sentence if that keeps most of the text
+    end = max(truncated.rfind('. '), truncated.rfind('.\n'))
+    if end > len(truncated) // 2:
+        return truncated[:end + 1]
+
+    # Leave room for the mark, so the marked text still fits in max_tokens
+    mark_tokens = len(tokenizer.encode(TRUNCATION_MARK))
+    if max_tokens <= mark_tokens:
+        return tokenizer.decode(tokens[:max_tokens])
+    return tokenizer.decode(tokens[:max_tokens - mark_tokens]).rstrip() + TRUNCATION_MARK
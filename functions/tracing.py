@@ -0,0 +1,316 @@
+import os
+import json
+import time
+import threading
+import contextvars
+import functools
+
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_sinks = []
+
+
+class Span:
+    """
+    A timed operation with attributes such as candidate counts, token counts and cache hits.
+    """
+
+    __slots__ = ('name', 'attributes', 'start', 'duration', 'children')
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self.children = []
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'start': self.start,
+            'duration_ms': self.duration * 1000 if self.duration is not None else None,
+            'attributes': self.attributes,
+            'children': [child.to_dict() for child in self.children],
+        }
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+class NoopSpan:
+    """
+    Returned while tracing is disabled, so instrumented code never has to check.
+    """
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def add_sink(sink) -> None:
+    """
+    Registers a sink; every finished root span is passed to sink.emit(span). Tracing is disabled while no sink is registered.
+    """
+    _sinks.append(sink)
+
+
+def remove_sinks() -> None:
+    _sinks.clear()
+
+
+def is_enabled() -> bool:
+    return bool(_sinks)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the enclosed block as a span, nested under the current span if there is one.
+
+    Spans started in the block nest under this one. Do not use it across a yield, see detached_span.
+
+    Parameters:
+    - name (str): Name of the operation.
+    - attributes: Initial span attributes.
+
+    Yields:
+    - Span: The span, attributes can be added with span.set(...).
+    """
+    yield from _run_span(name, attributes, make_current=True)
+
+
+@contextmanager
+def detached_span(name: str, **attributes):
+    """
+    Times the enclosed block as a span nested under the current span, without making it the current span.
+
+    Meant for generators: a span made current inside a generator would stay current in the caller
+    while the generator is suspended, and could not be reset when the generator is closed from
+    another context.
+
+    Parameters:
+    - name (str): Name of the operation.
+    - attributes: Initial span attributes.
+
+    Yields:
+    - Span: The span, attributes can be added with span.set(...).
+    """
+    yield from _run_span(name, attributes, make_current=False)
+
+
+def _run_span(name: str, attributes: Dict[str, Any], make_current: bool):
+    if not _sinks:
+        yield NOOP_SPAN
+        return
+
+    parent = _current_span.get()
+    current = Span(name, attributes)
+    if parent is not None:
+        parent.children.append(current)
+
+    token = _current_span.set(current) if make_current else None
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        if token is not None:
+            _current_span.reset(token)
+        if parent is None:
+            for sink in list(_sinks):
+                sink.emit(current)
+
+
+def set_attributes(**attributes) -> None:
+    """
+    Adds attributes to the current span, does nothing outside of a span.
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator running every call of the function in a span.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _sinks:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def run_in_context(fn: Callable) -> Callable:
+    """
+    Binds fn to a copy of the current context, so spans created in a worker thread nest under the caller's span.
+    """
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)
+
+
+class JsonLinesSink:
+    """
+    Appends every finished request as one JSON line.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def emit(self, root: Span) -> None:
+        line = json.dumps(root.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+
+class MetricsRegistry:
+    """
+    In-process Prometheus-style registry: a call counter and a duration histogram per span name,
+    and a counter per numeric span attribute.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.calls = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.duration_sum = defaultdict(float)
+        self.duration_buckets = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self.attribute_totals = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def emit(self, root: Span) -> None:
+        with self._lock:
+            for current in root.walk():
+                # A detached span whose generator was not consumed before its root finished
+                if current.duration is None:
+                    continue
+                self.calls[current.name] += 1
+                if 'error' in current.attributes:
+                    self.errors[current.name] += 1
+                self.duration_sum[current.name] += current.duration
+                self.duration_buckets[current.name][bisect_left(self.buckets, current.duration)] += 1
+                for key, value in current.attributes.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        self.attribute_totals[(current.name, key)] += value
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """
+        Returns one row per span name with its calls, errors and mean duration in ms.
+        """
+        with self._lock:
+            return [
+                {
+                    'span': name,
+                    'calls': count,
+                    'errors': self.errors[name],
+                    'mean_ms': self.duration_sum[name] / count * 1000,
+                }
+                for name, count in sorted(self.calls.items())
+            ]
+
+    def render(self) -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            '# TYPE assistant_span_calls_total counter',
+            '# TYPE assistant_span_errors_total counter',
+            '# TYPE assistant_span_duration_seconds histogram',
+            '# TYPE assistant_span_attribute_total counter',
+        ]
+        with self._lock:
+            for name, count in sorted(self.calls.items()):
+                lines.append(f'assistant_span_calls_total{{span="{name}"}} {count}')
+                lines.append(f'assistant_span_errors_total{{span="{name}"}} {self.errors[name]}')
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + (float('inf'),), self.duration_buckets[name]):
+                    cumulative += bucket
+                    le = '+Inf' if bound == float('inf') else bound
+                    lines.append(f'assistant_span_duration_seconds_bucket{{span="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'assistant_span_duration_seconds_sum{{span="{name}"}} {self.duration_sum[name]}')
+                lines.append(f'assistant_span_duration_seconds_count{{span="{name}"}} {count}')
+            for (name, key), total in sorted(self.attribute_totals.items()):
+                lines.append(f'assistant_span_attribute_total{{span="{name}",attribute="{key}"}} {total}')
+        return '\n'.join(lines) + '\n'
+
+
+class RecentTraces:
+    """
+    Keeps the last max_traces requests in memory, e.g. for the Streamlit sidebar panel.
+    """
+
+    def __init__(self, max_traces: int = 20):
+        self.traces = deque(maxlen=max_traces)
+
+    def emit(self, root: Span) -> None:
+        self.traces.append(root)
+
+    def breakdown(self, root: Span) -> List[Dict[str, Any]]:
+        """
+        Flattens a trace into rows of depth, name, duration in ms and attributes.
+        """
+        rows = []
+
+        def visit(current: Span, depth: int):
+            rows.append({
+                'depth': depth,
+                'name': current.name,
+                'duration_ms': current.duration * 1000,
+                'attributes': current.attributes,
+            })
+            for child in current.children:
+                if child.duration is not None:
+                    visit(child, depth + 1)
+
+        visit(root, 0)
+        return rows
+
+
+def configure_tracing(jsonl_path: Optional[str] = None, metrics: bool = False,
+                      recent: int = 0) -> Dict[str, Any]:
+    """
+    Registers the configured sinks, replacing the registered ones.
+
+    Parameters:
+    - jsonl_path (str, optional): Append finished requests to this JSON-lines file.
+    - metrics (bool, optional): Keep a Prometheus-style MetricsRegistry.
+    - recent (int, optional): Keep the last `recent` requests in a RecentTraces sink.
+
+    Returns:
+    - Dict[str, Any]: The registered sinks by kind ('jsonl', 'metrics', 'recent').
+    """
+    remove_sinks()
+    sinks = {}
+    if jsonl_path:
+        sinks['jsonl'] = JsonLinesSink(jsonl_path)
+    if metrics:
+        sinks['metrics'] = MetricsRegistry()
+    if recent:
+        sinks['recent'] = RecentTraces(recent)
+    for sink in sinks.values():
+        add_sink(sink)
+    return sinks
@@ -0,0 +1,466 @@
+"""
+Streaming ingestion runner: download -> extract -> chunk -> embed -> insert.
+
+The Stanford reports and the EQT X portfolio run concurrently, each as a chain of stages with
+their own workers, connected by bounded queues. Pages are embedded and inserted while later pages
+are still being extracted. Every finished unit of work (INGEST_PAGES_PER_UNIT pages of a report, or
+one company) is checkpointed once its chunks are written, so a rerun after a crash resumes from the
+last checkpoint. Only chunks missing from the manifest of the previous run are embedded and inserted.
+With RETRIEVER_BACKEND = "local", the local vector index of every source is updated after a complete run.
+
+With INGEST_DEDUP set, near-duplicates are removed within each unit of work, while the feature pipeline
+notebook removes them across the whole corpus. The two then produce different chunks, so a feature group
+version must be ingested by one of them only: alternating would delete and re-insert chunks on every run.
+
+Usage (from the repository root):
+    python -m pipelines.ingest
+    python -m pipelines.ingest --sources stanford_reports --extract-workers 8
+    python -m pipelines.ingest --sink parquet --output data/ingest
+"""
+import os
+import sys
+import glob
+import time
+import uuid
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+
+from functions.streaming import Stage, StreamingPipeline
+from functions.pdf_preprocess import download_pdf, extract_page_range
+from functions.company_data import HostRateLimiter, fetch_company_website_text
+from functions.text_preprocess import add_context_ids
+from functions.incremental import (
+    load_manifest, save_manifest, delete_chunks, load_checkpoint, save_checkpoint, remove_checkpoint,
+)
+from functions.bulk_insert import to_arrow_table, FeatureGroupSink, ParquetSink
+from functions.embeddings import EmbeddingService
+from functions.parallel_encoding import ParallelEncoder
+from functions.inference_backends import get_model_id
+from functions.retrievers import LocalVectorIndex, EMBEDDING_FEATURE
+from pipelines.stanford_reports import get_reports_chunks
+from pipelines.portfolio_companies import get_portfolio_chunks
+
+import config
+
+SOURCES = {
+    "stanford_reports": {
+        "version": config.STANFORD_REPORTS_VERSION,
+        "description": "Stanford AI report.",
+        "view_description": "Stanford reports for RAG system",
+        "view_columns": ["name", "url", "source", "page_number", "paragraph", "text", "year", "embeddings"],
+    },
+    "eqt_portfolio": {
+        "version": config.EQT_PORTFOLIO_VERSION,
+        "description": "EQT portfolio companies.",
+        "view_description": "Text data from EQT portfolio companies for RAG system",
+        "view_columns": ["name", "url", "source", "page_number", "paragraph", "text", "embeddings"],
+    },
+}
+
+
+def get_manifest_name(source: str) -> str:
+    return f"{source}_{SOURCES[source]['version']}"
+
+
+def get_local_staging_path(name: str, checkpoint_path: str = config.INGEST_CHECKPOINT_PATH) -> str:
+    return os.path.join(checkpoint_path, f"{name}.local")
+
+
+def get_feature_group(fs, source: str, dimension: int):
+    """
+    Gets or creates the feature group of a source, with the schema of the feature pipeline notebook.
+    """
+    from hsfs import embedding
+    from hsfs.feature import Feature
+
+    embedding_index = embedding.EmbeddingIndex()
+    embedding_index.add_embedding("embeddings", dimension)
+
+    feature_group = fs.get_or_create_feature_group(
+        name=source,
+        version=SOURCES[source]["version"],
+        description=SOURCES[source]["description"],
+        primary_key=['context_id'],
+        online_enabled=True,
+        embedding_index=embedding_index,
+    )
+    if feature_group.id is None:
+        feature_group.save([
+            Feature(name='name', type='string', online_type='varchar(100)'),
+            Feature(name='url', type='string', online_type='varchar(100)'),
+            Feature(name='source', type='string', online_type='varchar(100)'),
+            Feature(name='page_number', type='bigint', online_type='bigint'),
+            Feature(name='paragraph', type='bigint', online_type='bigint'),
+            Feature(name='text', type='string', online_type='VARCHAR(5900)'),
+            Feature(name='year', type='bigint', online_type='bigint'),
+            Feature(name='timestamp', type='timestamp', online_type='timestamp'),
+            Feature(name='embeddings', type='array<float>', online_type='varbinary(100)'),
+            Feature(name='context_id', type='bigint', online_type='bigint'),
+        ])
+    return feature_group
+
+
+class CheckpointedWriter:
+    """
+    Buffers embedded chunks up to batch_rows rows for the sink, and checkpoints the units of work whose
+    chunks are written. A unit interrupted before its checkpoint is redone by the next run, and since
+    chunks are upserted by context_id, writing it twice is harmless.
+
+    With a staging_path, every written batch is also kept there as a Parquet file, until a complete
+    run applies the batches of all its attempts to the local vector index.
+    """
+
+    def __init__(self, sink, name: str, checkpoint: Dict[str, Set], batch_rows: int = config.INSERT_BATCH_ROWS,
+                 checkpoint_path: str = config.INGEST_CHECKPOINT_PATH, staging_path: Optional[str] = None):
+        self.sink = sink
+        self.name = name
+        self.checkpoint = checkpoint
+        self.batch_rows = batch_rows
+        self.checkpoint_path = checkpoint_path
+        self.staging_path = staging_path
+        self.rows = 0
+        self._keys, self._seen_ids, self._frames, self._embeddings = [], set(), [], []
+
+    def add(self, key: str, df: pd.DataFrame, embeddings: np.ndarray, seen_ids: Set[int]) -> None:
+        self._keys.append(key)
+        self._seen_ids.update(seen_ids)
+        if len(df):
+            self._frames.append(df)
+            self._embeddings.append(embeddings)
+
+        buffered = sum(len(frame) for frame in self._frames)
+        # Units without new chunks are checkpointed right away
+        if buffered >= self.batch_rows or buffered == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._frames:
+            df = pd.concat(self._frames, ignore_index=True)
+            table = to_arrow_table(df, np.vstack(self._embeddings))
+            self.sink.write(table)
+            if self.staging_path is not None:
+                import pyarrow.parquet as pq
+
+                # One complete file per batch, a crash never leaves a partial one behind
+                os.makedirs(self.staging_path, exist_ok=True)
+                pq.write_table(table, os.path.join(self.staging_path, f"{uuid.uuid4().hex}.parquet"))
+            self.rows += len(df)
+            self.checkpoint['inserted_ids'].update(int(i) for i in df['context_id'])
+
+        if self._keys:
+            self.checkpoint['completed'].update(self._keys)
+            self.checkpoint['seen_ids'].update(self._seen_ids)
+            save_checkpoint(self.name, self.checkpoint, self.checkpoint_path)
+        self._keys, self._seen_ids, self._frames, self._embeddings = [], set(), [], []
+
+
+def update_local_index(source: str, staging_path: str, deleted_ids: List[int], seen_ids: Set[int], dimension: int,
+                       index_path: str = config.LOCAL_INDEX_PATH) -> int:
+    """
+    Applies the chunks staged by a complete run, including its interrupted attempts, and its deletions
+    to the local vector index of a source.
+
+    Parameters:
+    - source (str): Feature group name, a key of SOURCES.
+    - staging_path (str): Directory of the batches staged by CheckpointedWriter.
+    - deleted_ids (List[int]): The context ids that disappeared upstream.
+    - seen_ids (Set[int]): The context ids of all chunks of the run.
+    - dimension (int): Embedding dimension, for a run without new chunks.
+    - index_path (str, optional): Directory holding the local indexes.
+
+    Returns:
+    - int: Number of chunks written to the local index.
+    """
+    import pyarrow.parquet as pq
+
+    columns = [column for column in SOURCES[source]["view_columns"] if column != EMBEDDING_FEATURE]
+    frames, embeddings = [], []
+    for file in sorted(glob.glob(os.path.join(staging_path, '*.parquet'))):
+        df = pq.read_table(file).to_pandas()
+        embeddings.append(np.vstack(df.pop(EMBEDDING_FEATURE)).astype(np.float32))
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns + ['context_id'])
+    embeddings = np.vstack(embeddings) if embeddings else np.empty((0, dimension), dtype=np.float32)
+
+    # A unit redone after a crash is staged twice, with the same chunks
+    keep = (~df['context_id'].duplicated(keep='last') & df['context_id'].isin(seen_ids)).to_numpy()
+    LocalVectorIndex.update(
+        df[keep].reset_index(drop=True),
+        deleted_ids,
+        embeddings=embeddings[keep],
+        path=os.path.join(index_path, source),
+        columns=columns,
+        name=source,
+        mode=config.LOCAL_INDEX_MODE,
+        compression=config.LOCAL_INDEX_COMPRESSION,
+        pca_dim=config.LOCAL_INDEX_PCA_DIM,
+        rescore_factor=config.LOCAL_INDEX_RESCORE_FACTOR,
+    )
+    return int(keep.sum())
+
+
+def get_reports_stages(checkpoint: Dict[str, Set], failures: List[str], executor: ProcessPoolExecutor,
+                       download_workers: int, pages_per_unit: int) -> List[Stage]:
+    """
+    Download and extract stages of the Stanford reports, yielding (unit key, page rows) per unit of pages.
+    """
+    def download(url):
+        pdf_path = os.path.join(config.DOWNLOAD_PATH, url.split('/')[-1])
+        if download_pdf(url, pdf_path):
+            yield url, pdf_path
+        else:
+            failures.append(url)
+
+    def extract(item):
+        import PyPDF2
+
+        url, pdf_path = item
+        file_title = Path(pdf_path).stem
+        pages_amount = len(PyPDF2.PdfReader(pdf_path).pages)
+        units = [(start, min(start + pages_per_unit, pages_amount)) for start in range(0, pages_amount, pages_per_unit)]
+        pending = [(start, end) for start, end in units if f"{url}#{start}" not in checkpoint['completed']]
+        print(f"[INGEST] {file_title}: {pages_amount} pages, {len(units) - len(pending)} of {len(units)} units done before")
+
+        # The shared process pool extracts the units of all reports, map yields them in page order
+        results = executor.map(
+            extract_page_range,
+            [pdf_path] * len(pending),
+            [start for start, _ in pending],
+            [end for _, end in pending],
+        )
+        for (start, _), pages in zip(pending, results):
+            yield f"{url}#{start}", [[file_title, url, page_number, text] for page_number, text, _ in pages]
+
+    return [
+        Stage("download", download, workers=download_workers, unit="reports"),
+        Stage("extract", extract, workers=2, unit="pages", size=lambda item: len(item[1])),
+        Stage("chunk", lambda item: [(item[0], add_context_ids(get_reports_chunks(item[1])))],
+              workers=2, unit="chunks", size=lambda item: len(item[1])),
+    ]
+
+
+def get_portfolio_stages(failures: List[str], fetch_workers: int) -> List[Stage]:
+    """
+    Fetch stage of the EQT X portfolio, yielding (unit key, company data) per company.
+    """
+    rate_limiter = HostRateLimiter()
+
+    def fetch(item):
+        name, urls = item
+        urls = [urls] if isinstance(urls, str) else list(urls)
+        texts = [fetch_company_website_text(url, rate_limiter=rate_limiter) for url in urls]
+        if not any(texts):
+            failures.append(name)
+            return
+        yield name, [{
+            "company_name": name,
+            "url": urls[0],
+            "text": '\n \n'.join(text for text in texts if text),
+            "source": "EQT_X_Portfolio",
+        }]
+
+    return [
+        Stage("fetch", fetch, workers=fetch_workers, unit="companies"),
+        Stage("chunk", lambda item: [(item[0], add_context_ids(get_portfolio_chunks(item[1])))],
+              unit="chunks", size=lambda item: len(item[1])),
+    ]
+
+
+def ingest_source(source: str, items: List, front_stages: List[Stage], embedding_service, sink, feature_group,
+                  checkpoint: Dict[str, Set], failures: List[str], batch_rows: int = config.INSERT_BATCH_ROWS,
+                  queue_size: int = config.INGEST_QUEUE_SIZE,
+                  progress_interval: Optional[float] = config.INGEST_PROGRESS_INTERVAL,
+                  manifest_path: str = config.MANIFEST_PATH,
+                  checkpoint_path: str = config.INGEST_CHECKPOINT_PATH,
+                  local_index_path: Optional[str] = None) -> dict:
+    """
+    Streams the units of one source through its front stages, embedding and insertion.
+
+    After a complete run, chunks that disappeared upstream are deleted, the manifest is replaced and
+    the checkpoint removed. A run with failed downloads keeps its checkpoint and deletes nothing, so
+    the next run retries only what failed. With a local_index_path, the local vector index is updated
+    with the same inserts and deletions before the manifest is replaced.
+
+    Parameters:
+    - source (str): Feature group name, a key of SOURCES.
+    - items (List): Input items of the first front stage.
+    - front_stages (List[Stage]): Stages turning the items into (unit key, chunks DataFrame).
+    - embedding_service (EmbeddingService): Encodes the new chunks.
+    - sink (FeatureGroupSink or ParquetSink): Receives the embedded chunks.
+    - feature_group (FeatureGroup, optional): Feature group to delete chunks from, None skips deletions.
+    - checkpoint (Dict[str, Set]): Progress of earlier interrupted runs, as returned by load_checkpoint.
+    - failures (List[str]): Appended to by the front stages for every item that failed.
+    - batch_rows (int, optional): Rows per sink write.
+    - queue_size (int, optional): Maximum number of items between two stages.
+    - progress_interval (float, optional): Seconds between two progress lines.
+    - manifest_path (str, optional): Directory holding the manifests.
+    - checkpoint_path (str, optional): Directory holding the checkpoints.
+    - local_index_path (str, optional): Directory holding the local indexes, None leaves them unchanged.
+
+    Returns:
+    - dict: Rows inserted, ids deleted, failures and per-stage statistics.
+    """
+    name = get_manifest_name(source)
+    indexed_ids = load_manifest(name, manifest_path)
+    known_ids = indexed_ids | checkpoint['inserted_ids']
+    staging_path = get_local_staging_path(name, checkpoint_path) if local_index_path is not None else None
+    writer = CheckpointedWriter(sink, name, checkpoint, batch_rows, checkpoint_path, staging_path)
+    dimension = embedding_service.get_sentence_embedding_dimension()
+
+    def embed(item):
+        key, df = item
+        new_df = df[~df['context_id'].isin(known_ids)].reset_index(drop=True)
+        embeddings = embedding_service.encode(new_df['text']) if len(new_df) else np.empty((0, dimension), dtype=np.float32)
+        yield key, new_df, embeddings, set(int(i) for i in df['context_id'])
+
+    def insert(item):
+        writer.add(*item)
+        return []
+
+    for stage in front_stages:
+        stage.queue_size = queue_size
+    stages = front_stages + [
+        Stage("embed", embed, queue_size=queue_size, unit="chunks", size=lambda item: len(item[1])),
+        Stage("insert", insert, queue_size=queue_size, unit="chunks", size=lambda item: len(item[1])),
+    ]
+
+    pipeline = StreamingPipeline(source, stages, progress_interval)
+    try:
+        stats = pipeline.run(items)
+    except Exception:
+        # Checkpoint the units finished before the error, the next run resumes after them
+        writer.flush()
+        raise
+    else:
+        writer.flush()
+    finally:
+        sink.close()
+
+    result = {'source': source, 'inserted': writer.rows, 'deleted': 0, 'failures': list(failures), 'stages': stats}
+    if failures:
+        print(f"[INGEST] {source}: {len(failures)} inputs failed, keeping the checkpoint and skipping deletions: "
+              + ', '.join(failures))
+        return result
+
+    deleted_ids = sorted(indexed_ids - checkpoint['seen_ids'])
+    if feature_group is not None:
+        delete_chunks(feature_group, deleted_ids)
+    if local_index_path is not None:
+        update_local_index(source, staging_path, deleted_ids, checkpoint['seen_ids'], dimension, local_index_path)
+    save_manifest(name, checkpoint['seen_ids'], manifest_path)
+    remove_checkpoint(name, checkpoint_path)
+    if staging_path is not None:
+        shutil.rmtree(staging_path, ignore_errors=True)
+    result['deleted'] = len(deleted_ids)
+    result['deleted_ids'] = deleted_ids
+    print(f"[INGEST] {source}: {writer.rows} chunks inserted, {len(deleted_ids)} deleted, "
+          f"{len(checkpoint['seen_ids'])} indexed")
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sources', nargs='+', choices=list(SOURCES), default=list(SOURCES))
+    parser.add_argument('--sink', choices=['hopsworks', 'parquet'], default='hopsworks',
+                        help='parquet writes the chunks to local files, with its own manifests and checkpoints.')
+    parser.add_argument('--output', default='data/ingest', help='Directory of the parquet sink.')
+    parser.add_argument('--restart', action='store_true', help='Discard the checkpoints of interrupted runs.')
+    parser.add_argument('--download-workers', type=int, default=config.DOWNLOAD_WORKERS)
+    parser.add_argument('--extract-workers', type=int, default=config.PDF_EXTRACT_WORKERS,
+                        help='Processes extracting PDF pages, shared by all reports.')
+    parser.add_argument('--fetch-workers', type=int, default=config.CRAWL_WORKERS)
+    parser.add_argument('--encode-processes', type=int, default=config.ENCODE_PROCESSES)
+    parser.add_argument('--pages-per-unit', type=int, default=config.INGEST_PAGES_PER_UNIT)
+    parser.add_argument('--queue-size', type=int, default=config.INGEST_QUEUE_SIZE)
+    parser.add_argument('--batch-rows', type=int, default=config.INSERT_BATCH_ROWS)
+    parser.add_argument('--progress-interval', type=float, default=config.INGEST_PROGRESS_INTERVAL)
+    parser.add_argument('--local-index', action=argparse.BooleanOptionalAction,
+                        default=config.RETRIEVER_BACKEND == "local",
+                        help='Update the local vector indexes. Default is on with RETRIEVER_BACKEND = "local".')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    if args.sink == 'parquet':
+        manifest_path = os.path.join(args.output, 'manifest')
+        checkpoint_path = os.path.join(args.output, 'checkpoints')
+        local_index_path = os.path.join(args.output, 'index')
+    else:
+        manifest_path, checkpoint_path = config.MANIFEST_PATH, config.INGEST_CHECKPOINT_PATH
+        local_index_path = config.LOCAL_INDEX_PATH
+    if not args.local_index:
+        local_index_path = None
+
+    encoder = ParallelEncoder(config.MODEL_SENTENCE_TRANSFORMER, processes=args.encode_processes)
+    embedding_service = EmbeddingService(encoder, get_model_id(config.MODEL_SENTENCE_TRANSFORMER))
+    dimension = embedding_service.get_sentence_embedding_dimension()
+
+    fs = None
+    if args.sink == 'hopsworks':
+        import hopsworks
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        fs = hopsworks.login().get_feature_store()
+
+    def run(source: str, executor: ProcessPoolExecutor) -> dict:
+        name = get_manifest_name(source)
+        if args.restart:
+            remove_checkpoint(name, checkpoint_path)
+            shutil.rmtree(get_local_staging_path(name, checkpoint_path), ignore_errors=True)
+        checkpoint = load_checkpoint(name, checkpoint_path)
+        failures = []
+
+        if source == "stanford_reports":
+            items = config.REPORTS_URLS
+            front_stages = get_reports_stages(checkpoint, failures, executor, args.download_workers, args.pages_per_unit)
+        else:
+            items = [(company, urls) for company, urls in config.EQT_X_COMPANY_URLS.items()
+                     if company not in checkpoint['completed']]
+            front_stages = get_portfolio_stages(failures, args.fetch_workers)
+
+        if fs is not None:
+            feature_group = get_feature_group(fs, source, dimension)
+            sink = FeatureGroupSink(feature_group)
+        else:
+            feature_group = None
+            sink = ParquetSink(os.path.join(args.output, f"{name}.{time.strftime('%Y%m%d%H%M%S')}.parquet"))
+
+        result = ingest_source(source, items, front_stages, embedding_service, sink, feature_group, checkpoint,
+                               failures, args.batch_rows, args.queue_size, args.progress_interval,
+                               manifest_path, checkpoint_path, local_index_path)
+        if fs is not None and not failures:
+            fs.get_or_create_feature_view(
+                name=source,
+                version=SOURCES[source]["version"],
+                description=SOURCES[source]["view_description"],
+                query=feature_group.select(SOURCES[source]["view_columns"]),
+            )
+        return result
+
+    try:
+        with ProcessPoolExecutor(max_workers=max(args.extract_workers, 1)) as executor, \
+                ThreadPoolExecutor(max_workers=len(args.sources)) as sources:
+            futures = [sources.submit(run, source, executor) for source in args.sources]
+            results = [future.result() for future in futures]
+    finally:
+        encoder.close()
+
+    # Answers generated from deleted or changed chunks are no longer valid
+    deleted_ids = [context_id for result in results for context_id in result.get('deleted_ids', [])]
+    if fs is not None and deleted_ids:
+        from functions.semantic_cache import SemanticCache
+
+        SemanticCache().invalidate_context_ids(deleted_ids)
+
+    print(f"[INGEST] Finished in {time.perf_counter() - started:.1f}s")
+    return 1 if any(result['failures'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,31 @@
 import os
 import pandas as pd
 
+from typing import Dict, List
+
 from functions.company_data import gather_portfolio_data
-from functions.text_preprocess import process_text_data
+from functions.text_preprocess import process_text_data, CHUNK_COLUMNS
 
 import config
 
 def get_portfolio_df():
     portfolio_data = gather_portfolio_data(config.EQT_X_COMPANY_URLS)
+    return get_portfolio_chunks(portfolio_data)
+
+
+def get_portfolio_chunks(portfolio_data: List[Dict]) -> pd.DataFrame:
+    """
+    Turns scraped portfolio company texts into paragraph chunks with the feature group columns.
+
+    Parameters:
+    - portfolio_data (List[Dict]): One dict with 'company_name', 'url', 'text' and 'source' per company, as returned by gather_portfolio_data.
+
+    Returns:
+    - pd.DataFrame: One row per paragraph with the CHUNK_COLUMNS columns.
+    """
+    if not portfolio_data:
+        return pd.DataFrame(columns=CHUNK_COLUMNS)
+
     columns = ["company_name", "url", "source", "text"]
     portfolio_data_df = pd.DataFrame(
         data=portfolio_data,
@@ -21,6 +39,5 @@ def get_portfolio_df():
     
     # Reorder columns and rename
     portfolio_data_filtered = portfolio_data_filtered[['company_name', 'url', 'source', 'page_number', 'paragraph', 'text', 'year', 'timestamp']]
-    portfolio_data_filtered.columns = ['name', 'url', 'source', 'page_number', 'paragraph', 'text', 'year', 'timestamp']
+    portfolio_data_filtered.columns = CHUNK_COLUMNS
     return portfolio_data_filtered
-    
\ No newline at end of file
@@ -2,12 +2,14 @@ import os
 import PyPDF2
 import pandas as pd
 
+from typing import List
+
 from functions.pdf_preprocess import (
     download_stanford_ai_reports, 
     process_pdf_file,
     extract_year_regex
 )
-from functions.text_preprocess import process_text_data
+from functions.text_preprocess import process_text_data, CHUNK_COLUMNS
 
 import config
 
@@ -15,7 +17,23 @@ def get_reports_df():
     ai_report_text = []    
     
     download_stanford_ai_reports(urls = config.REPORTS_URLS, ai_report_text = ai_report_text, pdfs_path = config.DOWNLOAD_PATH)
-    
+
+    return get_reports_chunks(ai_report_text)
+
+
+def get_reports_chunks(ai_report_text: List) -> pd.DataFrame:
+    """
+    Turns extracted report pages into paragraph chunks with the feature group columns.
+
+    Parameters:
+    - ai_report_text (List): [file_name, file_link, page_number, text] for every page, as yielded by iter_pdf_pages.
+
+    Returns:
+    - pd.DataFrame: One row per paragraph with the CHUNK_COLUMNS columns.
+    """
+    if not ai_report_text:
+        return pd.DataFrame(columns=CHUNK_COLUMNS)
+
     # Create a DataFrame
     columns = ["file_name", "file_link", "page_number", "text"]
     ai_report_text_df = pd.DataFrame(
@@ -24,7 +42,6 @@ def get_reports_df():
     )
     
     ai_report_text_df["year"] = ai_report_text_df["file_name"].apply(extract_year_regex).astype(str).astype(int)
-    ai_report_text_df
     ai_report_text_df["timestamp"] = pd.to_datetime(ai_report_text_df["year"].astype(str) + "-12-31")
     
     # Process text data using the process_text_data function
@@ -33,6 +50,6 @@ def get_reports_df():
     
     # Reorder columns and rename
     ai_report_text_processed_df  = ai_report_text_processed_df[['file_name', 'file_link', 'source', 'page_number', 'paragraph', 'text', 'year', 'timestamp']]
-    ai_report_text_processed_df.columns = ['name', 'url', 'source', 'page_number', 'paragraph', 'text', 'year', 'timestamp']
+    ai_report_text_processed_df.columns = CHUNK_COLUMNS
 
-    return ai_report_text_processed_df
\ No newline at end of file
+    return ai_report_text_processed_df